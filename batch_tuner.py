@@ -0,0 +1,235 @@
+import os
+import gc
+import json
+import time
+import hashlib
+import platform
+import contextlib
+import numpy as np
+import torch
+from torch.utils.data import default_collate
+from scheduler import available_memory_gb
+from telemetry import current_rss_mb
+
+# Per-device batch sizes probed, in increasing order
+BATCH_SIZES = (1, 2, 4, 8, 16, 32, 64)
+
+def machine_key():
+    """Short hash of what bounds the batch size: CPU, cores, memory and GPU"""
+    memory = None
+    try:
+        memory = os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 1024 ** 3
+    except (ValueError, OSError, AttributeError):
+        pass
+    parts = [platform.machine(), platform.processor(), str(os.cpu_count()), str(memory)]
+    if torch.cuda.is_available():
+        props = torch.cuda.get_device_properties(0)
+        parts += [props.name, str(props.total_memory)]
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:12]
+
+def is_out_of_memory(error):
+    return isinstance(error, MemoryError) or (
+        isinstance(error, RuntimeError) and 'out of memory' in str(error).lower()
+    )
+
+class BatchTuner:
+    """Pick the per-device batch size and gradient accumulation of a model
+    
+    Short probes run full training steps (forward, backward and an AdamW
+    step with learning rate 0, so the weights do not change) on the longest
+    features of the training set at increasing batch sizes. Probing stops at
+    the first batch size that runs out of memory, that is predicted not to
+    fit in the available RAM on CPU, or whose throughput drops clearly below
+    the best so far. The fastest batch size that fits is used, with gradient
+    accumulation keeping the effective batch size of the settings.
+    
+    Probe results are cached in a JSON file per (model name and config,
+    machine, max_length, precision), so later runs skip the probes.
+    """
+    
+    def __init__(self, cache_path='./batch_tuning.json', probe_steps=3, batch_sizes=BATCH_SIZES,
+                 memory_fraction=0.8, slowdown=0.9):
+        self.cache_path = cache_path
+        self.probe_steps = probe_steps
+        self.batch_sizes = tuple(sorted(batch_sizes))
+        self.memory_fraction = memory_fraction
+        self.slowdown = slowdown
+    
+    def cache_key(self, model, max_length, precision):
+        name = getattr(model, 'name_or_path', None) or type(model).__name__
+        # Students share the teacher's name_or_path, the config tells them apart
+        config = getattr(model, 'config', None)
+        architecture = type(model).__name__ if config is None else config.to_json_string(use_diff=False)
+        config_hash = hashlib.sha1(architecture.encode('utf-8')).hexdigest()[:12]
+        return f"{name}|{config_hash}|{machine_key()}|{max_length}|{precision}"
+    
+    def load_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable batch tuning cache {self.cache_path}: {str(e)}")
+            return {}
+    
+    def save_cache(self, key, entry):
+        if not self.cache_path:
+            return
+        # Re-read first, other workers may have tuned other models meanwhile
+        cache = self.load_cache()
+        cache[key] = entry
+        directory = os.path.dirname(os.path.abspath(self.cache_path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=4)
+        os.replace(tmp_path, self.cache_path)
+    
+    def probe_batch(self, dataset, collator, batch_size, device):
+        """The batch_size longest training features, collated like the Trainer does"""
+        order = np.argsort(-np.asarray(dataset.lengths), kind='stable')[:batch_size]
+        batch = (collator or default_collate)([dataset[int(i)] for i in order])
+        return {key: value.to(device) for key, value in batch.items()}
+    
+    def probe(self, model, batch, precision, device):
+        """Training samples per second at one batch size
+        
+        Also returns the largest resident set size in MB seen right after a
+        forward pass, when the activations are alive (None if unknown).
+        """
+        optimizer = torch.optim.AdamW(model.parameters(), lr=0.0)
+        if precision in ('fp16', 'bf16'):
+            autocast = torch.autocast(device.type, dtype=torch.float16 if precision == 'fp16' else torch.bfloat16)
+        else:
+            autocast = contextlib.nullcontext()
+        
+        timings = []
+        rss_mb = None
+        try:
+            # The first step allocates the optimizer state and is not timed
+            for step in range(self.probe_steps + 1):
+                start = time.perf_counter()
+                with autocast:
+                    loss = model(**batch).loss
+                current = current_rss_mb()
+                if current is not None:
+                    rss_mb = max(rss_mb or 0.0, current)
+                loss.backward()
+                optimizer.step()
+                optimizer.zero_grad(set_to_none=True)
+                if device.type == 'cuda':
+                    torch.cuda.synchronize()
+                if step:
+                    timings.append(time.perf_counter() - start)
+        finally:
+            loss = None
+            optimizer = None
+            model.zero_grad(set_to_none=True)
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        
+        return len(batch['input_ids']) / float(np.median(timings)), rss_mb
+    
+    def run_probes(self, model, dataset, collator, precision, device, max_batch_size):
+        """Probe increasing batch sizes up to max_batch_size
+        
+        Returns ({batch size: samples/sec, or None if it did not fit}, whether
+        probing stopped before max_batch_size because larger batches would not
+        fit or run faster).
+        """
+        probes = {}
+        memory_mb = {}  # RSS growth over the pre-probe level, per batch size
+        best = 0.0
+        model.to(device)
+        model.train()
+        if getattr(model, 'supports_gradient_checkpointing', False):
+            # Trained with gradient checkpointing, so probe with it too
+            model.gradient_checkpointing_enable()
+        
+        for batch_size in self.batch_sizes:
+            if batch_size > max(max_batch_size, self.batch_sizes[0]):
+                break
+            
+            # On CPU running out of memory kills the process, so stop before
+            # a batch whose memory growth, extrapolated linearly from the
+            # last two probes (or proportionally from one), does not fit
+            if device.type != 'cuda' and memory_mb:
+                sizes = sorted(memory_mb)[-2:]
+                if len(sizes) == 2 and sizes[1] > sizes[0]:
+                    slope = (memory_mb[sizes[1]] - memory_mb[sizes[0]]) / (sizes[1] - sizes[0])
+                    # Memory the allocator kept from the last probe hides growth
+                    slope = max(slope, memory_mb[sizes[1]] / sizes[1] / 2)
+                else:
+                    slope = memory_mb[sizes[-1]] / sizes[-1]
+                needed_gb = (memory_mb[sizes[-1]] + slope * (batch_size - sizes[-1])) / 1024
+                available = available_memory_gb()
+                if available is not None and needed_gb > available * self.memory_fraction:
+                    print(f"Batch size {batch_size} predicted not to fit in {available:.1f} GB of free memory")
+                    probes[batch_size] = None
+                    return probes, True
+            
+            try:
+                rss_before = current_rss_mb()
+                samples_per_sec, rss_during = self.probe(
+                    model, self.probe_batch(dataset, collator, batch_size, device), precision, device
+                )
+            except Exception as e:
+                if not is_out_of_memory(e):
+                    raise
+                print(f"Batch size {batch_size} ran out of memory")
+                probes[batch_size] = None
+                return probes, True
+            
+            probes[batch_size] = samples_per_sec
+            if rss_before is not None and rss_during is not None:
+                memory_mb[batch_size] = max(rss_during - rss_before, 0.0)
+            print(f"Batch size {batch_size}: {samples_per_sec:.1f} samples/sec")
+            if samples_per_sec < best * self.slowdown:
+                return probes, True
+            best = max(best, samples_per_sec)
+        
+        return probes, False
+    
+    def choose(self, probes, effective_batch_size):
+        """(batch size, gradient accumulation) from probe results
+        
+        Batch sizes that divide the effective batch size are preferred, so
+        it stays exactly the same.
+        """
+        fitting = {batch_size: samples_per_sec for batch_size, samples_per_sec in probes.items()
+                   if samples_per_sec is not None and batch_size <= max(effective_batch_size, 1)}
+        exact = {batch_size: samples_per_sec for batch_size, samples_per_sec in fitting.items()
+                 if effective_batch_size % batch_size == 0}
+        fitting = exact or fitting
+        if not fitting:
+            return 1, max(1, effective_batch_size)
+        batch_size = max(fitting, key=fitting.get)
+        return batch_size, max(1, round(effective_batch_size / batch_size))
+    
+    def tune(self, model_name, model, dataset, collator, precision, effective_batch_size, device):
+        """Tuned (batch size, gradient accumulation) of a model, from the cache if possible"""
+        key = self.cache_key(model, dataset.max_length, precision)
+        entry = self.load_cache().get(key)
+        
+        # A cached entry serves any effective batch size it probed up to
+        if entry is None or entry['probed_up_to'] < min(effective_batch_size, self.batch_sizes[-1]):
+            print(f"Probing training batch sizes for {model_name}...")
+            start = time.perf_counter()
+            probes, stopped = self.run_probes(model, dataset, collator, precision, device, effective_batch_size)
+            entry = {
+                'probes': {str(batch_size): samples_per_sec for batch_size, samples_per_sec in probes.items()},
+                # Larger batches are not worth probing once one did not fit or ran slower
+                'probed_up_to': self.batch_sizes[-1] if stopped else max(effective_batch_size, max(probes)),
+                'seconds': time.perf_counter() - start
+            }
+            self.save_cache(key, entry)
+        
+        batch_size, grad_accum = self.choose(
+            {int(batch_size): samples_per_sec for batch_size, samples_per_sec in entry['probes'].items()},
+            effective_batch_size
+        )
+        print(f"Tuned {model_name}: batch size {batch_size} x {grad_accum} accumulation steps "
+              f"(effective {batch_size * grad_accum})")
+        return batch_size, grad_accum
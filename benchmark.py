@@ -0,0 +1,273 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from collections import Counter
+import numpy as np
+import pandas as pd
+import torch
+from transformers import BertConfig, BertForQuestionAnswering, BertTokenizerFast
+from data_preparation import DataPreparator
+from evaluation import Evaluator
+from generate_tourism_guides import tourism_guides
+from models import QADataset
+from telemetry import peak_rss_mb
+
+STAGES = [
+    'create_qa_pairs',
+    'prepare_tourism_data',
+    'find_answer_span',
+    'dataset_getitem',
+    'find_best_answer',
+    'compute_metrics',
+    'evaluate_model'
+]
+
+def synthetic_guides(n_guides, sentences_per_guide=5, seed=0):
+    """Guide texts mixed from the sentences of the generate_tourism_guides templates
+    
+    Every guide draws random template sentences and replaces their numbers
+    with random ones, so QA pairs of different guides rarely collide.
+    """
+    rng = random.Random(seed)
+    preparator = DataPreparator()
+    sentences = [sentence for guide in tourism_guides
+                 for sentence in preparator.custom_sentence_split(guide['text'])]
+    
+    guides = []
+    for _ in range(n_guides):
+        picked = rng.sample(sentences, min(sentences_per_guide, len(sentences)))
+        picked = [re.sub(r'\d+', lambda m: str(rng.randint(1, 2000)), sentence) for sentence in picked]
+        guides.append(' '.join(picked))
+    return guides
+
+def tiny_tokenizer(texts, vocab_dir, vocab_size=2000):
+    """Word-level BERT tokenizer built from the corpus, so nothing is downloaded"""
+    counts = Counter(word for text in texts for word in re.findall(r'\w+|[^\w\s]', text.lower()))
+    vocab = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]']
+    vocab += [word for word, _ in counts.most_common(vocab_size - len(vocab))]
+    
+    vocab_file = os.path.join(vocab_dir, 'vocab.txt')
+    with open(vocab_file, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(vocab) + '\n')
+    return BertTokenizerFast(vocab_file=vocab_file, do_lower_case=True)
+
+def tiny_model(tokenizer, seed=0):
+    """Randomly initialized 2-layer BERT QA model"""
+    torch.manual_seed(seed)
+    config = BertConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=128,
+        max_position_embeddings=512
+    )
+    return BertForQuestionAnswering(config).eval()
+
+def time_calls(fn, args_list, repeat=1, items_per_call=1):
+    """Time fn(*args) for every args tuple and summarize the latencies
+    
+    Throughput is in items per second, latency percentiles are per call.
+    """
+    latencies = []
+    for _ in range(repeat):
+        for args in args_list:
+            start = time.perf_counter()
+            fn(*args)
+            latencies.append(time.perf_counter() - start)
+    
+    total = sum(latencies)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'calls': len(latencies),
+        'seconds': total,
+        'throughput': len(latencies) * items_per_call / total if total > 0 else 0.0,
+        'p50_ms': float(np.percentile(latencies_ms, 50)) if len(latencies) else 0.0,
+        'p90_ms': float(np.percentile(latencies_ms, 90)) if len(latencies) else 0.0,
+        'p99_ms': float(np.percentile(latencies_ms, 99)) if len(latencies) else 0.0,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+def run_benchmarks(n_guides=200, repeat=3, batch_size=32, stages=None, seed=0):
+    """Time every pipeline stage on a synthetic corpus of n_guides guides
+    
+    Returns {'config': ..., 'stages': {stage: {'calls', 'seconds',
+    'throughput', 'p50_ms', 'p90_ms', 'p99_ms', 'peak_rss_mb'}}}. Peak RSS is
+    the process peak after the stage ran, so it only grows across stages.
+    """
+    stages = stages or STAGES
+    results = {}
+    
+    preparator = DataPreparator()
+    evaluator = Evaluator()
+    guides = synthetic_guides(n_guides, seed=seed)
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, 'guides.csv')
+        pd.DataFrame({'text': guides}).to_csv(csv_path, index=False)
+        
+        if 'create_qa_pairs' in stages:
+            results['create_qa_pairs'] = time_calls(
+                preparator.create_qa_pairs, [(text,) for text in guides], repeat
+            )
+        
+        # Later stages all need the splits, prepared once outside the timings
+        start = time.perf_counter()
+        train_data, _, test_data = preparator.prepare_tourism_data(csv_path)
+        prepare_seconds = time.perf_counter() - start
+        if train_data is None:
+            raise ValueError("Data preparation failed on the synthetic corpus")
+        if 'prepare_tourism_data' in stages:
+            results['prepare_tourism_data'] = time_calls(
+                preparator.prepare_tourism_data, [(csv_path,)], repeat, items_per_call=n_guides
+            )
+            results['prepare_tourism_data']['first_run_seconds'] = prepare_seconds
+        
+        tokenizer = tiny_tokenizer(guides, tmp_dir)
+        model = tiny_model(tokenizer, seed)
+        
+        dataset = None
+        if 'find_answer_span' in stages or 'dataset_getitem' in stages:
+            dataset = QADataset(train_data, tokenizer)
+        
+        if 'find_answer_span' in stages:
+            pairs = list(zip(train_data['context'], train_data['answer']))
+            results['find_answer_span'] = time_calls(dataset.find_answer_span, pairs, repeat)
+        
+        if 'dataset_getitem' in stages:
+            results['dataset_getitem'] = time_calls(
+                dataset.__getitem__, [(i,) for i in range(len(dataset))], repeat
+            )
+        
+        if 'find_best_answer' in stages:
+            inputs = tokenizer(
+                test_data['question'].tolist(), test_data['context'].tolist(),
+                max_length=384, truncation=True, padding='max_length', return_tensors='pt'
+            )
+            generator = torch.Generator().manual_seed(seed)
+            start_logits = torch.randn(inputs['input_ids'].shape, generator=generator)
+            end_logits = torch.randn(inputs['input_ids'].shape, generator=generator)
+            results['find_best_answer'] = time_calls(
+                evaluator.find_best_answer,
+                [(start_logits[i:i + 1], end_logits[i:i + 1], inputs['input_ids'][i:i + 1], tokenizer)
+                 for i in range(len(test_data))],
+                repeat
+            )
+        
+        if 'compute_metrics' in stages:
+            # Reference answers against the answers of the next pair
+            answers = test_data['answer'].tolist()
+            pairs = list(zip(answers[1:] + answers[:1], answers))
+            results['compute_metrics'] = time_calls(evaluator.compute_metrics, pairs, repeat)
+        
+        if 'evaluate_model' in stages:
+            results['evaluate_model'] = time_calls(
+                lambda: evaluator.evaluate_model(model, tokenizer, test_data, batch_size=batch_size),
+                [()], repeat, items_per_call=len(test_data)
+            )
+    
+    return {
+        'config': {
+            'n_guides': n_guides,
+            'repeat': repeat,
+            'batch_size': batch_size,
+            'seed': seed,
+            'train_examples': len(train_data),
+            'test_examples': len(test_data),
+            'torch_threads': torch.get_num_threads()
+        },
+        'stages': results
+    }
+
+def compare_to_baseline(results, baseline, tolerance=0.2):
+    """Flag stages that got slower than the baseline by more than tolerance
+    
+    A stage regresses when its throughput dropped or its p90 latency rose
+    by more than `tolerance` (a fraction). Returns a list of
+    {'stage', 'metric', 'baseline', 'current', 'change'} entries.
+    """
+    regressions = []
+    for stage, current in results['stages'].items():
+        reference = baseline.get('stages', {}).get(stage)
+        if reference is None:
+            continue
+        
+        checks = [
+            ('throughput', reference['throughput'], current['throughput'], -1),
+            ('p90_ms', reference['p90_ms'], current['p90_ms'], 1)
+        ]
+        for metric, before, after, direction in checks:
+            if not before:
+                continue
+            change = (after - before) / before
+            if change * direction > tolerance:
+                regressions.append({
+                    'stage': stage,
+                    'metric': metric,
+                    'baseline': before,
+                    'current': after,
+                    'change': change
+                })
+    
+    return regressions
+
+def print_report(results, regressions=None):
+    """Print a table of the stage timings and any regressions"""
+    print("\nBenchmark results:")
+    header = "Stage".ljust(22) + " | " + " | ".join(
+        name.ljust(10) for name in ['items/s', 'p50 ms', 'p90 ms', 'p99 ms', 'RSS MB']
+    )
+    print(header)
+    print("-" * len(header))
+    for stage, entry in results['stages'].items():
+        rss = entry['peak_rss_mb']
+        values = [entry['throughput'], entry['p50_ms'], entry['p90_ms'], entry['p99_ms']]
+        cells = [f"{value:.2f}".ljust(10) for value in values]
+        cells.append((f"{rss:.0f}" if rss is not None else "n/a").ljust(10))
+        print(f"{stage.ljust(22)} | {' | '.join(cells)}")
+    
+    if regressions is not None:
+        if not regressions:
+            print("\nNo regressions against the baseline")
+        for entry in regressions:
+            print(f"REGRESSION {entry['stage']} {entry['metric']}: "
+                  f"{entry['baseline']:.2f} -> {entry['current']:.2f} ({entry['change']:+.1%})")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the tourism QA pipeline offline on CPU")
+    parser.add_argument('--guides', type=int, default=200, help="Synthetic guides to generate")
+    parser.add_argument('--repeat', type=int, default=3, help="Times every stage is repeated")
+    parser.add_argument('--batch-size', type=int, default=32, help="evaluate_model batch size")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=None, help="Stages to run (default: all)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json', help="Where to write the results JSON")
+    parser.add_argument('--baseline', default=None, help="Results JSON to compare against")
+    parser.add_argument('--save-baseline', default=None, help="Also write the results to this baseline path")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed slowdown before flagging a regression")
+    args = parser.parse_args(argv)
+    
+    results = run_benchmarks(args.guides, args.repeat, args.batch_size, args.stages, args.seed)
+    
+    regressions = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        results['regressions'] = regressions
+    
+    print_report(results, regressions)
+    
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+        print(f"Results saved to {path}")
+    
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
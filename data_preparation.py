@@ -1,54 +1,260 @@
+import os
+import glob
+import json
 import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
 import re
+import math
+import time
+import zlib
+import hashlib
+import functools
+from concurrent.futures import ProcessPoolExecutor
 import nltk
 from nltk.tokenize import sent_tokenize
 import torch
+from telemetry import telemetry
 
 nltk.download('punkt')
 nltk.download('stopwords')
 from nltk.corpus import stopwords
 
+# Mersenne prime 2**31 - 1, keeps MinHash products inside uint64
+_MINHASH_PRIME = (1 << 31) - 1
+
+@functools.lru_cache(maxsize=None)
+def _minhash_coefficients(num_perm):
+    """Fixed (a, b) of the universal hashes (a*x + b) mod p, one per permutation"""
+    rng = np.random.RandomState(42)
+    a = rng.randint(1, _MINHASH_PRIME, size=num_perm).astype(np.uint64)
+    b = rng.randint(0, _MINHASH_PRIME, size=num_perm).astype(np.uint64)
+    a.flags.writeable = False
+    b.flags.writeable = False
+    return a, b
+
+# Preparator used by pool workers, set once per process by _init_worker
+_worker_preparator = None
+
+def _init_worker(preparator):
+    global _worker_preparator
+    _worker_preparator = preparator
+
+def _create_qa_pairs_chunk(texts):
+    return [_worker_preparator.create_qa_pairs(text) for text in texts]
+
+class PatternMatcher:
+    """Compiled question patterns with a single keyword pre-scan per sentence
+    
+    Every pattern is compiled once when it is registered. A pattern can name
+    trigger words it cannot match without (e.g. "is" for "X is located Y");
+    all triggers are folded into one alternation that scans each sentence
+    once, and only patterns whose triggers occur are run. Patterns without
+    triggers always run. Matches come back in registration order, exactly as
+    running every pattern with re.finditer would produce them.
+    """
+    
+    def __init__(self, patterns=(), flags=re.IGNORECASE):
+        self.flags = flags
+        self.patterns = []
+        self._compiled = []
+        self._trigger_regex = None
+        
+        for pattern in patterns:
+            self.register(*pattern)
+    
+    def register(self, pattern, question_template, answer_template, triggers=None):
+        """Compile and add a pattern at the end of the pattern list"""
+        compiled = re.compile(pattern, self.flags)
+        trigger_set = None if triggers is None else frozenset(t.lower() for t in triggers)
+        
+        self.patterns.append((pattern, question_template, answer_template, triggers))
+        self._compiled.append((compiled, question_template, answer_template, trigger_set))
+        
+        # Rebuild the combined trigger scan
+        all_triggers = set()
+        for _, _, _, trigger_set in self._compiled:
+            if trigger_set:
+                all_triggers |= trigger_set
+        if all_triggers:
+            alternation = '|'.join(re.escape(t) for t in sorted(all_triggers, key=len, reverse=True))
+            self._trigger_regex = re.compile(rf'\b(?:{alternation})\b', self.flags)
+        else:
+            self._trigger_regex = None
+    
+    def match(self, sentence):
+        """Yield (match, question_template, answer_template) for a sentence"""
+        if self._trigger_regex is not None:
+            present = {word.lower() for word in self._trigger_regex.findall(sentence)}
+        else:
+            present = set()
+        
+        for compiled, question_template, answer_template, trigger_set in self._compiled:
+            if trigger_set is not None and not (trigger_set & present):
+                continue
+            for match in compiled.finditer(sentence):
+                yield match, question_template, answer_template
+    
+    def benchmark(self, sentences, repeat=3):
+        """Time each registered pattern over sentences
+        
+        Returns a dict per pattern with the best-of-`repeat` seconds spent in
+        re.finditer, the number of matches and the share of sentences the
+        trigger scan let through.
+        """
+        results = {}
+        for compiled, _, _, trigger_set in self._compiled:
+            if trigger_set is None or self._trigger_regex is None:
+                candidates = list(sentences)
+            else:
+                candidates = [
+                    s for s in sentences
+                    if trigger_set & {w.lower() for w in self._trigger_regex.findall(s)}
+                ]
+            
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                matches = sum(1 for s in candidates for _ in compiled.finditer(s))
+                best = min(best, time.perf_counter() - start)
+            
+            results[compiled.pattern] = {
+                'seconds': best,
+                'matches': matches,
+                'scanned_fraction': len(candidates) / len(sentences) if sentences else 0.0
+            }
+        
+        return results
+
+class BloomFilter:
+    """Fixed-size set of SHA-1 digests with a small false positive rate
+    
+    Memory is set by `capacity` and `error_rate` alone (about 29 bits per
+    item at 1e-6). Past `capacity` items the false positive rate grows, so
+    more unique items are mistaken for seen ones.
+    """
+    
+    def __init__(self, capacity=10_000_000, error_rate=1e-6):
+        self.n_bits = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.n_hashes = max(1, round(self.n_bits / capacity * math.log(2)))
+        self.bits = np.zeros((self.n_bits + 7) // 8, dtype=np.uint8)
+    
+    def add(self, digest):
+        """Add a digest; return True if it was (probably) added before"""
+        # Double hashing over two 8-byte halves of the digest
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        seen = True
+        for i in range(self.n_hashes):
+            position = (h1 + i * h2) % self.n_bits
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                seen = False
+                self.bits[byte] |= 1 << bit
+        return seen
+
+class ShardWriter:
+    """Append rows to size-capped JSONL or Parquet shards of one split"""
+    
+    def __init__(self, output_dir, split, shard_size=10000, file_format='jsonl'):
+        if file_format not in ('jsonl', 'parquet'):
+            raise ValueError(f"Unsupported shard format: {file_format}")
+        if file_format == 'parquet':
+            try:
+                import pyarrow
+            except ImportError:
+                raise ImportError("Parquet shards need pyarrow; install it with `pip install pyarrow` "
+                                  "or use file_format='jsonl'")
+        self.output_dir = output_dir
+        self.split = split
+        self.shard_size = shard_size
+        self.file_format = file_format
+        self.shard_index = 0
+        self.rows_in_shard = 0
+        self.total_rows = 0
+        self._file = None
+        self._buffer = []
+    
+    def _shard_path(self):
+        return os.path.join(self.output_dir, f"{self.split}-{self.shard_index:05d}.{self.file_format}")
+    
+    def write(self, row):
+        if self.file_format == 'jsonl':
+            if self._file is None:
+                self._file = open(self._shard_path(), 'w', encoding='utf-8')
+            self._file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        else:
+            # Parquet files cannot be appended to, rows are buffered per shard
+            self._buffer.append(row)
+        
+        self.rows_in_shard += 1
+        self.total_rows += 1
+        if self.rows_in_shard >= self.shard_size:
+            self.flush()
+    
+    def flush(self):
+        """Close the current shard, the next row starts a new one"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._buffer:
+            pd.DataFrame(self._buffer).to_parquet(self._shard_path(), index=False)
+            self._buffer = []
+        if self.rows_in_shard:
+            self.shard_index += 1
+            self.rows_in_shard = 0
+    
+    close = flush
+
 class DataPreparator:
     def __init__(self):
         # Simplified English patterns for question generation
-        self.patterns = [
+        # (regex, question template, answer template, trigger words);
+        # templates are filled with str.format(m=match) so the preparator
+        # stays picklable for workers
+        self.matcher = PatternMatcher([
             # Location patterns
             (r'(.*?) is located (.*?)(?:\.|$)',
-             lambda m: f"Where is {m.group(1)} located?",
-             lambda m: f"{m.group(1)} is located {m.group(2)}"),
+             "Where is {m[1]} located?",
+             "{m[1]} is located {m[2]}",
+             ['is']),
             
             # Description patterns - "is a/an"
             (r'(.*?) is (?:a|an) (.*?)(?:\.|$)',
-             lambda m: f"What is {m.group(1)}?",
-             lambda m: f"{m.group(1)} is a {m.group(2)}"),
+             "What is {m[1]}?",
+             "{m[1]} is a {m[2]}",
+             ['is']),
             
             # Description patterns - "is"
             (r'(.*?) is (.*?)(?:\.|$)',
-             lambda m: f"What is {m.group(1)}?",
-             lambda m: f"{m.group(1)} is {m.group(2)}"),
+             "What is {m[1]}?",
+             "{m[1]} is {m[2]}",
+             ['is']),
             
             # Feature patterns
             (r'(.*?) (?:has|contains|includes) (.*?)(?:\.|$)',
-             lambda m: f"What does {m.group(1)} have?",
-             lambda m: f"{m.group(1)} has {m.group(2)}"),
+             "What does {m[1]} have?",
+             "{m[1]} has {m[2]}",
+             ['has', 'contains', 'includes']),
             
             # Known for patterns
             (r'(.*?) is known for (.*?)(?:\.|$)',
-             lambda m: f"What is {m.group(1)} known for?",
-             lambda m: f"{m.group(1)} is known for {m.group(2)}"),
+             "What is {m[1]} known for?",
+             "{m[1]} is known for {m[2]}",
+             ['is']),
             
             # Famous for patterns
             (r'(.*?) is famous for (.*?)(?:\.|$)',
-             lambda m: f"What is {m.group(1)} famous for?",
-             lambda m: f"{m.group(1)} is famous for {m.group(2)}"),
+             "What is {m[1]} famous for?",
+             "{m[1]} is famous for {m[2]}",
+             ['is']),
             
             # Number patterns
             (r'(.*?) has (\d+.*?)(?:\.|$)',
-             lambda m: f"How many {m.group(2)} does {m.group(1)} have?",
-             lambda m: f"{m.group(1)} has {m.group(2)}")
-        ]
+             "How many {m[2]} does {m[1]} have?",
+             "{m[1]} has {m[2]}",
+             ['has'])
+        ])
         
         # English stopwords and invalid starts
         self.stopwords = set(stopwords.words('english'))
@@ -56,6 +262,15 @@ class DataPreparator:
         self.min_answer_words = 3
         self.max_answer_words = 50
 
+    @property
+    def patterns(self):
+        """Registered (regex, question template, answer template, triggers) entries"""
+        return self.matcher.patterns
+
+    def register_pattern(self, pattern, question_template, answer_template, triggers=None):
+        """Add a question pattern; templates are formatted with m=<re.Match>"""
+        self.matcher.register(pattern, question_template, answer_template, triggers)
+
     def custom_sentence_split(self, text):
         """Enhanced sentence splitting for English text"""
         # Pre-process abbreviations and special cases
@@ -94,79 +309,311 @@ class DataPreparator:
         
         return True
 
+    def context_windows(self, sentences):
+        """Context of each sentence: the sentence with its neighbours on both sides"""
+        contexts = []
+        for i in range(len(sentences)):
+            # Create context from surrounding sentences
+            start_idx = max(0, i - 1)
+            end_idx = min(len(sentences), i + 2)
+            contexts.append(' '.join(sentences[start_idx:end_idx]))
+        return contexts
+
     def create_qa_pairs(self, text):
         """Generate question-answer pairs from text"""
         sentences = self.custom_sentence_split(text)
+        contexts = self.context_windows(sentences)
         qa_pairs = []
+        seen_answers = set()
         
-        for i, sentence in enumerate(sentences):
-            # Create context from surrounding sentences
-            start_idx = max(0, i - 1)
-            end_idx = min(len(sentences), i + 2)
-            context = ' '.join(sentences[start_idx:end_idx])
-            
+        for sentence, context in zip(sentences, contexts):
             # Generate QA pairs using patterns
             if len(sentence.split()) >= 5:  # Skip very short sentences
-                for pattern, q_gen, a_gen in self.patterns:
-                    matches = list(re.finditer(pattern, sentence, re.IGNORECASE))
-                    
-                    for match in matches:
-                        try:
-                            question = q_gen(match)
-                            answer = a_gen(match)
+                for match, q_template, a_template in self.matcher.match(sentence):
+                    try:
+                        question = q_template.format(m=match)
+                        answer = a_template.format(m=match)
+                        
+                        # Validate the generated QA pair
+                        if (self.is_valid_answer(answer) and
+                            len(question.split()) >= 3 and
+                            answer not in seen_answers):
                             
-                            # Validate the generated QA pair
-                            if (self.is_valid_answer(answer) and
-                                len(question.split()) >= 3 and
-                                answer not in [pair['answer'] for pair in qa_pairs]):
-                                
-                                qa_pairs.append({
-                                    'question': question,
-                                    'answer': answer,
-                                    'context': context
-                                })
-                        except Exception as e:
-                            print(f"Error generating QA pair: {str(e)}")
-                            continue
+                            seen_answers.add(answer)
+                            qa_pairs.append({
+                                'question': question,
+                                'answer': answer,
+                                'context': context
+                            })
+                    except Exception as e:
+                        print(f"Error generating QA pair: {str(e)}")
+                        continue
         
         return qa_pairs
 
-    def prepare_tourism_data(self, csv_path, test_size=0.2, val_size=0.1):
+    def normalize_for_hash(self, text):
+        """Lowercase, drop punctuation and collapse whitespace"""
+        text = re.sub(r'[^\w\s]', ' ', text.lower())
+        return ' '.join(text.split())
+
+    def text_hash(self, text):
+        """Stable hash of the normalized text"""
+        return hashlib.sha1(self.normalize_for_hash(text).encode('utf-8')).digest()
+
+    def minhash_signature(self, text, num_perm=64, shingle_size=3):
+        """MinHash signature over word shingles of the normalized text"""
+        words = self.normalize_for_hash(text).split()
+        shingles = {' '.join(words[i:i + shingle_size])
+                    for i in range(max(1, len(words) - shingle_size + 1))}
+        hashes = np.array([zlib.crc32(sh.encode('utf-8')) & _MINHASH_PRIME for sh in shingles],
+                          dtype=np.uint64)
+        
+        # Universal hashing (a*x + b) mod p, one row per permutation
+        a, b = _minhash_coefficients(num_perm)
+        return ((hashes[:, None] * a + b) % _MINHASH_PRIME).min(axis=0)
+
+    def deduplicate_texts(self, texts, near_duplicate_threshold=0.8, num_perm=64, bands=16):
+        """Drop exact and near-duplicate guide texts, keeping the first occurrence
+        
+        Exact duplicates are found by hashing the normalized text. Near
+        duplicates are found with MinHash + LSH banding: texts sharing a band
+        are compared on their signatures and dropped when the estimated
+        Jaccard similarity of their word shingles reaches the threshold.
+        Returns the kept texts and the number of exact and near duplicates.
+        """
+        rows = num_perm // bands
+        seen_hashes = set()
+        buckets = {}
+        signatures = []
+        kept = []
+        exact = 0
+        near = 0
+        
+        for text in texts:
+            digest = self.text_hash(text)
+            if digest in seen_hashes:
+                exact += 1
+                continue
+            
+            signature = self.minhash_signature(text, num_perm)
+            keys = [(band, signature[band * rows:(band + 1) * rows].tobytes())
+                    for band in range(bands)]
+            
+            candidates = {idx for key in keys for idx in buckets.get(key, ())}
+            if any(np.mean(signatures[idx] == signature) >= near_duplicate_threshold
+                   for idx in candidates):
+                near += 1
+                continue
+            
+            seen_hashes.add(digest)
+            for key in keys:
+                buckets.setdefault(key, []).append(len(signatures))
+            signatures.append(signature)
+            kept.append(text)
+        
+        return kept, exact, near
+
+    def deduplicate_qa_pairs(self, qa_pairs):
+        """Drop QA pairs whose normalized question and answer were already seen"""
+        seen = set()
+        kept = []
+        for pair in qa_pairs:
+            key = (self.text_hash(pair['question']), self.text_hash(pair['answer']))
+            if key not in seen:
+                seen.add(key)
+                kept.append(pair)
+        return kept, len(qa_pairs) - len(kept)
+
+    def qa_pair_executor(self, n_workers):
+        """Process pool whose workers each hold a copy of this preparator"""
+        return ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(self,))
+
+    def generate_qa_pairs(self, texts, n_workers=1, chunk_size=16, executor=None):
+        """Yield the QA pairs of each text, in input order
+        
+        With n_workers > 1 the texts are sent in chunks of `chunk_size` to a
+        process pool; results come back in submission order, so the output is
+        identical to the serial path. n_workers=None uses all CPU cores. Pass
+        an `executor` from qa_pair_executor to reuse its workers across calls.
+        """
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        
+        if executor is None and (n_workers <= 1 or len(texts) <= chunk_size):
+            for text in texts:
+                yield self.create_qa_pairs(text)
+            return
+        
+        chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        if executor is not None:
+            for chunk_qa_pairs in executor.map(_create_qa_pairs_chunk, chunks):
+                yield from chunk_qa_pairs
+            return
+        
+        with self.qa_pair_executor(n_workers) as executor:
+            for chunk_qa_pairs in executor.map(_create_qa_pairs_chunk, chunks):
+                yield from chunk_qa_pairs
+
+    def split_for_pair(self, pair, test_size=0.2, val_size=0.1):
+        """Deterministically assign a QA pair to train/val/test by hashing it"""
+        digest = hashlib.sha1(
+            f"{self.normalize_for_hash(pair['question'])}\n{self.normalize_for_hash(pair['answer'])}".encode('utf-8')
+        ).digest()
+        position = int.from_bytes(digest[:8], 'big') / 2 ** 64
+        
+        if position < test_size:
+            return 'test'
+        if position < test_size + val_size:
+            return 'val'
+        return 'train'
+
+    def iter_qa_pairs(self, csv_path, chunksize=1000, n_workers=1, chunk_size=16, deduplicate=True,
+                      dedup_capacity=10_000_000):
+        """Read the CSV in chunks and yield QA pairs one at a time
+        
+        Only exact duplicates are removed here (texts and QA pairs), tracked in
+        two fixed-size Bloom filters of about 36 MB each for the default
+        `dedup_capacity`, allocated only when `deduplicate` is set. Beyond that many texts or pairs, unique ones are
+        increasingly dropped as duplicates. MinHash near-duplicate detection
+        needs the whole corpus and is left to prepare_tourism_data.
+        """
+        if deduplicate:
+            seen_texts = BloomFilter(dedup_capacity)
+            seen_pairs = BloomFilter(dedup_capacity)
+        self.stream_stats = {'duplicate_texts': 0, 'duplicate_pairs': 0}
+        
+        # One pool for the whole file, workers are not respawned per CSV chunk
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        executor = self.qa_pair_executor(n_workers) if n_workers > 1 else None
+        try:
+            for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+                if 'text' not in chunk.columns:
+                    raise ValueError("CSV must contain a 'text' column")
+                
+                texts = []
+                for text in chunk['text']:
+                    if not (isinstance(text, str) and text.strip()):
+                        continue
+                    if deduplicate and seen_texts.add(self.text_hash(text)):
+                        self.stream_stats['duplicate_texts'] += 1
+                        continue
+                    texts.append(text)
+                
+                for qa_pairs in self.generate_qa_pairs(texts, n_workers, chunk_size, executor):
+                    for pair in qa_pairs:
+                        if deduplicate:
+                            key = hashlib.sha1(
+                                self.text_hash(pair['question']) + self.text_hash(pair['answer'])
+                            ).digest()
+                            if seen_pairs.add(key):
+                                self.stream_stats['duplicate_pairs'] += 1
+                                continue
+                        yield pair
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def stream_tourism_data(self, csv_path, output_dir, test_size=0.2, val_size=0.1, chunksize=1000,
+                            shard_size=10000, file_format='jsonl', n_workers=1, chunk_size=16,
+                            deduplicate=True, dedup_capacity=10_000_000):
+        """Prepare dataset shards without holding the corpus in memory
+        
+        QA pairs are generated chunk by chunk, assigned to a split by hashing
+        their question and answer, and appended to `<split>-NNNNN.<format>`
+        shards in output_dir. Memory use is bounded by the CSV chunk, one
+        shard buffer (Parquet only) and the fixed-size duplicate filters of
+        iter_qa_pairs. Returns the number of pairs per split.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        
+        # Remove shards from a previous run so splits are not mixed
+        for split in ('train', 'val', 'test'):
+            for path in glob.glob(os.path.join(output_dir, f"{split}-*.{file_format}")):
+                os.remove(path)
+        
+        writers = {split: ShardWriter(output_dir, split, shard_size, file_format)
+                   for split in ('train', 'val', 'test')}
+        try:
+            for pair in self.iter_qa_pairs(csv_path, chunksize, n_workers, chunk_size, deduplicate,
+                                           dedup_capacity):
+                writers[self.split_for_pair(pair, test_size, val_size)].write(pair)
+        finally:
+            for writer in writers.values():
+                writer.close()
+        
+        counts = {split: writer.total_rows for split, writer in writers.items()}
+        if deduplicate:
+            print(f"Removed {self.stream_stats['duplicate_texts']} duplicate guide texts "
+                  f"and {self.stream_stats['duplicate_pairs']} duplicate QA pairs")
+        print(f"Dataset shards written to {output_dir}:")
+        print(f"Training samples: {counts['train']}")
+        print(f"Validation samples: {counts['val']}")
+        print(f"Test samples: {counts['test']}")
+        
+        return counts
+
+    def load_split(self, output_dir, split, file_format='jsonl'):
+        """Load all shards of a split written by stream_tourism_data"""
+        paths = sorted(glob.glob(os.path.join(output_dir, f"{split}-*.{file_format}")))
+        if not paths:
+            return pd.DataFrame(columns=['question', 'answer', 'context'])
+        if file_format == 'parquet':
+            return pd.concat([pd.read_parquet(path) for path in paths], ignore_index=True)
+        return pd.concat([pd.read_json(path, lines=True) for path in paths], ignore_index=True)
+
+    def prepare_tourism_data(self, csv_path, test_size=0.2, val_size=0.1, n_workers=1, chunk_size=16,
+                             deduplicate=True, near_duplicate_threshold=0.8):
         """Prepare dataset for training"""
         try:
             # Load and validate data
-            df = pd.read_csv(csv_path)
+            with telemetry.span('read_csv'):
+                df = pd.read_csv(csv_path)
             if 'text' not in df.columns:
                 raise ValueError("CSV must contain a 'text' column")
             
+            texts = [text for text in df['text'] if isinstance(text, str) and text.strip()]
+            
+            # Remove repeated guides before they leak into several splits
+            if deduplicate:
+                with telemetry.span('deduplicate_texts', examples=len(texts)):
+                    texts, exact, near = self.deduplicate_texts(texts, near_duplicate_threshold)
+                print(f"Removed {exact} exact and {near} near-duplicate guide texts")
+            
             # Create QA pairs from all texts
             all_qa_pairs = []
-            for text in df['text']:
-                if isinstance(text, str) and text.strip():
-                    qa_pairs = self.create_qa_pairs(text)
+            with telemetry.span('generate_qa_pairs', examples=len(texts)):
+                for qa_pairs in self.generate_qa_pairs(texts, n_workers, chunk_size):
                     all_qa_pairs.extend(qa_pairs)
+                telemetry.count(qa_pairs=len(all_qa_pairs))
+            
+            if deduplicate:
+                with telemetry.span('deduplicate_qa_pairs', examples=len(all_qa_pairs)):
+                    all_qa_pairs, dropped = self.deduplicate_qa_pairs(all_qa_pairs)
+                print(f"Removed {dropped} duplicate QA pairs")
             
             if not all_qa_pairs:
                 raise ValueError("No valid QA pairs generated from the texts")
             
-            # Convert to DataFrame
-            qa_df = pd.DataFrame(all_qa_pairs)
-            
-            # Shuffle the data
-            qa_df = qa_df.sample(frac=1, random_state=42).reset_index(drop=True)
-            
-            # Split into train, validation, and test sets
-            train_df, temp_df = train_test_split(
-                qa_df,
-                test_size=(test_size + val_size),
-                random_state=42
-            )
-            
-            val_df, test_df = train_test_split(
-                temp_df,
-                test_size=test_size/(test_size + val_size),
-                random_state=42
-            )
+            with telemetry.span('split', examples=len(all_qa_pairs)):
+                # Convert to DataFrame
+                qa_df = pd.DataFrame(all_qa_pairs)
+                
+                # Shuffle the data
+                qa_df = qa_df.sample(frac=1, random_state=42).reset_index(drop=True)
+                
+                # Split into train, validation, and test sets
+                train_df, temp_df = train_test_split(
+                    qa_df,
+                    test_size=(test_size + val_size),
+                    random_state=42
+                )
+                
+                val_df, test_df = train_test_split(
+                    temp_df,
+                    test_size=test_size/(test_size + val_size),
+                    random_state=42
+                )
             
             print(f"Dataset splits created:")
             print(f"Training samples: {len(train_df)}")
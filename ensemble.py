@@ -0,0 +1,338 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+import itertools
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from inference_backends import TorchBackend
+from telemetry import telemetry
+
+METRICS = ['f1', 'bleu', 'tourism_relevance', 'factual_accuracy']
+
+def tokenizer_family(tokenizer):
+    """Key shared by tokenizers that turn text into the same token ids
+    
+    Fast tokenizers are compared by their normalizer, pre-tokenizer, vocab
+    and post-processor, so e.g. the BERT and DistilBERT uncased tokenizers
+    fall into one family. Slow tokenizers only match themselves.
+    """
+    backend = getattr(tokenizer, 'backend_tokenizer', None)
+    if backend is None:
+        spec = f"{type(tokenizer).__name__}:{tokenizer.name_or_path}"
+    else:
+        # Truncation and padding are per-call state, not part of the family
+        spec = json.loads(backend.to_str())
+        spec.pop('truncation', None)
+        spec.pop('padding', None)
+        spec = json.dumps(spec, sort_keys=True)
+    spec += f":{tokenizer.padding_side}:{tokenizer.pad_token_id}"
+    return hashlib.sha1(spec.encode('utf-8')).hexdigest()[:12]
+
+class EnsembleEvaluator:
+    """Answer questions with several QA models at once and combine their spans
+    
+    `members` maps model names to (model, tokenizer). Models whose
+    tokenizers share a family (see tokenizer_family) reuse one tokenization
+    of the questions and contexts. For every batch of examples the models run
+    concurrently on a thread pool, each with an equal share of the torch
+    threads. Every model turns its logits into span probabilities (softmax
+    over the context tokens) and maps its best spans back to character
+    offsets in the context; the ensemble answer is the character span with
+    the highest weighted mean probability.
+    """
+    
+    def __init__(self, evaluator, members, weights=None, max_length=384, stride=128,
+                 n_best=20, max_answer_length=50):
+        self.evaluator = evaluator
+        self.names = list(members)
+        self.weights = {name: (weights or {}).get(name, 1.0) for name in self.names}
+        self.max_length = max_length
+        self.stride = stride
+        self.n_best = n_best
+        self.max_answer_length = max_answer_length
+        
+        self.backends = {}
+        self.families = defaultdict(list)
+        self.tokenizers = {}
+        for name, (model, tokenizer) in members.items():
+            model.to(evaluator.device)
+            self.backends[name] = TorchBackend(model, evaluator.device)
+            family = tokenizer_family(tokenizer)
+            self.families[family].append(name)
+            self.tokenizers.setdefault(family, tokenizer)
+        self.input_names = {name: set(tokenizer.model_input_names) for name, (_, tokenizer) in members.items()}
+        
+        print(f"Ensemble of {len(self.names)} models in {len(self.families)} tokenizer families: " +
+              "; ".join(', '.join(names) for names in self.families.values()))
+    
+    def encode(self, questions, contexts, families):
+        """Tokenize the examples once per tokenizer family"""
+        encoded = {}
+        for family in families:
+            encodings = self.tokenizers[family](
+                questions,
+                contexts,
+                max_length=self.max_length,
+                truncation='only_second',
+                stride=self.stride,
+                return_overflowing_tokens=True,
+                return_offsets_mapping=True
+            )
+            example_ids = encodings.pop('overflow_to_sample_mapping')
+            features_of = [[] for _ in questions]
+            for i, example_id in enumerate(example_ids):
+                features_of[example_id].append(i)
+            
+            encoded[family] = {
+                'encodings': encodings,
+                'offsets': encodings.pop('offset_mapping'),
+                'context_masks': [
+                    np.array([s == 1 for s in encodings.sequence_ids(i)]) for i in range(len(example_ids))
+                ],
+                'example_ids': example_ids,
+                'features_of': features_of
+            }
+        return encoded
+    
+    def span_candidates(self, start_logits, end_logits, context_mask, offsets):
+        """{(char start, char end): probability} of the best spans of one feature"""
+        if not context_mask.any():
+            return {}
+        
+        # Log-probabilities over the context tokens only
+        log_probs = []
+        for logits in (start_logits, end_logits):
+            logits = np.where(context_mask, logits.astype(np.float64), -np.inf)
+            top = logits.max()
+            log_probs.append(logits - top - np.log(np.exp(logits - top).sum()))
+        start_log_probs, end_log_probs = log_probs
+        
+        n_best = min(self.n_best, int(context_mask.sum()))
+        start_idx = np.argsort(start_log_probs)[::-1][:n_best]
+        end_idx = np.argsort(end_log_probs)[::-1][:n_best]
+        span_log_probs = start_log_probs[start_idx][:, None] + end_log_probs[end_idx][None, :]
+        span_length = end_idx[None, :] - start_idx[:, None] + 1
+        valid = (span_length >= 1) & (span_length <= self.max_answer_length)
+        
+        candidates = {}
+        for s, e in zip(*np.nonzero(valid)):
+            span = (int(offsets[start_idx[s]][0]), int(offsets[end_idx[e]][1]))
+            probability = float(np.exp(span_log_probs[s, e]))
+            candidates[span] = max(candidates.get(span, 0.0), probability)
+        return candidates
+    
+    def _forward(self, name, inputs):
+        start = time.perf_counter()
+        inputs = {key: value for key, value in inputs.items() if key in self.input_names[name]}
+        start_logits, end_logits = self.backends[name](inputs)
+        return start_logits.float().cpu().numpy(), end_logits.float().cpu().numpy(), time.perf_counter() - start
+    
+    def predict_candidates(self, questions, contexts, names=None, batch_size=32):
+        """Span candidates of every model for every example
+        
+        Returns ({name: [{(char start, char end): probability} per example]},
+        {name: forward seconds}). Only the models in `names` are run.
+        """
+        names = list(names or self.names)
+        families = [family for family, members in self.families.items() if any(n in names for n in members)]
+        candidates = {name: [{} for _ in questions] for name in names}
+        seconds = {name: 0.0 for name in names}
+        
+        with telemetry.span('ensemble', examples=len(questions)):
+            encoded = self.encode(questions, contexts, families)
+            
+            # Models share the cores instead of each using all of them
+            previous_threads = torch.get_num_threads()
+            torch.set_num_threads(max(1, (os.cpu_count() or 1) // len(names)))
+            try:
+                with ThreadPoolExecutor(max_workers=len(names)) as executor:
+                    for batch_start in range(0, len(questions), batch_size):
+                        batch = range(batch_start, min(batch_start + batch_size, len(questions)))
+                        
+                        # One padded batch per family, run by all of its models at once
+                        futures = []
+                        for family in families:
+                            entry = encoded[family]
+                            tokenizer = self.tokenizers[family]
+                            feature_idx = [i for example_id in batch for i in entry['features_of'][example_id]]
+                            if not feature_idx:
+                                continue
+                            encodings = entry['encodings']
+                            features = [{key: encodings[key][i] for key in encodings.keys()} for i in feature_idx]
+                            inputs = tokenizer.pad(features, padding='longest', return_tensors='pt')
+                            for name in self.families[family]:
+                                if name in names:
+                                    futures.append((name, family, feature_idx,
+                                                    executor.submit(self._forward, name, inputs)))
+                        
+                        for name, family, feature_idx, future in futures:
+                            start_logits, end_logits, forward_seconds = future.result()
+                            seconds[name] += forward_seconds
+                            entry = encoded[family]
+                            padded_length = start_logits.shape[1]
+                            left_padded = self.tokenizers[family].padding_side == 'left'
+                            for row, i in enumerate(feature_idx):
+                                length = len(entry['context_masks'][i])
+                                columns = slice(padded_length - length, None) if left_padded else slice(0, length)
+                                spans = self.span_candidates(
+                                    start_logits[row, columns], end_logits[row, columns],
+                                    entry['context_masks'][i], entry['offsets'][i]
+                                )
+                                # Windows of the same example keep the best probability per span
+                                example_candidates = candidates[name][entry['example_ids'][i]]
+                                for span, probability in spans.items():
+                                    example_candidates[span] = max(example_candidates.get(span, 0.0), probability)
+            finally:
+                torch.set_num_threads(previous_threads)
+        
+        return candidates, seconds
+    
+    def combine(self, candidates, contexts, names):
+        """Ensemble answer of the models in `names` for every example
+        
+        Spans are ranked by the weighted mean of the model probabilities (a
+        model that did not propose a span counts as 0); the best span whose
+        text passes the answer quality check wins. Examples without any
+        candidate get None.
+        """
+        total_weight = sum(self.weights[name] for name in names)
+        predictions = []
+        for example_id, context in enumerate(contexts):
+            scores = defaultdict(float)
+            for name in names:
+                for span, probability in candidates[name][example_id].items():
+                    scores[span] += self.weights[name] * probability / total_weight
+            
+            prediction = None
+            for span in sorted(scores, key=scores.get, reverse=True):
+                text = self.evaluator.clean_prediction(context[span[0]:span[1]])
+                if prediction is None:
+                    prediction = text
+                if self.evaluator.is_valid_prediction(text):
+                    prediction = text
+                    break
+            predictions.append(prediction)
+        return predictions
+    
+    def answer(self, questions, contexts, names=None, batch_size=32):
+        """Ensemble answers of the models in `names` (default: all)"""
+        names = list(names or self.names)
+        candidates, _ = self.predict_candidates(questions, contexts, names, batch_size)
+        return self.combine(candidates, contexts, names)
+    
+    def score(self, predictions, references, metric_workers=1):
+        """Mean metrics over the examples that got a prediction"""
+        pairs = [(prediction, reference) for prediction, reference in zip(predictions, references)
+                 if prediction is not None]
+        all_metrics = self.evaluator.compute_metrics_batch(
+            [prediction for prediction, _ in pairs],
+            [reference for _, reference in pairs],
+            n_workers=metric_workers
+        )
+        return {metric: float(np.mean([m[metric] for m in all_metrics])) if all_metrics else 0.0
+                for metric in METRICS}
+    
+    def measure_latency(self, questions, contexts, names, n_latency=20):
+        """Median milliseconds to answer one question with the models in `names`"""
+        latencies = []
+        for question, context in list(zip(questions, contexts))[:n_latency]:
+            start = time.perf_counter()
+            self.answer([question], [context], names)
+            latencies.append(time.perf_counter() - start)
+        return float(np.percentile(np.array(latencies) * 1000, 50)) if latencies else 0.0
+    
+    def compare(self, test_data, sizes=(1, 2), batch_size=32, metric_workers=1, n_latency=20):
+        """Accuracy and latency of every model combination of the given sizes
+        
+        All models run over the test set once; combinations only recombine
+        their span candidates. Latency is measured per combination on single
+        questions. Gains and added latency are against the most accurate
+        single model. Returns {combination: {'models', 'metrics', 'p50_ms',
+        'forward_seconds', 'f1_gain', 'added_ms'}}, best F1 first.
+        """
+        questions = test_data['question'].tolist()
+        contexts = test_data['context'].tolist()
+        references = test_data['answer'].tolist()
+        
+        candidates, seconds = self.predict_candidates(questions, contexts, batch_size=batch_size)
+        
+        report = {}
+        for size in sorted(set(sizes) | {1}):
+            for names in itertools.combinations(self.names, size):
+                predictions = self.combine(candidates, contexts, names)
+                report['+'.join(names)] = {
+                    'models': list(names),
+                    'metrics': self.score(predictions, references, metric_workers),
+                    'p50_ms': self.measure_latency(questions, contexts, names, n_latency),
+                    'forward_seconds': sum(seconds[name] for name in names)
+                }
+        
+        best_single = max((entry for entry in report.values() if len(entry['models']) == 1),
+                          key=lambda entry: entry['metrics']['f1'])
+        for entry in report.values():
+            entry['f1_gain'] = entry['metrics']['f1'] - best_single['metrics']['f1']
+            entry['added_ms'] = entry['p50_ms'] - best_single['p50_ms']
+        
+        # Single models only serve as the reference unless asked for
+        report = {combination: entry for combination, entry in report.items()
+                  if len(entry['models']) in sizes or entry is best_single}
+        return dict(sorted(report.items(), key=lambda item: item[1]['metrics']['f1'], reverse=True))
+
+def load_members(checkpoints):
+    """{name: (model, tokenizer)} loaded from {name: checkpoint directory}"""
+    from transformers import AutoModelForQuestionAnswering, AutoTokenizer
+    
+    return {
+        name: (AutoModelForQuestionAnswering.from_pretrained(path), AutoTokenizer.from_pretrained(path))
+        for name, path in checkpoints.items()
+    }
+
+def print_comparison(report):
+    """Print ensemble accuracy against added latency, best F1 first"""
+    print("\nEnsemble comparison:")
+    header = "Models".ljust(36) + " | " + " | ".join(
+        name.ljust(10) for name in ['f1', 'F1 gain', 'p50 ms', 'added ms']
+    )
+    print(header)
+    print("-" * len(header))
+    for combination, entry in report.items():
+        cells = [f"{entry['metrics']['f1']:.4f}", f"{entry['f1_gain']:+.4f}",
+                 f"{entry['p50_ms']:.1f}", f"{entry['added_ms']:+.1f}"]
+        print(f"{combination.ljust(36)} | {' | '.join(cell.ljust(10) for cell in cells)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare ensembles of trained QA checkpoints")
+    parser.add_argument('checkpoints', nargs='+', help="Directories written by ModelManager.train_model (best_<model>)")
+    parser.add_argument('--csv', default='tourism_guides.csv', help="Guides CSV whose test split is evaluated")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2], help="Ensemble sizes to compare")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--max-length', type=int, default=384)
+    parser.add_argument('--n-latency', type=int, default=20, help="Questions timed per combination")
+    parser.add_argument('--output', default=None, help="Where to write the comparison JSON")
+    args = parser.parse_args()
+    
+    from data_preparation import DataPreparator
+    from evaluation import Evaluator
+    
+    _, _, test_data = DataPreparator().prepare_tourism_data(args.csv)
+    checkpoints = {}
+    for checkpoint in args.checkpoints:
+        name = os.path.basename(os.path.normpath(checkpoint))
+        checkpoints[name[len('best_'):] if name.startswith('best_') else name] = checkpoint
+    members = load_members(checkpoints)
+    
+    ensemble = EnsembleEvaluator(Evaluator(), members, max_length=args.max_length)
+    report = ensemble.compare(test_data, sizes=args.sizes, batch_size=args.batch_size, n_latency=args.n_latency)
+    print_comparison(report)
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+        print(f"Comparison saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
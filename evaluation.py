@@ -1,3 +1,5 @@
+import os
+import time
 import evaluate
 from tqdm import tqdm
 import torch
@@ -8,15 +10,36 @@ from nltk.translate.bleu_score import sentence_bleu
 import nltk
 from typing import Dict, List, Union
 import string
+from concurrent.futures import ProcessPoolExecutor
+from inference_backends import TorchBackend
+from logit_cache import LogitCache
+from telemetry import telemetry
 
 nltk.download('punkt')
 nltk.download('stopwords')
 from nltk.corpus import stopwords
 
+# Compiled once, shared by all metric computations
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+NUMBER_PATTERN = re.compile(r'\d+(?:,\d+)*(?:\.\d+)?')
+ENTITY_PATTERN = re.compile(r'[A-Z][a-z]+')
+
+# Evaluator used by metric pool workers, set once per process
+_worker_evaluator = None
+
+def _init_metric_worker(evaluator):
+    global _worker_evaluator
+    _worker_evaluator = evaluator
+
+def _compute_metrics_chunk(chunk):
+    predictions, references = chunk
+    return _worker_evaluator.compute_metrics_batch(predictions, references)
+
 class Evaluator:
-    def __init__(self):
+    def __init__(self, logit_cache_dir=None):
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         print(f"Evaluator using device: {self.device}")
+        self.logit_cache = LogitCache(logit_cache_dir) if logit_cache_dir else None
         
         # English stopwords from NLTK
         self.stopwords = set(stopwords.words('english'))
@@ -37,47 +60,98 @@ class Evaluator:
     def find_best_answer(self, start_logits: torch.Tensor, end_logits: torch.Tensor, 
                         input_ids: torch.Tensor, tokenizer, max_answer_length: int = 50) -> str:
         """Find the best answer span from model outputs"""
-        # Convert to numpy for easier handling
-        start_logits = start_logits[0].cpu().numpy()
-        end_logits = end_logits[0].cpu().numpy()
-        
-        # Get the top start and end positions
-        start_idx = np.argsort(start_logits)[-20:][::-1]  # Top 20 starts
-        end_idx = np.argsort(end_logits)[-20:][::-1]  # Top 20 ends
-        
-        best_score = float('-inf')
-        best_answer = ""
-        
-        # Try all valid combinations of start and end positions
-        for start in start_idx:
-            for end in end_idx:
-                if start > end or end - start + 1 > max_answer_length:
-                    continue
-                    
-                # Skip answers starting with special tokens
-                if start == 0:
-                    continue
-                    
-                score = start_logits[start] + end_logits[end]
-                if score > best_score:
-                    tokens = input_ids[0][start:end + 1]
-                    answer = tokenizer.decode(tokens, skip_special_tokens=True).strip()
-                    
-                    # Validate answer quality
-                    if (len(answer.split()) >= 2 and  # At least 2 words
-                        not answer.startswith('?') and  # Not a question
-                        not any(answer.lower().startswith(w) for w in ['what', 'where', 'when', 'who', 'how', 'why'])):
-                        
-                        best_score = score
-                        best_answer = answer
-        
-        return best_answer.strip()
+        return self.find_best_answers(
+            start_logits[:1],
+            end_logits[:1],
+            input_ids[:1],
+            tokenizer,
+            max_answer_length=max_answer_length
+        )[0]
+
+    def find_best_answers(self, start_logits: torch.Tensor, end_logits: torch.Tensor,
+                          input_ids: torch.Tensor, tokenizer, context_mask: torch.Tensor = None,
+                          max_answer_length: int = 50, n_best: int = 20,
+                          return_scores: bool = False):
+        """Find the best answer span for every example in a batch
+        
+        The top `n_best` start and end positions of each example are combined
+        into a (batch, n_best, n_best) score matrix in one shot. Pairs with
+        start > end, spans longer than `max_answer_length`, spans starting at
+        position 0 and, if `context_mask` is given, spans touching positions
+        outside the mask are masked out. Candidates are then visited from the
+        highest score down and only decoded until one passes the answer
+        quality check, so usually a single decode per example is needed.
+        With `return_scores=True` the start+end logit score of every chosen
+        span is returned as well (-inf when no valid span was found).
+        """
+        start_logits = start_logits.float().cpu().numpy()
+        end_logits = end_logits.float().cpu().numpy()
+        input_ids = input_ids.cpu().numpy()
+        batch_size = start_logits.shape[0]
+        
+        # Get the top start and end positions (highest first)
+        start_idx = np.argsort(start_logits, axis=1)[:, -n_best:][:, ::-1]
+        end_idx = np.argsort(end_logits, axis=1)[:, -n_best:][:, ::-1]
+        n_candidates = start_idx.shape[1]
+        
+        # Score every start/end combination at once
+        scores = (np.take_along_axis(start_logits, start_idx, axis=1)[:, :, None] +
+                  np.take_along_axis(end_logits, end_idx, axis=1)[:, None, :])
+        
+        # Band mask: start <= end and span within the maximum answer length
+        span_length = end_idx[:, None, :] - start_idx[:, :, None] + 1
+        valid = (span_length >= 1) & (span_length <= max_answer_length)
+        
+        # Skip answers starting with special tokens
+        valid &= (start_idx != 0)[:, :, None]
+        
+        if context_mask is not None:
+            context_mask = context_mask.cpu().numpy().astype(bool)
+            valid &= np.take_along_axis(context_mask, start_idx, axis=1)[:, :, None]
+            valid &= np.take_along_axis(context_mask, end_idx, axis=1)[:, None, :]
+        
+        scores = np.where(valid, scores, -np.inf).reshape(batch_size, -1)
+        
+        # Stable sort keeps the start-major order of the original search for ties
+        candidates = np.argsort(-scores, axis=1, kind='stable')
+        
+        answers = []
+        answer_scores = []
+        for row in range(batch_size):
+            best_answer = ""
+            best_score = float('-inf')
+            for flat_idx in candidates[row]:
+                if scores[row, flat_idx] == -np.inf:
+                    break
+                
+                start = start_idx[row, flat_idx // n_candidates]
+                end = end_idx[row, flat_idx % n_candidates]
+                tokens = input_ids[row][start:end + 1]
+                answer = tokenizer.decode(tokens, skip_special_tokens=True).strip()
+                
+                if self.is_valid_prediction(answer):
+                    best_answer = answer
+                    best_score = float(scores[row, flat_idx])
+                    break
+            
+            answers.append(best_answer.strip())
+            answer_scores.append(best_score)
+        
+        if return_scores:
+            return answers, answer_scores
+        return answers
+
+    def is_valid_prediction(self, answer: str) -> bool:
+        """Validate answer quality of a decoded span"""
+        return (len(answer.split()) >= 2 and  # At least 2 words
+                not answer.startswith('?') and  # Not a question
+                not any(answer.lower().startswith(w) for w in ['what', 'where', 'when', 'who', 'how', 'why']))
 
     def normalize_text(self, text: str) -> str:
         """Normalize text for comparison"""
         # Convert to lowercase and remove punctuation
         text = text.lower()
-        text = text.translate(str.maketrans('', '', string.punctuation))
+        text = text.translate(PUNCTUATION_TABLE)
         
         # Remove extra whitespace
         text = ' '.join(text.split())
@@ -88,75 +162,138 @@ class Evaluator:
         
         return ' '.join(words)
 
+    def text_features(self, text: str) -> Dict[str, object]:
+        """Normalize and tokenize a text once for all metrics"""
+        return {
+            'tokens': word_tokenize(self.normalize_text(text)),
+            'keywords': self.extract_tourism_keywords(text),
+            'numbers': set(NUMBER_PATTERN.findall(text)),
+            'entities': set(ENTITY_PATTERN.findall(text))
+        }
+
+    def score_features(self, pred: Dict[str, object], ref: Dict[str, object]) -> Dict[str, float]:
+        """Compute all metrics from precomputed text features"""
+        pred_tokens = pred['tokens']
+        ref_tokens = ref['tokens']
+        
+        # F1 score
+        pred_set = set(pred_tokens)
+        ref_set = set(ref_tokens)
+        
+        if not pred_set or not ref_set:
+            f1 = 0.0
+        else:
+            intersection = pred_set & ref_set
+            precision = len(intersection) / len(pred_set)
+            recall = len(intersection) / len(ref_set)
+            f1 = 2 * precision * recall / (precision + recall) if (precision + recall) > 0 else 0
+        
+        # BLEU score
+        try:
+            bleu = sentence_bleu([ref_tokens], pred_tokens, weights=(0.5, 0.5, 0, 0))
+        except:
+            bleu = 0.0
+        
+        return {
+            'f1': f1,
+            'bleu': bleu,
+            'tourism_relevance': self.keyword_overlap(pred['keywords'], ref['keywords']),
+            'factual_accuracy': self.fact_overlap(
+                pred['numbers'], ref['numbers'], pred['entities'], ref['entities']
+            )
+        }
+
     def compute_metrics(self, prediction: str, reference: str) -> Dict[str, float]:
         """Compute evaluation metrics for a single prediction"""
         try:
-            # Normalize texts
-            pred_norm = self.normalize_text(prediction)
-            ref_norm = self.normalize_text(reference)
-            
-            # Tokenize
-            pred_tokens = word_tokenize(pred_norm)
-            ref_tokens = word_tokenize(ref_norm)
+            return self.score_features(self.text_features(prediction), self.text_features(reference))
             
-            # F1 score
-            pred_set = set(pred_tokens)
-            ref_set = set(ref_tokens)
-            
-            if not pred_set or not ref_set:
-                f1 = 0.0
-            else:
-                intersection = pred_set & ref_set
-                precision = len(intersection) / len(pred_set)
-                recall = len(intersection) / len(ref_set)
-                f1 = 2 * precision * recall / (precision + recall) if (precision + recall) > 0 else 0
-            
-            # BLEU score
+        except Exception as e:
+            return self._failed_metrics(prediction, reference, e)
+
+    def compute_metrics_batch(self, predictions: List[str], references: List[str],
+                              n_workers: int = 1, chunk_size: int = 256) -> List[Dict[str, float]]:
+        """Compute evaluation metrics for lists of predictions and references
+        
+        Every distinct text is normalized, tokenized and pattern-matched once
+        and its features are shared by all four metrics. With n_workers > 1
+        the pairs are scored in chunks on a process pool (n_workers=None uses
+        all cores). Scores are identical to calling compute_metrics per pair.
+        """
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        
+        if n_workers > 1 and len(predictions) > chunk_size:
+            chunks = [(predictions[i:i + chunk_size], references[i:i + chunk_size])
+                      for i in range(0, len(predictions), chunk_size)]
+            with ProcessPoolExecutor(max_workers=n_workers,
+                                     initializer=_init_metric_worker,
+                                     initargs=(self,)) as executor:
+                return [metrics for chunk in executor.map(_compute_metrics_chunk, chunks)
+                        for metrics in chunk]
+        
+        features = {}
+        
+        def get_features(text):
+            if text not in features:
+                features[text] = self.text_features(text)
+            return features[text]
+        
+        all_metrics = []
+        for prediction, reference in zip(predictions, references):
             try:
-                bleu = sentence_bleu([ref_tokens], pred_tokens, weights=(0.5, 0.5, 0, 0))
-            except:
-                bleu = 0.0
-            
-            # Tourism relevance
-            tourism_relevance = self.evaluate_tourism_relevance(prediction, reference)
-            
-            # Factual accuracy
-            factual_accuracy = self.evaluate_factual_accuracy(prediction, reference)
-            
-            return {
-                'f1': f1,
-                'bleu': bleu,
-                'tourism_relevance': tourism_relevance,
-                'factual_accuracy': factual_accuracy
-            }
+                all_metrics.append(self.score_features(get_features(prediction), get_features(reference)))
+            except Exception as e:
+                all_metrics.append(self._failed_metrics(prediction, reference, e))
+        
+        return all_metrics
+
+    def _failed_metrics(self, prediction, reference, error) -> Dict[str, float]:
+        """Report a metric failure and return zero scores"""
+        print(f"\nError computing metrics:")
+        print(f"Prediction: {prediction}")
+        print(f"Reference: {reference}")
+        print(f"Error: {str(error)}")
+        return {
+            'f1': 0.0,
+            'bleu': 0.0,
+            'tourism_relevance': 0.0,
+            'factual_accuracy': 0.0
+        }
+
+    def extract_tourism_keywords(self, text: str) -> set:
+        """Tourism keywords occurring in a text"""
+        return set(word.lower() for word in text.split() 
+                   if word.lower() in self.tourism_keywords)
+
+    def keyword_overlap(self, pred_keywords: set, ref_keywords: set) -> float:
+        """Share of the reference tourism keywords found in the prediction"""
+        if not ref_keywords:
+            return 1.0 if not pred_keywords else 0.0
             
-        except Exception as e:
-            print(f"\nError computing metrics:")
-            print(f"Prediction: {prediction}")
-            print(f"Reference: {reference}")
-            print(f"Error: {str(e)}")
-            return {
-                'f1': 0.0,
-                'bleu': 0.0,
-                'tourism_relevance': 0.0,
-                'factual_accuracy': 0.0
-            }
+        # Calculate overlap
+        overlap = len(pred_keywords & ref_keywords)
+        return overlap / len(ref_keywords)
+
+    def fact_overlap(self, pred_numbers: set, ref_numbers: set,
+                     pred_entities: set, ref_entities: set) -> float:
+        """Average share of reference numbers and named entities found in the prediction"""
+        # Calculate accuracy scores
+        number_accuracy = (len(pred_numbers & ref_numbers) / len(ref_numbers) 
+                         if ref_numbers else 1.0)
+        entity_accuracy = (len(pred_entities & ref_entities) / len(ref_entities) 
+                         if ref_entities else 1.0)
+        
+        return (number_accuracy + entity_accuracy) / 2
 
     def evaluate_tourism_relevance(self, prediction: str, reference: str) -> float:
         """Evaluate how relevant the answer is to tourism domain"""
         try:
             # Get tourism keywords from both texts
-            pred_keywords = set(word.lower() for word in prediction.split() 
-                              if word.lower() in self.tourism_keywords)
-            ref_keywords = set(word.lower() for word in reference.split() 
-                             if word.lower() in self.tourism_keywords)
-            
-            if not ref_keywords:
-                return 1.0 if not pred_keywords else 0.0
-                
-            # Calculate overlap
-            overlap = len(pred_keywords & ref_keywords)
-            return overlap / len(ref_keywords)
+            return self.keyword_overlap(
+                self.extract_tourism_keywords(prediction),
+                self.extract_tourism_keywords(reference)
+            )
             
         except Exception:
             return 0.0
@@ -164,84 +301,319 @@ class Evaluator:
     def evaluate_factual_accuracy(self, prediction: str, reference: str) -> float:
         """Evaluate factual accuracy by comparing numbers, dates, and named entities"""
         try:
-            # Extract numbers
-            pred_numbers = set(re.findall(r'\d+(?:,\d+)*(?:\.\d+)?', prediction))
-            ref_numbers = set(re.findall(r'\d+(?:,\d+)*(?:\.\d+)?', reference))
-            
-            # Extract capitalized words (potential named entities)
-            pred_entities = set(re.findall(r'[A-Z][a-z]+', prediction))
-            ref_entities = set(re.findall(r'[A-Z][a-z]+', reference))
-            
-            # Calculate accuracy scores
-            number_accuracy = (len(pred_numbers & ref_numbers) / len(ref_numbers) 
-                             if ref_numbers else 1.0)
-            entity_accuracy = (len(pred_entities & ref_entities) / len(ref_entities) 
-                             if ref_entities else 1.0)
-            
-            return (number_accuracy + entity_accuracy) / 2
+            # Extract numbers and capitalized words (potential named entities)
+            return self.fact_overlap(
+                set(NUMBER_PATTERN.findall(prediction)),
+                set(NUMBER_PATTERN.findall(reference)),
+                set(ENTITY_PATTERN.findall(prediction)),
+                set(ENTITY_PATTERN.findall(reference))
+            )
             
         except Exception:
             return 0.0
 
-    def evaluate_model(self, model, tokenizer, test_data):
-        """Evaluate model on test set"""
+    def make_batches(self, lengths: List[int], batch_size: int = 32,
+                     max_tokens: int = None) -> List[List[int]]:
+        """Group example indices of similar length into batches
+        
+        Examples are sorted by token length so each batch only needs padding
+        up to its own longest sequence. A batch is closed when it reaches
+        `batch_size` examples or, if `max_tokens` is set, when adding the next
+        example would push the padded batch (size x longest length) over the
+        token budget.
+        """
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+        
+        batches = []
+        batch = []
+        for idx in order:
+            # Sorted ascending, so the new example is the longest in the batch
+            padded_tokens = (len(batch) + 1) * lengths[idx]
+            if batch and (len(batch) >= batch_size or
+                          (max_tokens is not None and padded_tokens > max_tokens)):
+                batches.append(batch)
+                batch = []
+            batch.append(idx)
+        
+        if batch:
+            batches.append(batch)
+        
+        return batches
+
+    def forward_batch(self, backend, inputs):
+        """Start and end logits of one padded batch"""
+        with telemetry.span('forward') as span:
+            start_logits, end_logits = backend(inputs)
+            if telemetry.enabled and 'attention_mask' in inputs:
+                span.count(
+                    examples=len(inputs['input_ids']),
+                    tokens=int(inputs['attention_mask'].sum()),
+                    padded_tokens=inputs['input_ids'].numel()
+                )
+        return start_logits, end_logits
+
+    def decode_batch(self, start_logits, end_logits, input_ids, tokenizer,
+                     context_mask: torch.Tensor = None, max_answer_length: int = 50):
+        """Cleaned best answers and their scores from the logits of one batch"""
+        with telemetry.span('decode', examples=len(input_ids)):
+            predictions, scores = self.find_best_answers(
+                start_logits,
+                end_logits,
+                input_ids,
+                tokenizer,
+                context_mask=context_mask,
+                max_answer_length=max_answer_length,
+                return_scores=True
+            )
+        
+        # Clean predictions
+        predictions = [self.clean_prediction(prediction) for prediction in predictions]
+        return predictions, scores
+
+    def predict_batch(self, backend, tokenizer, inputs, return_scores: bool = False,
+                      context_mask: torch.Tensor = None):
+        """Answer one padded batch of tokenized question/context pairs"""
+        start_logits, end_logits = self.forward_batch(backend, inputs)
+        
+        # Get best answers for the whole batch
+        predictions, scores = self.decode_batch(
+            start_logits, end_logits, inputs['input_ids'], tokenizer, context_mask=context_mask
+        )
+        if return_scores:
+            return predictions, scores
+        return predictions
+
+    def merge_chunk_predictions(self, example_ids, predictions, scores, n_examples: int):
+        """Keep the highest scoring chunk prediction of every example
+        
+        `example_ids` maps every chunk to its example. Examples without any
+        chunk get a None prediction and a -inf score.
+        """
+        example_ids = np.asarray(example_ids, dtype=np.int64)
+        scores = np.asarray(scores, dtype=np.float64)
+        
+        # Sort by example, then by descending score; NaN scores sort last
+        order = np.lexsort((-scores, example_ids))
+        ids, first = np.unique(example_ids[order], return_index=True)
+        
+        merged_predictions = [None] * n_examples
+        merged_scores = [float('-inf')] * n_examples
+        for example_id, chunk in zip(ids, order[first]):
+            merged_predictions[example_id] = predictions[chunk]
+            merged_scores[example_id] = float(scores[chunk])
+        
+        return merged_predictions, merged_scores
+
+    def answer_questions(self, backend, tokenizer, questions: List[str], contexts: List[str],
+                         max_length: int = 384, stride: int = 128, return_scores: bool = False):
+        """Tokenize question/context pairs into one padded batch and answer them
+        
+        Long contexts are split into windows overlapping by `stride` tokens
+        and the best scoring window answers the question.
+        """
+        inputs = tokenizer(
+            questions,
+            contexts,
+            max_length=max_length,
+            truncation='only_second',
+            stride=stride,
+            return_overflowing_tokens=True,
+            padding='longest',
+            return_tensors='pt'
+        )
+        example_ids = inputs.pop('overflow_to_sample_mapping')
+        context_mask = torch.tensor([
+            [s == 1 for s in inputs.sequence_ids(i)] for i in range(len(example_ids))
+        ])
+        
+        predictions, scores = self.predict_batch(
+            backend, tokenizer, dict(inputs), return_scores=True, context_mask=context_mask
+        )
+        predictions, scores = self.merge_chunk_predictions(example_ids, predictions, scores, len(questions))
+        if return_scores:
+            return predictions, scores
+        return predictions
+
+    def measure_speed(self, backend, tokenizer, test_data, batch_size: int = 32, max_length: int = 384,
+                      n_latency: int = 50) -> Dict[str, float]:
+        """Single-question latency and batched throughput of a backend on the test set
+        
+        Latency percentiles come from answering the first `n_latency`
+        questions one at a time, throughput from answering all of them in
+        batches of `batch_size`.
+        """
+        questions = test_data['question'].tolist()
+        contexts = test_data['context'].tolist()
+        if not questions:
+            return {'p50_ms': 0.0, 'p90_ms': 0.0, 'examples_per_sec': 0.0}
+        
+        # Warm up once so lazy initialization is not timed
+        self.answer_questions(backend, tokenizer, questions[:1], contexts[:1], max_length=max_length)
+        
+        latencies = []
+        for question, context in list(zip(questions, contexts))[:n_latency]:
+            start = time.perf_counter()
+            self.answer_questions(backend, tokenizer, [question], [context], max_length=max_length)
+            latencies.append(time.perf_counter() - start)
+        
+        start = time.perf_counter()
+        for i in range(0, len(questions), batch_size):
+            self.answer_questions(backend, tokenizer, questions[i:i + batch_size], contexts[i:i + batch_size],
+                                  max_length=max_length)
+        elapsed = time.perf_counter() - start
+        
+        latencies_ms = np.array(latencies) * 1000
+        return {
+            'p50_ms': float(np.percentile(latencies_ms, 50)),
+            'p90_ms': float(np.percentile(latencies_ms, 90)),
+            'examples_per_sec': len(questions) / elapsed if elapsed > 0 else 0.0
+        }
+
+    def evaluate_model(self, model, tokenizer, test_data, batch_size: int = 32,
+                       max_tokens: int = None, max_length: int = 384, verbose: bool = False,
+                       metric_workers: int = 1, backend=None, stride: int = 128,
+                       logit_cache=None, max_answer_length: int = 50):
+        """Evaluate model on test set
+        
+        Inputs are tokenized once without padding, grouped by length and run
+        through the model one dynamically padded batch at a time. Contexts
+        longer than `max_length` become windows overlapping by `stride`
+        tokens; the best scoring window of each example is its prediction.
+        Set `verbose=True` to print every question, prediction and reference;
+        `metric_workers` is passed on to compute_metrics_batch. `backend`
+        replaces the plain PyTorch forward pass, see inference_backends.
+        
+        With a `logit_cache` (logit_cache.LogitCache, by default the one of
+        the evaluator) the start/end logits are stored on the first run;
+        later runs of the same model on the same features only decode the
+        cached logits, so changing `max_answer_length` or the answer cleaning
+        skips the forward passes.
+        """
         print("\nStarting model evaluation...")
-        model.eval()
-        model.to(self.device)
+        if backend is None:
+            model.eval()
+            model.to(self.device)
+            backend = TorchBackend(model, self.device)
         
-        all_metrics = []
-        detailed_results = []
+        logit_cache = logit_cache or self.logit_cache
+        questions = test_data['question'].tolist()
+        contexts = test_data['context'].tolist()
+        references = test_data['answer'].tolist()
         
-        for _, row in tqdm(test_data.iterrows(), total=len(test_data)):
-            try:
-                # Prepare input
-                inputs = tokenizer(
-                    row['question'],
-                    row['context'],
-                    max_length=384,
-                    truncation=True,
-                    padding='max_length',
-                    return_tensors='pt'
+        # Tokenize everything once, padding is applied per batch
+        with telemetry.span('tokenize', examples=len(questions)) as span:
+            encodings = tokenizer(
+                questions,
+                contexts,
+                max_length=max_length,
+                truncation='only_second',
+                stride=stride,
+                return_overflowing_tokens=True
+            )
+            example_ids = encodings.pop('overflow_to_sample_mapping')
+            context_masks = [
+                np.array([s == 1 for s in encodings.sequence_ids(i)]) for i in range(len(example_ids))
+            ]
+            lengths = [len(ids) for ids in encodings['input_ids']]
+            batches = self.make_batches(lengths, batch_size, max_tokens)
+            span.count(features=len(lengths), tokens=sum(lengths))
+        
+        cached_logits = None
+        if logit_cache is not None:
+            with telemetry.span('logit_cache'):
+                cache_key = logit_cache.cache_key(
+                    model, encodings['input_ids'], getattr(backend, 'name', type(backend).__name__)
                 )
+                cached_logits = logit_cache.load(cache_key)
+            if cached_logits is not None:
+                print(f"Loaded cached logits {cache_key}")
+            else:
+                new_start_logits = [None] * len(example_ids)
+                new_end_logits = [None] * len(example_ids)
+        
+        # Chunks of failed batches keep a NaN score, so any other chunk wins
+        chunk_predictions = [None] * len(example_ids)
+        chunk_scores = np.full(len(example_ids), np.nan)
+        
+        for batch in tqdm(batches, total=len(batches)):
+            try:
+                # Pad the batch to its own longest sequence
+                features = [{key: encodings[key][i] for key in encodings.keys()} for i in batch]
+                inputs = tokenizer.pad(features, padding='longest', return_tensors='pt')
                 
-                # Move to GPU
-                inputs = {k: v.to(self.device) for k, v in inputs.items()}
+                # Pad the context masks the same way
+                padded_length = inputs['input_ids'].shape[1]
+                context_mask = np.zeros((len(batch), padded_length), dtype=bool)
+                for row, i in enumerate(batch):
+                    if tokenizer.padding_side == 'left':
+                        context_mask[row, padded_length - lengths[i]:] = context_masks[i]
+                    else:
+                        context_mask[row, :lengths[i]] = context_masks[i]
                 
-                # Generate prediction
-                with torch.no_grad():
-                    outputs = model(**inputs)
+                if cached_logits is not None:
+                    start_logits, end_logits = cached_logits.batch(batch, padded_length, tokenizer.padding_side)
+                else:
+                    start_logits, end_logits = self.forward_batch(backend, inputs)
+                    if logit_cache is not None:
+                        # Keep the unpadded rows at full precision
+                        for row, i in enumerate(batch):
+                            columns = (slice(padded_length - lengths[i], None) if tokenizer.padding_side == 'left'
+                                       else slice(0, lengths[i]))
+                            new_start_logits[i] = start_logits[row, columns].float().cpu().numpy()
+                            new_end_logits[i] = end_logits[row, columns].float().cpu().numpy()
                 
-                # Get best answer
-                prediction = self.find_best_answer(
-                    outputs.start_logits,
-                    outputs.end_logits,
-                    inputs['input_ids'],
-                    tokenizer
+                # Generate predictions for the whole batch
+                batch_predictions, batch_scores = self.decode_batch(
+                    start_logits, end_logits, inputs['input_ids'], tokenizer,
+                    context_mask=torch.from_numpy(context_mask),
+                    max_answer_length=max_answer_length
                 )
-                
-                # Clean prediction
-                prediction = self.clean_prediction(prediction)
-                
-                # Store results
-                detailed_results.append({
-                    'question': row['question'],
-                    'prediction': prediction,
-                    'reference': row['answer']
-                })
-                
-                # Print example
-                print(f"\nQuestion: {row['question']}")
-                print(f"Predicted: {prediction}")
-                print(f"Reference: {row['answer']}")
-                
-                # Compute metrics
-                metrics = self.compute_metrics(prediction, row['answer'])
-                all_metrics.append(metrics)
+                for idx, prediction, score in zip(batch, batch_predictions, batch_scores):
+                    chunk_predictions[idx] = prediction
+                    chunk_scores[idx] = score
                 
             except Exception as e:
-                print(f"Error evaluating example: {str(e)}")
+                print(f"Error evaluating batch: {str(e)}")
                 continue
         
+        # Only complete runs are cached, a failed batch leaves rows missing
+        if logit_cache is not None and cached_logits is None:
+            if all(row is not None for row in new_start_logits):
+                with telemetry.span('logit_cache'):
+                    logit_cache.save(cache_key, new_start_logits, new_end_logits)
+                print(f"Saved logits to cache {cache_key}")
+        
+        predictions, _ = self.merge_chunk_predictions(
+            example_ids, chunk_predictions, chunk_scores, len(questions)
+        )
+        
+        detailed_results = []
+        
+        # Collect results in the original test set order
+        for question, prediction, reference in zip(questions, predictions, references):
+            if prediction is None:
+                continue
+            
+            # Store results
+            detailed_results.append({
+                'question': question,
+                'prediction': prediction,
+                'reference': reference
+            })
+            
+            if verbose:
+                print(f"\nQuestion: {question}")
+                print(f"Predicted: {prediction}")
+                print(f"Reference: {reference}")
+        
+        # Compute metrics
+        with telemetry.span('metrics', examples=len(detailed_results)):
+            all_metrics = self.compute_metrics_batch(
+                [result['prediction'] for result in detailed_results],
+                [result['reference'] for result in detailed_results],
+                n_workers=metric_workers
+            )
+        
         # Calculate final metrics
         final_results = {}
         for metric in ['f1', 'bleu', 'tourism_relevance', 'factual_accuracy']:
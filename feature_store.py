@@ -0,0 +1,94 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+# Bump when the layout or the contents of the stored features change
+FEATURE_FORMAT_VERSION = 4
+
+class FeatureStore:
+    """Disk cache of tokenized QA features
+    
+    Every split is tokenized once per tokenizer and saved as one `.npy` file
+    per feature (input_ids, attention_mask, start/end positions, ...). The
+    arrays are opened memory-mapped, so repeated runs and later epochs only
+    slice them instead of tokenizing again.
+    """
+    
+    def __init__(self, cache_dir='./feature_cache'):
+        self.cache_dir = cache_dir
+    
+    def hash_data(self, data, columns=('question', 'context', 'answer')):
+        """Hash the text columns of a split"""
+        hashes = pd.util.hash_pandas_object(data[list(columns)], index=False).values
+        return hashlib.sha1(hashes.tobytes()).hexdigest()
+    
+    def cache_key(self, tokenizer, data, max_length, **params):
+        """Build the cache key for a split and tokenizer"""
+        key = {
+            'version': FEATURE_FORMAT_VERSION,
+            'tokenizer': tokenizer.name_or_path,
+            'tokenizer_class': type(tokenizer).__name__,
+            'vocab_size': len(tokenizer),
+            'max_length': max_length,
+            'data': self.hash_data(data),
+            **params
+        }
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        
+        # Keep the tokenizer name readable in the directory listing
+        name = str(tokenizer.name_or_path).strip('/').replace('/', '_').replace('\\', '_')
+        return f"{name}_{max_length}_{digest}"
+    
+    def load(self, key):
+        """Open cached features memory-mapped, or return None on a miss"""
+        path = os.path.join(self.cache_dir, key)
+        meta_path = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            return {
+                name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+                for name in meta['features']
+            }
+        except Exception as e:
+            print(f"Ignoring unreadable feature cache {path}: {str(e)}")
+            return None
+    
+    def save(self, key, features):
+        """Write features to disk and return them memory-mapped"""
+        path = os.path.join(self.cache_dir, key)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        os.makedirs(tmp_path, exist_ok=True)
+        
+        for name, array in features.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(array))
+        
+        # meta.json is written last, it marks the entry as complete
+        with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'features': list(features.keys()),
+                'num_examples': len(next(iter(features.values()))) if features else 0
+            }, f, indent=4)
+        
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+        
+        return self.load(key)
+    
+    def get_or_build(self, tokenizer, data, max_length, build_fn, **params):
+        """Return cached features for a split, building them on a miss"""
+        key = self.cache_key(tokenizer, data, max_length, **params)
+        features = self.load(key)
+        if features is not None:
+            print(f"Loaded cached features {key}")
+            return features
+        
+        print(f"Tokenizing {len(data)} examples into feature cache {key}...")
+        return self.save(key, build_fn())
@@ -133,10 +133,11 @@ tourism_guides = [
     }
 ]
 
-# Create DataFrame
-df = pd.DataFrame(tourism_guides)
+if __name__ == "__main__":
+    # Create DataFrame
+    df = pd.DataFrame(tourism_guides)
 
-# Save to CSV
-df.to_csv('tourism_guides.csv', index=False)
+    # Save to CSV
+    df.to_csv('tourism_guides.csv', index=False)
 
-print("English tourism guides CSV file has been created successfully!")
\ No newline at end of file
+    print("English tourism guides CSV file has been created successfully!")
\ No newline at end of file
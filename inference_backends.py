@@ -0,0 +1,202 @@
+import os
+import time
+import inspect
+import argparse
+import numpy as np
+import torch
+from transformers import AutoModelForQuestionAnswering, AutoTokenizer
+
+class TorchBackend:
+    """Plain PyTorch forward pass, the reference fp32 backend"""
+    
+    name = 'fp32'
+    
+    def __init__(self, model, device=None):
+        self.model = model
+        self.device = device or next(model.parameters()).device
+        self.model.eval()
+    
+    def __call__(self, inputs):
+        """Return (start_logits, end_logits) for a batch of tokenized inputs"""
+        inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        with torch.no_grad():
+            outputs = self.model(**inputs)
+        return outputs.start_logits, outputs.end_logits
+
+class QuantizedTorchBackend(TorchBackend):
+    """int8 dynamically quantized PyTorch model, CPU only"""
+    
+    name = 'int8'
+    
+    def __init__(self, model):
+        super().__init__(model, torch.device('cpu'))
+
+class OnnxBackend:
+    """ONNX Runtime session on the CPU execution provider"""
+    
+    def __init__(self, model_path, num_threads=None):
+        import onnxruntime as ort
+        
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            model_path,
+            sess_options=options,
+            providers=['CPUExecutionProvider']
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.name = 'onnx-int8' if model_path.endswith('.int8.onnx') else 'onnx'
+    
+    def __call__(self, inputs):
+        """Return (start_logits, end_logits) for a batch of tokenized inputs"""
+        feeds = {
+            name: inputs[name].cpu().numpy().astype(np.int64)
+            for name in self.input_names
+        }
+        start_logits, end_logits = self.session.run(['start_logits', 'end_logits'], feeds)
+        return torch.from_numpy(start_logits), torch.from_numpy(end_logits)
+
+class _LogitsOnly(torch.nn.Module):
+    """Positional-argument wrapper used for ONNX tracing"""
+    
+    def __init__(self, model, input_names):
+        super().__init__()
+        self.model = model
+        self.input_names = input_names
+    
+    def forward(self, *args):
+        outputs = self.model(**dict(zip(self.input_names, args)))
+        return outputs.start_logits, outputs.end_logits
+
+def quantize_model(model):
+    """Apply int8 dynamic quantization to all Linear layers"""
+    model = model.cpu().eval()
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def export_quantized(checkpoint_dir, output_path=None):
+    """Quantize a saved best_<model> checkpoint and save the int8 model"""
+    output_path = output_path or os.path.join(checkpoint_dir, 'model.int8.pt')
+    model = AutoModelForQuestionAnswering.from_pretrained(checkpoint_dir)
+    torch.save(quantize_model(model), output_path)
+    print(f"Quantized model saved to {output_path}")
+    return output_path
+
+def load_quantized(path):
+    """Load an int8 model written by export_quantized"""
+    # The whole module is pickled, newer torch only loads weights by default
+    load_kwargs = {}
+    if 'weights_only' in inspect.signature(torch.load).parameters:
+        load_kwargs['weights_only'] = False
+    return torch.load(path, **load_kwargs)
+
+def export_onnx(checkpoint_dir, output_path=None, quantize=False, opset_version=14):
+    """Export a saved checkpoint to ONNX, optionally int8-quantizing the graph
+    
+    Batch and sequence dimensions are dynamic so the graph accepts the
+    dynamically padded batches of Evaluator.evaluate_model. Returns the path
+    of the exported (or quantized) graph.
+    """
+    output_path = output_path or os.path.join(checkpoint_dir, 'model.onnx')
+    model = AutoModelForQuestionAnswering.from_pretrained(checkpoint_dir).cpu().eval()
+    tokenizer = AutoTokenizer.from_pretrained(checkpoint_dir)
+    
+    dummy = tokenizer("Where is the cathedral?", "The cathedral is in the old town.", return_tensors='pt')
+    input_names = [name for name in tokenizer.model_input_names if name in dummy]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'}
+                    for name in input_names + ['start_logits', 'end_logits']}
+    
+    export_kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # Keep the TorchScript exporter, which supports dynamic_axes
+        export_kwargs['dynamo'] = False
+    
+    with torch.no_grad():
+        torch.onnx.export(
+            _LogitsOnly(model, input_names),
+            tuple(dummy[name] for name in input_names),
+            output_path,
+            input_names=input_names,
+            output_names=['start_logits', 'end_logits'],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset_version,
+            **export_kwargs
+        )
+    print(f"ONNX model saved to {output_path}")
+    
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        
+        quantized_path = output_path[:-len('.onnx')] + '.int8.onnx'
+        quantize_dynamic(output_path, quantized_path, weight_type=QuantType.QInt8)
+        print(f"Quantized ONNX model saved to {quantized_path}")
+        return quantized_path
+    
+    return output_path
+
+def compare_backends(evaluator, model, tokenizer, test_data, backends, **eval_kwargs):
+    """Evaluate the fp32 model and every backend on the same test data
+    
+    Returns {backend name: {'metrics', 'deltas', 'seconds', 'speedup'}} where
+    deltas are metric differences against the fp32 model.
+    """
+    reference = TorchBackend(model)
+    start = time.perf_counter()
+    reference_metrics, _ = evaluator.evaluate_model(model, tokenizer, test_data, backend=reference, **eval_kwargs)
+    reference_seconds = time.perf_counter() - start
+    
+    report = {
+        reference.name: {
+            'metrics': reference_metrics,
+            'deltas': {metric: 0.0 for metric in reference_metrics},
+            'seconds': reference_seconds,
+            'speedup': 1.0
+        }
+    }
+    
+    for backend in backends:
+        start = time.perf_counter()
+        metrics, _ = evaluator.evaluate_model(model, tokenizer, test_data, backend=backend, **eval_kwargs)
+        seconds = time.perf_counter() - start
+        report[backend.name] = {
+            'metrics': metrics,
+            'deltas': {metric: metrics[metric] - reference_metrics[metric] for metric in metrics},
+            'seconds': seconds,
+            'speedup': reference_seconds / seconds if seconds > 0 else float('inf')
+        }
+    
+    print("\nBackend comparison:")
+    for name, entry in report.items():
+        deltas = ', '.join(f"{metric} {delta:+.4f}" for metric, delta in entry['deltas'].items())
+        print(f"{name.ljust(10)} | {entry['seconds']:.2f}s | x{entry['speedup']:.2f} | {deltas}")
+    
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Export trained QA checkpoints for CPU inference")
+    parser.add_argument('checkpoint', help="Directory written by ModelManager.train_model (best_<model>)")
+    parser.add_argument('--onnx', action='store_true', help="Also export an ONNX graph")
+    parser.add_argument('--quantize-onnx', action='store_true', help="int8-quantize the ONNX graph")
+    parser.add_argument('--compare', metavar='CSV', help="Report accuracy deltas and speedups on the test split of CSV")
+    args = parser.parse_args()
+    
+    quantized_path = export_quantized(args.checkpoint)
+    onnx_path = None
+    if args.onnx or args.quantize_onnx:
+        onnx_path = export_onnx(args.checkpoint, quantize=args.quantize_onnx)
+    
+    if args.compare:
+        from data_preparation import DataPreparator
+        from evaluation import Evaluator
+        
+        _, _, test_data = DataPreparator().prepare_tourism_data(args.compare)
+        model = AutoModelForQuestionAnswering.from_pretrained(args.checkpoint)
+        tokenizer = AutoTokenizer.from_pretrained(args.checkpoint)
+        
+        backends = [QuantizedTorchBackend(load_quantized(quantized_path))]
+        if onnx_path:
+            backends.append(OnnxBackend(onnx_path))
+        compare_backends(Evaluator(), model, tokenizer, test_data, backends)
+
+if __name__ == "__main__":
+    main()
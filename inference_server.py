@@ -0,0 +1,326 @@
+import sys
+import json
+import time
+import queue
+import logging
+import argparse
+import threading
+import urllib.request
+import urllib.error
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+import torch
+from transformers import AutoModelForQuestionAnswering, AutoTokenizer
+from evaluation import Evaluator
+from inference_backends import TorchBackend, QuantizedTorchBackend, OnnxBackend, quantize_model
+
+class QAService:
+    """A trained best_<model> checkpoint loaded once for answering questions
+    
+    `backend` is 'fp32', 'int8' (dynamic quantization at load time) or the
+    path of an exported .onnx graph. With `guides_csv`, requests can name a
+    guide by its row number instead of sending the context.
+    
+    Fast tokenizers must not be shared between threads, so every thread
+    calling answer_batch loads its own copy of the tokenizer.
+    """
+    
+    def __init__(self, checkpoint_dir, backend='fp32', guides_csv=None, max_length=384):
+        self.checkpoint_dir = checkpoint_dir
+        self._local = threading.local()
+        self._local.tokenizer = AutoTokenizer.from_pretrained(checkpoint_dir)
+        self.evaluator = Evaluator()
+        self.max_length = max_length
+        
+        if backend.endswith('.onnx'):
+            self.backend = OnnxBackend(backend)
+        else:
+            model = AutoModelForQuestionAnswering.from_pretrained(checkpoint_dir)
+            if backend == 'int8':
+                self.backend = QuantizedTorchBackend(quantize_model(model))
+            else:
+                self.backend = TorchBackend(model.to(self.evaluator.device), self.evaluator.device)
+        
+        self.guides = []
+        if guides_csv:
+            self.guides = pd.read_csv(guides_csv)['text'].tolist()
+        
+        logging.info(f"Loaded {checkpoint_dir} with {self.backend.name} backend")
+    
+    @property
+    def tokenizer(self):
+        """The calling thread's tokenizer"""
+        if not hasattr(self._local, 'tokenizer'):
+            self._local.tokenizer = AutoTokenizer.from_pretrained(self.checkpoint_dir)
+        return self._local.tokenizer
+    
+    def resolve_context(self, request):
+        """Return the context of a request, looking up guide_id if needed"""
+        if request.get('context'):
+            return request['context']
+        
+        if 'guide_id' in request:
+            guide_id = int(request['guide_id'])
+            if not 0 <= guide_id < len(self.guides):
+                raise ValueError(f"Unknown guide_id {guide_id}")
+            return self.guides[guide_id]
+        
+        raise ValueError("Request needs a 'context' or a 'guide_id'")
+    
+    def answer_batch(self, questions, contexts):
+        """Answer a micro-batch of question/context pairs"""
+        return self.evaluator.answer_questions(
+            self.backend, self.tokenizer, questions, contexts, max_length=self.max_length
+        )
+
+class MicroBatcher:
+    """Combine concurrent requests into dynamic micro-batches
+    
+    Requests wait in a bounded queue. Each worker thread takes the oldest
+    request and keeps collecting until it has `batch_size` requests or the
+    oldest one has waited `max_wait_ms`, then answers the batch with one
+    forward pass.
+    """
+    
+    def __init__(self, service, batch_size=16, max_wait_ms=10, queue_depth=256, workers=1):
+        self.service = service
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue(maxsize=queue_depth)
+        self.stats = {'requests': 0, 'batches': 0, 'rejected': 0}
+        self._stats_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"batcher-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+    
+    def submit(self, question, context):
+        """Queue a request; raises queue.Full when the queue is at capacity"""
+        if self._stopped.is_set():
+            raise RuntimeError("Batcher is stopped")
+        future = Future()
+        try:
+            self.queue.put_nowait((question, context, future))
+        except queue.Full:
+            with self._stats_lock:
+                self.stats['rejected'] += 1
+            raise
+        return future
+    
+    def _worker(self):
+        while not self._stopped.is_set():
+            try:
+                batch = [self.queue.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            
+            # Collect more requests until the batch is full or the deadline passes
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            try:
+                answers = self.service.answer_batch(
+                    [question for question, _, _ in batch],
+                    [context for _, context, _ in batch]
+                )
+                for (_, _, future), answer in zip(batch, answers):
+                    future.set_result(answer)
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+            
+            with self._stats_lock:
+                self.stats['requests'] += len(batch)
+                self.stats['batches'] += 1
+    
+    def stop(self):
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+        
+        # Fail the requests no worker took, instead of leaving them to time out
+        while True:
+            try:
+                _, _, future = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            future.set_exception(RuntimeError("Batcher stopped before the request was answered"))
+
+def make_handler(service, batcher, request_timeout=30):
+    """Build the HTTP request handler bound to a service and batcher"""
+    
+    class QARequestHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def do_GET(self):
+            if self.path == '/health':
+                with batcher._stats_lock:
+                    stats = dict(batcher.stats)
+                stats['queue_size'] = batcher.queue.qsize()
+                stats['mean_batch_size'] = stats['requests'] / stats['batches'] if stats['batches'] else 0.0
+                self._send_json(200, {'status': 'ok', **stats})
+            else:
+                self._send_json(404, {'error': 'not found'})
+        
+        def do_POST(self):
+            if self.path != '/answer':
+                self._send_json(404, {'error': 'not found'})
+                return
+            
+            start = time.perf_counter()
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+                question = request['question']
+                context = service.resolve_context(request)
+            except (KeyError, ValueError, TypeError) as e:
+                self._send_json(400, {'error': f"Bad request: {str(e)}"})
+                return
+            
+            try:
+                answer = batcher.submit(question, context).result(timeout=request_timeout)
+            except queue.Full:
+                self._send_json(503, {'error': 'queue full'})
+                return
+            except Exception as e:
+                self._send_json(500, {'error': str(e)})
+                return
+            
+            self._send_json(200, {
+                'answer': answer,
+                'latency_ms': (time.perf_counter() - start) * 1000
+            })
+        
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+    
+    return QARequestHandler
+
+class QAHTTPServer(ThreadingHTTPServer):
+    # The default listen backlog of 5 makes bursts of clients retry their connect
+    request_queue_size = 1024
+    daemon_threads = True
+
+def serve(service, host='127.0.0.1', port=8000, batch_size=16, max_wait_ms=10, queue_depth=256, workers=1):
+    """Run the HTTP service until interrupted"""
+    batcher = MicroBatcher(service, batch_size, max_wait_ms, queue_depth, workers)
+    server = QAHTTPServer((host, port), make_handler(service, batcher))
+    logging.info(f"Serving on http://{host}:{port} (batch size {batch_size}, max wait {max_wait_ms}ms, "
+                 f"queue depth {queue_depth}, {workers} workers)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.stop()
+
+def run_load_test(url, payloads, n_requests=500, concurrency=16, timeout=30):
+    """Send n_requests POSTs from `concurrency` threads and report latency percentiles"""
+    def send(i):
+        data = json.dumps(payloads[i % len(payloads)]).encode('utf-8')
+        request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+        start = time.perf_counter()
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+        return time.perf_counter() - start
+    
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(send, i) for i in range(n_requests)]:
+            try:
+                latencies.append(future.result())
+            except (urllib.error.URLError, OSError):
+                errors += 1
+    elapsed = time.perf_counter() - start
+    
+    latencies_ms = np.array(latencies) * 1000
+    report = {
+        'requests': n_requests,
+        'errors': errors,
+        'concurrency': concurrency,
+        'throughput_rps': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'mean_ms': float(latencies_ms.mean()) if len(latencies) else 0.0,
+        'p50_ms': float(np.percentile(latencies_ms, 50)) if len(latencies) else 0.0,
+        'p90_ms': float(np.percentile(latencies_ms, 90)) if len(latencies) else 0.0,
+        'p99_ms': float(np.percentile(latencies_ms, 99)) if len(latencies) else 0.0
+    }
+    
+    print("\nLoad test results:")
+    for key, value in report.items():
+        print(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
+    
+    return report
+
+def load_test_payloads(csv_path):
+    """Question/context requests generated from the guides CSV"""
+    from data_preparation import DataPreparator
+    
+    data_prep = DataPreparator()
+    payloads = []
+    for text in pd.read_csv(csv_path)['text']:
+        if isinstance(text, str) and text.strip():
+            payloads.extend({'question': pair['question'], 'context': pair['context']}
+                            for pair in data_prep.create_qa_pairs(text))
+    return payloads
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler(sys.stdout)]
+    )
+    
+    parser = argparse.ArgumentParser(description="Tourism QA inference server")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    serve_parser = subparsers.add_parser('serve', help="Serve a trained checkpoint over HTTP")
+    serve_parser.add_argument('checkpoint', help="best_<model> directory written by training")
+    serve_parser.add_argument('--backend', default='fp32', help="fp32, int8 or the path of an .onnx graph")
+    serve_parser.add_argument('--guides', default=None, help="Guides CSV for guide_id requests")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8000)
+    serve_parser.add_argument('--batch-size', type=int, default=16)
+    serve_parser.add_argument('--max-wait-ms', type=float, default=10)
+    serve_parser.add_argument('--queue-depth', type=int, default=256)
+    serve_parser.add_argument('--workers', type=int, default=1, help="Batching worker threads")
+    serve_parser.add_argument('--threads', type=int, default=None, help="Torch intra-op threads")
+    
+    load_parser = subparsers.add_parser('loadtest', help="Measure latency and throughput of a running server")
+    load_parser.add_argument('--url', default='http://127.0.0.1:8000/answer')
+    load_parser.add_argument('--csv', default='tourism_guides.csv', help="Guides CSV to generate requests from")
+    load_parser.add_argument('--requests', type=int, default=500)
+    load_parser.add_argument('--concurrency', type=int, default=16)
+    
+    args = parser.parse_args()
+    
+    if args.command == 'serve':
+        if args.threads:
+            torch.set_num_threads(args.threads)
+        service = QAService(args.checkpoint, args.backend, args.guides)
+        serve(service, args.host, args.port, args.batch_size, args.max_wait_ms, args.queue_depth, args.workers)
+    else:
+        run_load_test(args.url, load_test_payloads(args.csv), args.requests, args.concurrency)
+
+if __name__ == "__main__":
+    main()
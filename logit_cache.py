@@ -0,0 +1,137 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import torch
+
+# Bump when the layout or the contents of the stored logits change
+LOGIT_FORMAT_VERSION = 2
+
+# Logit of padding positions when cached rows are padded into a batch
+PAD_LOGIT = -1e4
+
+def model_hash(model):
+    """SHA-1 of a model's class, config and weights"""
+    digest = hashlib.sha1(type(model).__name__.encode('utf-8'))
+    config = getattr(model, 'config', None)
+    if config is not None:
+        digest.update(config.to_json_string(use_diff=False).encode('utf-8'))
+    for name, tensor in model.state_dict().items():
+        digest.update(name.encode('utf-8'))
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()
+
+def feature_hash(sequences):
+    """SHA-1 of a list of token id sequences"""
+    digest = hashlib.sha1()
+    for ids in sequences:
+        ids = np.asarray(ids, dtype=np.int64)
+        digest.update(np.int64(len(ids)).tobytes())
+        digest.update(ids.tobytes())
+    return digest.hexdigest()
+
+class CachedLogits:
+    """Start/end logits of every feature, stored flat with row offsets
+    
+    Row i covers positions offsets[i]:offsets[i + 1] of the flat float32
+    arrays, one logit per unpadded token of feature i.
+    """
+    
+    def __init__(self, start_logits, end_logits, offsets):
+        self.start_logits = start_logits
+        self.end_logits = end_logits
+        self.offsets = offsets
+    
+    def __len__(self):
+        return len(self.offsets) - 1
+    
+    def get(self, i):
+        """(start_logits, end_logits) of feature i as float32 arrays"""
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.start_logits[start:end], self.end_logits[start:end]
+    
+    def batch(self, indices, padded_length, padding_side='right'):
+        """Float tensors of shape (len(indices), padded_length) for a padded batch"""
+        start_logits = np.full((len(indices), padded_length), PAD_LOGIT, dtype=np.float32)
+        end_logits = np.full((len(indices), padded_length), PAD_LOGIT, dtype=np.float32)
+        for row, i in enumerate(indices):
+            start, end = self.get(i)
+            columns = slice(padded_length - len(start), None) if padding_side == 'left' else slice(0, len(start))
+            start_logits[row, columns] = start
+            end_logits[row, columns] = end
+        return torch.from_numpy(start_logits), torch.from_numpy(end_logits)
+
+class LogitCache:
+    """Disk cache of the start/end logits a model produced for a set of features
+    
+    Entries are keyed by a hash of the model weights, the inference backend
+    and the token ids of the features, so any change to the checkpoint or
+    the tokenization is a miss. Logits are stored as float32 `.npy` files and
+    opened memory-mapped; decoding with other settings and rerunning the
+    metrics then reads them instead of running the model again. float32
+    keeps the logits exact, so cached and uncached runs pick the same spans.
+    """
+    
+    def __init__(self, cache_dir='./logit_cache'):
+        self.cache_dir = cache_dir
+    
+    def cache_key(self, model, sequences, backend_name='fp32', **params):
+        """Build the cache key for a model and the token ids of its features"""
+        key = {
+            'version': LOGIT_FORMAT_VERSION,
+            'model': model_hash(model),
+            'backend': backend_name,
+            'features': feature_hash(sequences),
+            **params
+        }
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        
+        # Keep the model name readable in the directory listing
+        name = str(getattr(model, 'name_or_path', '') or type(model).__name__)
+        name = name.strip('/').replace('/', '_').replace('\\', '_')
+        return f"{name}_{backend_name}_{digest}"
+    
+    def load(self, key):
+        """Open cached logits memory-mapped, or return None on a miss"""
+        path = os.path.join(self.cache_dir, key)
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            return None
+        
+        try:
+            return CachedLogits(*(
+                np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+                for name in ('start_logits', 'end_logits', 'offsets')
+            ))
+        except Exception as e:
+            print(f"Ignoring unreadable logit cache {path}: {str(e)}")
+            return None
+    
+    def save(self, key, start_logits, end_logits):
+        """Write per-feature logit rows to disk and return them memory-mapped"""
+        lengths = [len(row) for row in start_logits]
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        
+        path = os.path.join(self.cache_dir, key)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        os.makedirs(tmp_path, exist_ok=True)
+        
+        arrays = {'offsets': offsets}
+        for name, rows in (('start_logits', start_logits), ('end_logits', end_logits)):
+            flat = np.empty(offsets[-1], dtype=np.float32)
+            for i, row in enumerate(rows):
+                flat[offsets[i]:offsets[i + 1]] = row
+            arrays[name] = flat
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+        
+        # meta.json is written last, it marks the entry as complete
+        with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'num_features': len(lengths), 'num_tokens': int(offsets[-1])}, f, indent=4)
+        
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+        
+        return self.load(key)
@@ -3,11 +3,16 @@ import sys
 import logging
 from datetime import datetime
 import json
-import torch
-import gc
+import argparse
 from data_preparation import DataPreparator
-from models import ModelManager
+from models import DEFAULT_TRAINING, ModelManager
 from evaluation import Evaluator
+from scheduler import (ModelScheduler, cleanup_gpu, max_concurrency_for_memory, run_model_pipeline,
+                       run_distillation_pipeline)
+from telemetry import telemetry
+from run_manifest import RunManifest
+from run_config import PRESETS, load_config, model_settings, result_config, sample_splits
+from ensemble import EnsembleEvaluator, load_members, print_comparison
 
 def setup_logging():
     """Setup logging configuration"""
@@ -36,103 +41,341 @@ def save_results(results, model_name, output_dir):
         json.dump(results, f, ensure_ascii=False, indent=4)
     
     logging.info(f"Results saved to {filename}")
+    return filename
 
-def cleanup_gpu():
-    """Clean up GPU memory"""
-    if torch.cuda.is_available():
-        torch.cuda.empty_cache()
-        gc.collect()
+def save_timing_report(output_dir):
+    """Save the run's telemetry report to JSON next to the results"""
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = telemetry.save(f"{output_dir}/timing_{timestamp}.json")
+    
+    logging.info("\nTiming report:")
+    for line in telemetry.summary_lines():
+        logging.info(line)
+    logging.info(f"Timing report saved to {filename}")
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Train and evaluate tourism QA models")
+    parser.add_argument('--config', default=None, help="JSON run config, see run_config.DEFAULT_CONFIG")
+    parser.add_argument('--preset', choices=sorted(PRESETS), default=None,
+                        help="Start from a named config; 'smoke' runs one small model on a data sample")
+    parser.add_argument('--csv', dest='csv_path', default=None,
+                        help="Guides CSV (default: tourism_guides.csv, from `python generate_tourism_guides.py`)")
+    parser.add_argument('--output-dir', default=None, help="Results directory (default: ./output)")
+    parser.add_argument('--models', nargs='+', default=None, metavar='MODEL', help="Models to run (default: all)")
+    parser.add_argument('--test-size', type=float, default=None)
+    parser.add_argument('--val-size', type=float, default=None)
+    parser.add_argument('--sample', type=int, default=None, help="Keep only this many QA pairs across all splits")
+    parser.add_argument('--epochs', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=None)
+    parser.add_argument('--grad-accum', type=int, default=None)
+    parser.add_argument('--max-length', type=int, default=None, help="Maximum sequence length in tokens")
+    parser.add_argument('--learning-rate', type=float, default=None)
+    parser.add_argument('--num-workers', type=int, default=None, help="DataLoader worker processes")
+    parser.add_argument('--precision', choices=['auto', 'fp32', 'fp16', 'bf16'], default=None)
+    parser.add_argument('--auto-batch', action='store_true', default=None,
+                        help="Probe for the fastest batch size that fits, keeping the effective batch size")
+    parser.add_argument('--patience', type=int, default=None,
+                        help="Evaluations without a lower eval loss before stopping early, 0 disables (default: 3)")
+    parser.add_argument('--max-minutes', type=float, default=None, help="Wall-clock training budget per model")
+    parser.add_argument('--val-sample', type=int, default=None,
+                        help="Val QA pairs evaluated during training (default: all)")
+    parser.add_argument('--distill', action='store_true',
+                        help="Distill the best model into a smaller student after training")
+    parser.add_argument('--student', default=None,
+                        help="Student checkpoint sharing the teacher's vocabulary (default: reduced-layer teacher)")
+    parser.add_argument('--student-layers', type=int, default=None,
+                        help="Layers of the reduced-layer student (default: 4)")
+    parser.add_argument(
+        '--max-concurrency',
+        default='1',
+        help="Models trained in parallel worker processes; 'auto' sizes it from available memory (default: 1)"
+    )
+    parser.add_argument(
+        '--threads-per-worker',
+        type=int,
+        default=None,
+        help="Torch threads per worker process (default: cores / concurrency)"
+    )
+    parser.add_argument(
+        '--telemetry',
+        action='store_true',
+        help="Record per-stage timings, throughput and peak memory into output/timing_<timestamp>.json"
+    )
+    parser.add_argument(
+        '--profile',
+        nargs='+',
+        default=[],
+        metavar='STAGE',
+        help="Also profile these stages, e.g. train evaluate forward (implies --telemetry)"
+    )
+    parser.add_argument(
+        '--profiler',
+        choices=['cprofile', 'torch'],
+        default='cprofile',
+        help="Profiler used for --profile stages (default: cprofile)"
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help="Reuse the cached QA splits and finished models of the last run with the same config, "
+             "and resume interrupted training from its latest checkpoint"
+    )
+    parser.add_argument(
+        '--force',
+        nargs='+',
+        default=[],
+        metavar='STAGE',
+        help="Redo these stages even when resuming: data, models, all or model names"
+    )
+    return parser.parse_args(argv)
+
+def build_config(args):
+    """Run config from --config/--preset with the other options on top"""
+    overrides = {
+        key: getattr(args, key)
+        for key in ('csv_path', 'output_dir', 'models', 'test_size', 'val_size')
+        if getattr(args, key) is not None
+    }
+    if args.sample is not None:
+        overrides['sample'] = args.sample
+    overrides['training'] = {
+        'epochs': args.epochs,
+        'batch_size': args.batch_size,
+        'grad_accum': args.grad_accum,
+        'max_length': args.max_length,
+        'learning_rate': args.learning_rate,
+        'num_workers': args.num_workers,
+        'precision': args.precision,
+        'auto_batch': args.auto_batch,
+        'patience': args.patience,
+        'max_minutes': args.max_minutes,
+        'val_sample': args.val_sample
+    }
+    if args.distill:
+        overrides['distill'] = {
+            key: value for key, value in
+            {'student': args.student, 'student_layers': args.student_layers}.items()
+            if value is not None
+        }
+    return load_config(args.config, args.preset, overrides)
 
-def main():
+def main(argv=None):
+    args = parse_args(argv)
+    config = build_config(args)
     setup_logging()
     logging.info("Starting Tourism QA System")
+    logging.info(f"Run config: {json.dumps(config)}")
+    telemetry.configure(
+        enabled=args.telemetry or bool(args.profile),
+        profile_stages=args.profile,
+        profiler=args.profiler,
+        trace_dir=os.path.join(config['output_dir'], 'traces')
+    )
     
     try:
         # Initialize components
+        feature_cache_dir = config['feature_cache_dir']
         data_prep = DataPreparator()
-        model_manager = ModelManager()
-        evaluator = Evaluator()
+        model_manager = ModelManager(feature_cache_dir=feature_cache_dir, tuning_cache=config['tuning_cache'])
+        evaluator = Evaluator(logit_cache_dir=config['logit_cache_dir'])
         
         # Create output directory
-        output_dir = './output'
+        output_dir = config['output_dir']
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
         
         # Prepare data
         logging.info("Starting data preparation...")
-        csv_path = 'tourism_guides.csv'
+        csv_path = config['csv_path']
         if not os.path.exists(csv_path):
-            raise FileNotFoundError(f"Tourism guides file not found at {csv_path}")
+            raise FileNotFoundError(f"Tourism guides file not found at {csv_path}, "
+                                    "generate it with `python generate_tourism_guides.py`")
         
-        train_data, val_data, test_data = data_prep.prepare_tourism_data(
-            csv_path,
-            test_size=0.2,
-            val_size=0.1
-        )
+        # Progress of this config is recorded whether or not we resume
+        test_size, val_size = config['test_size'], config['val_size']
+        manifest = RunManifest(output_dir, csv_path, result_config(config))
+        if args.force:
+            manifest.invalidate(args.force)
+        logging.info(f"Run manifest: {manifest.path}")
         
-        if train_data is None or val_data is None or test_data is None:
-            raise ValueError("Data preparation failed - check the data format and content")
+        splits = manifest.load_splits() if args.resume else None
+        if splits is not None:
+            logging.info("Reusing cached QA splits")
+            train_data, val_data, test_data = splits
+        else:
+            with telemetry.span('data_preparation'):
+                train_data, val_data, test_data = data_prep.prepare_tourism_data(
+                    csv_path,
+                    test_size=test_size,
+                    val_size=val_size
+                )
+            
+            if train_data is None or val_data is None or test_data is None:
+                raise ValueError("Data preparation failed - check the data format and content")
+            manifest.save_splits(train_data, val_data, test_data)
+        
+        if config['sample']:
+            train_data, val_data, test_data = sample_splits(train_data, val_data, test_data, config['sample'])
         
         logging.info(f"Data split sizes - Train: {len(train_data)}, Val: {len(val_data)}, Test: {len(test_data)}")
         
-        # Initialize models
+        # Register models, each one is loaded when its turn comes
         logging.info("Initializing models...")
-        model_manager.initialize_models()
+        model_manager.initialize_models(config['models'], config['checkpoints'])
+        settings = {name: model_settings(config, name) for name in model_manager.models}
         
         if not model_manager.models:
-            raise ValueError("No models were successfully loaded - check model configurations")
+            raise ValueError("No models were registered - check model configurations")
+        
+        if args.max_concurrency == 'auto':
+            max_concurrency = max_concurrency_for_memory(list(model_manager.models))
+        else:
+            max_concurrency = int(args.max_concurrency)
+        threads_per_worker = args.threads_per_worker
         
         # Train and evaluate each model
         results = {}
-        for model_name, model in model_manager.models.items():
-            try:
-                logging.info(f"\nProcessing model: {model_name}")
-                logging.info("=" * 50)
-                model_output_dir = os.path.join(output_dir, model_name)
-                
-                # Training phase
-                logging.info(f"Training {model_name}...")
-                trainer = model_manager.train_model(
-                    model_name,
-                    train_data,
-                    val_data,
-                    model_output_dir
-                )
-                
-                if trainer is None:
-                    logging.error(f"Training failed for {model_name} - skipping evaluation")
+        pending = list(model_manager.models)
+        
+        if args.resume:
+            for model_name in manifest.finished_models():
+                model_results = manifest.load_results(model_name)
+                if model_results is not None and model_name in pending:
+                    logging.info(f"Skipping {model_name}, finished in a previous run")
+                    results[model_name] = model_results
+                    pending.remove(model_name)
+        
+        # Only checkpoints of an interrupted run with this config are resumed;
+        # forced models and models first started now train from scratch
+        started = set(manifest.started_models()) if args.resume else set()
+        resume_models = {name for name in pending
+                         if name in started and not RunManifest.is_forced(args.force, name)}
+        for model_name in pending:
+            manifest.mark_model(model_name, 'running')
+        
+        def collect(model_name, model_results):
+            model_results['config'] = {'run': config, 'training': settings[model_name]}
+            results[model_name] = model_results
+            
+            # Save individual model results
+            filename = save_results(model_results, model_name, os.path.join(output_dir, model_name))
+            manifest.mark_model(model_name, 'done', filename)
+            
+            # Print current model results
+            logging.info(f"\nResults for {model_name}:")
+            for metric, score in model_results['metrics'].items():
+                logging.info(f"{metric}: {score:.4f}")
+            training = model_results.get('training')
+            if training:
+                logging.info(f"Training stopped by {training['stopped_by']} after {training['epochs']:.2f} of "
+                             f"{training['planned_epochs']:.2f} epochs from epoch {training['start_epoch']:.2f}, "
+                             f"{training['seconds_saved']:.0f}s saved")
+        
+        if max_concurrency == 1:
+            for model_name in pending:
+                try:
+                    with telemetry.span(model_name):
+                        model_results = run_model_pipeline(
+                            model_manager,
+                            evaluator,
+                            model_name,
+                            train_data,
+                            val_data,
+                            test_data,
+                            output_dir,
+                            resume=model_name in resume_models,
+                            settings=settings[model_name]
+                        )
+                    if model_results is not None:
+                        collect(model_name, model_results)
+                    else:
+                        manifest.mark_model(model_name, 'failed')
+                    
+                except Exception as e:
+                    logging.error(f"Error processing model {model_name}: {str(e)}")
+                    manifest.mark_model(model_name, 'failed')
                     continue
-                
-                # Clean up GPU memory after training
-                cleanup_gpu()
-                
-                # Evaluation phase
-                logging.info(f"Evaluating {model_name}...")
-                model_results, detailed_results = evaluator.evaluate_model(
-                    model_manager.models[model_name],
-                    model_manager.tokenizers[model_name],
-                    test_data
-                )
-                
-                results[model_name] = {
-                    'metrics': model_results,
-                    'detailed_results': detailed_results
-                }
-                
-                # Save individual model results
-                save_results(results[model_name], model_name, model_output_dir)
-                
-                # Print current model results
-                logging.info(f"\nResults for {model_name}:")
-                for metric, score in model_results.items():
-                    logging.info(f"{metric}: {score:.4f}")
-                
-                # Clean up GPU memory after evaluation
-                cleanup_gpu()
-                
+        elif pending:
+            # One worker process per model, results arrive as they finish
+            scheduler = ModelScheduler(max_concurrency, threads_per_worker)
+            scheduler.run(
+                {name: model_manager.model_configs[name] for name in pending},
+                train_data,
+                val_data,
+                test_data,
+                output_dir,
+                manager_kwargs={'feature_cache_dir': feature_cache_dir, 'tuning_cache': config['tuning_cache']},
+                evaluator_kwargs={'logit_cache_dir': config['logit_cache_dir']},
+                on_result=collect,
+                resume_models=resume_models,
+                model_settings=settings
+            )
+            for model_name in pending:
+                if model_name not in results:
+                    manifest.mark_model(model_name, 'failed')
+        
+        # Keep the registration order for the comparative table
+        results = {name: results[name] for name in model_manager.models if name in results}
+        
+        # Latency, throughput and F1 gap of the distilled student and its teacher
+        speeds = {}
+        f1_gaps = {}
+        if config['distill'] is not None and results:
+            teacher_name = max(results, key=lambda name: results[name]['metrics']['f1'])
+            student_name = f"{teacher_name}-student"
+            settings[student_name] = settings[teacher_name]
+            student_results = manifest.load_results(student_name) if args.resume else None
+            if student_results is not None:
+                logging.info(f"Skipping distillation of {teacher_name}, finished in a previous run")
+                results[student_name] = student_results
+            else:
+                manifest.mark_model(student_name, 'running')
+                with telemetry.span('distillation'):
+                    student_results = run_distillation_pipeline(
+                        model_manager,
+                        evaluator,
+                        teacher_name,
+                        results[teacher_name],
+                        train_data,
+                        val_data,
+                        test_data,
+                        output_dir,
+                        distill_config=config['distill'],
+                        settings=settings[student_name]
+                    )
+                if student_results is not None:
+                    collect(student_name, student_results)
+                else:
+                    manifest.mark_model(student_name, 'failed')
+            if student_results is not None:
+                speeds[teacher_name] = student_results['speed']['teacher']
+                speeds[student_name] = student_results['speed']['student']
+                f1_gaps[student_name] = student_results['metrics']['f1'] - results[teacher_name]['metrics']['f1']
+        
+        # Accuracy against added latency of ensembles of the trained models
+        # train_model saves to <model>/best_<model>, distillation to <teacher>-student/best_student
+        checkpoints = {
+            name: os.path.join(output_dir, name, 'best_student' if name.endswith('-student') else f"best_{name}")
+            for name in results
+        }
+        checkpoints = {name: path for name, path in checkpoints.items() if os.path.isdir(path)}
+        if config['ensemble'] is not None and len(checkpoints) > 1:
+            try:
+                with telemetry.span('ensemble_comparison'):
+                    ensemble = EnsembleEvaluator(evaluator, load_members(checkpoints), max_length=max(
+                        settings.get(name, DEFAULT_TRAINING)['max_length'] for name in checkpoints
+                    ))
+                    ensemble_report = ensemble.compare(test_data, **config['ensemble'])
+                print_comparison(ensemble_report)
+                logging.info(f"Ensemble comparison saved to {save_results(ensemble_report, 'ensembles', output_dir)}")
+                ensemble = None
             except Exception as e:
-                logging.error(f"Error processing model {model_name}: {str(e)}")
-                continue
+                logging.error(f"Ensemble comparison failed: {str(e)}")
+            cleanup_gpu()
         
         # Print comparative results
         if results:
@@ -140,18 +383,27 @@ def main():
             logging.info("=" * 50)
             
             # Create a formatted table header
-            metrics = next(iter(results.values()))['metrics'].keys()
-            header = "Model".ljust(15) + " | " + " | ".join(str(m).ljust(10) for m in metrics)
+            metrics = list(next(iter(results.values()))['metrics'].keys())
+            columns = metrics + (['p50 ms', 'ex/s', 'F1 gap'] if speeds else [])
+            header = "Model".ljust(22) + " | " + " | ".join(str(m).ljust(10) for m in columns)
             logging.info(header)
             logging.info("-" * len(header))
             
             # Print each model's results
             for model_name, model_results in results.items():
-                scores = [f"{score:.4f}".ljust(10) for score in model_results['metrics'].values()]
-                logging.info(f"{model_name.ljust(15)} | {' | '.join(scores)}")
+                scores = [f"{model_results['metrics'][metric]:.4f}".ljust(10) for metric in metrics]
+                if speeds:
+                    speed = speeds.get(model_name)
+                    scores.append((f"{speed['p50_ms']:.1f}" if speed else "").ljust(10))
+                    scores.append((f"{speed['examples_per_sec']:.1f}" if speed else "").ljust(10))
+                    scores.append((f"{f1_gaps[model_name]:+.4f}" if model_name in f1_gaps else "").ljust(10))
+                logging.info(f"{model_name.ljust(22)} | {' | '.join(scores)}")
         else:
             logging.warning("No results were generated - all models failed to process")
         
+        if telemetry.enabled:
+            save_timing_report(output_dir)
+        
         # Clean up
         model_manager.cleanup()
         logging.info("\nProcessing completed successfully")
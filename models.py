@@ -1,23 +1,95 @@
-from transformers import AutoTokenizer, AutoModelForQuestionAnswering, Trainer, TrainingArguments
+from transformers import (AutoTokenizer, AutoModelForQuestionAnswering, Trainer, TrainingArguments, TrainerCallback,
+                          EarlyStoppingCallback)
+from transformers.trainer_pt_utils import get_length_grouped_indices, LengthGroupedSampler
+from transformers.trainer_utils import get_last_checkpoint
 import torch
+import torch.nn.functional as F
 from torch.utils.data import Dataset
 import os
 import gc
+import time
+import inspect
+from collections.abc import Mapping
 from tqdm import tqdm
 import numpy as np
 import re
 from nltk.corpus import stopwords
 import nltk
+from feature_store import FeatureStore
+from batch_tuner import BatchTuner
+from telemetry import telemetry
 
 nltk.download('stopwords')
 
+# Per-token features; every other feature holds one value per example
+SEQUENCE_KEYS = ('input_ids', 'attention_mask', 'token_type_ids')
+
+# Checkpoints registered by ModelManager.initialize_models
+MODEL_CHECKPOINTS = {
+    'BERT': 'bert-base-uncased',
+    'RoBERTa': 'roberta-base',
+    'DistilBERT': 'distilbert-base-uncased',
+    'ALBERT': 'albert-base-v2',
+    'DeBERTa': 'microsoft/deberta-base'
+}
+
+# Training settings of train_model; MODEL_TRAINING overrides them per model
+DEFAULT_TRAINING = {
+    'epochs': 10,
+    'batch_size': 16,
+    'grad_accum': 2,
+    'max_length': 384,
+    'learning_rate': 2e-5,
+    'num_workers': 4,
+    'precision': 'auto',  # fp16 on CUDA, else fp32; or 'fp32', 'fp16', 'bf16'
+    'eval_steps': 100,    # optimizer steps between evaluations and checkpoints
+    'patience': 3,        # evaluations without a lower eval_loss before stopping, 0 never stops early
+    'min_delta': 0.0,     # eval_loss decrease that counts as an improvement
+    'max_minutes': None,  # wall-clock budget of one training run
+    'max_flos': None,     # estimated training FLOP budget, 6 x parameters x tokens
+    'val_sample': None,   # QA pairs of the val split evaluated during training, None keeps all
+    'auto_batch': False   # probe for the fastest batch size that fits, keeping batch_size x grad_accum
+}
+MODEL_TRAINING = {
+    'DeBERTa': {'batch_size': 8, 'grad_accum': 4},
+    'RoBERTa': {'batch_size': 8, 'grad_accum': 4}
+}
+
+def training_settings(model_name, overrides=None):
+    """Training settings of a model: defaults, model defaults, then overrides"""
+    settings = {**DEFAULT_TRAINING, **MODEL_TRAINING.get(model_name, {})}
+    settings.update({key: value for key, value in (overrides or {}).items() if value is not None})
+    
+    unknown = set(settings) - set(DEFAULT_TRAINING)
+    if unknown:
+        raise ValueError(f"Unknown training settings for {model_name}: {', '.join(sorted(unknown))}")
+    if settings['precision'] not in ('auto', 'fp32', 'fp16', 'bf16'):
+        raise ValueError(f"Unknown precision {settings['precision']!r} for {model_name}")
+    return settings
+
 class QADataset(Dataset):
-    def __init__(self, data, tokenizer, max_length=384):
+    def __init__(self, data, tokenizer, max_length=384, stride=128, feature_store=None,
+                 dynamic_padding=False):
         self.data = data
         self.tokenizer = tokenizer
         self.max_length = max_length
+        self.stride = stride
+        self.dynamic_padding = dynamic_padding
         self.max_answer_length = 100
         self.stopwords = set(stopwords.words('english'))
+        
+        # Tokenize the whole split once, from the on-disk cache if available
+        with telemetry.span('features', examples=len(data)) as span:
+            if feature_store is not None:
+                self.features = feature_store.get_or_build(
+                    tokenizer, data, max_length, self.build_features, stride=stride,
+                    dynamic_padding=dynamic_padding
+                )
+            else:
+                self.features = self.build_features()
+            if telemetry.enabled:
+                # Without dynamic padding this reads the whole attention mask
+                span.count(features=len(self), tokens=int(self.lengths.sum()))
     
     def clean_text(self, text):
         """Clean text for better processing"""
@@ -26,7 +98,7 @@ class QADataset(Dataset):
         text = text.replace('##', '')  # Remove BERT artifacts
         return text
     
-    def find_answer_span(self, context, answer):
+    def find_answer_span(self, context, answer, max_span_words=15):
         """Find the best concise answer span in context"""
         # Clean both texts
         context = self.clean_text(context.lower())
@@ -42,87 +114,381 @@ class QADataset(Dataset):
         key_words = {word for word in answer_words 
                     if len(word) > 3 and word not in self.stopwords}
         
+        # Tokenize the context once, keeping the character offsets of each word
+        word_spans = [(m.start(), m.end()) for m in re.finditer(r'\S+', context)]
+        if not word_spans:
+            return 0, 1
+        if not key_words:
+            return word_spans[0]
+        
+        # Only windows that start and end on a key word can score best:
+        # any other window has the same matches but more words
+        key_positions = [i for i, (s, e) in enumerate(word_spans) if context[s:e] in key_words]
+        min_matches = len(key_words) * 0.5  # At least 50% key words
+        
         best_start = -1
         best_end = -1
         best_score = 0
         min_length = float('inf')
         
-        # Sliding window approach
-        words = context.split()
-        for i in range(len(words)):
-            for j in range(i + 1, min(i + 15, len(words))):  # Limit to 15 words max
-                span = ' '.join(words[i:j])
-                span_words = set(span.split())
+        # Sliding window approach, counting distinct key words incrementally
+        for a, i in enumerate(key_positions):
+            seen = set()
+            for j in key_positions[a:]:
+                span_length = j - i + 1
+                if span_length > max_span_words:
+                    break
                 
-                # Calculate matching score
-                matches = len(key_words & span_words)
-                span_length = j - i
+                s, e = word_spans[j]
+                seen.add(context[s:e])
+                matches = len(seen)
                 
                 # Prefer shorter spans with more key word matches
                 score = matches / (span_length ** 0.5)  # Penalize length
                 
-                if (matches >= len(key_words) * 0.5 and  # At least 50% key words
+                if (matches >= min_matches and
                     (score > best_score or 
                      (score == best_score and span_length < min_length))):
-                    span_start = context.find(span)
-                    if span_start != -1:
-                        best_score = score
-                        min_length = span_length
-                        best_start = span_start
-                        best_end = span_start + len(span)
+                    best_score = score
+                    min_length = span_length
+                    best_start = word_spans[i][0]
+                    best_end = e
         
         return (best_start, best_end) if best_start != -1 else (0, 1)
     
-    def __len__(self):
-        return len(self.data)
-    
-    def __getitem__(self, idx):
-        item = self.data.iloc[idx]
-        question = self.clean_text(item['question'])
-        context = self.clean_text(item['context'])
-        answer = self.clean_text(item['answer'])
+    def build_features(self):
+        """Tokenize all examples into contiguous arrays
         
-        # Tokenize inputs
+        Contexts longer than max_length are split into overlapping windows of
+        `stride` tokens overlap, one feature per window. A window is labelled
+        with the answer span only if it contains the whole answer, otherwise
+        with the first token, like an unanswerable example. `example_ids`
+        maps every feature back to its row in the data.
+        
+        With dynamic_padding the sequences are stored unpadded, concatenated
+        into flat arrays; feature i spans sequence_offsets[i]:[i + 1].
+        Otherwise they are padded to max_length.
+        """
+        questions = [self.clean_text(q) for q in self.data['question']]
+        contexts = [self.clean_text(c) for c in self.data['context']]
+        answers = [self.clean_text(a) for a in self.data['answer']]
+        
+        # Tokenize inputs, padding is applied afterwards
         encoding = self.tokenizer(
-            question,
-            context,
+            questions,
+            contexts,
             max_length=self.max_length,
-            padding='max_length',
             truncation='only_second',
-            return_tensors='pt',
             return_offsets_mapping=True,
-            stride=128
+            return_overflowing_tokens=True,
+            stride=self.stride
         )
+        offset_mapping = encoding.pop('offset_mapping')
+        example_ids = np.asarray(encoding.pop('overflow_to_sample_mapping'), dtype=np.int64)
+        
+        # Find answer spans in context, once per example
+        answer_spans = [self.find_answer_span(context, answer) for context, answer in zip(contexts, answers)]
+        
+        start_positions = np.zeros(len(example_ids), dtype=np.int64)
+        end_positions = np.zeros(len(example_ids), dtype=np.int64)
         
-        # Find answer span in context
-        answer_start, answer_end = self.find_answer_span(context, answer)
+        for i, example_id in enumerate(example_ids):
+            answer_start, answer_end = answer_spans[example_id]
+            
+            # Only context tokens of this window can hold the answer
+            is_context = np.array([s == 1 for s in encoding.sequence_ids(i)])
+            context_tokens = np.nonzero(is_context)[0]
+            if not len(context_tokens):
+                continue
+            offsets = np.where(is_context[:, None], np.asarray(offset_mapping[i]), -1)
+            if (answer_start < offsets[context_tokens[0], 0] or
+                    answer_end > offsets[context_tokens[-1], 1]):
+                continue
+            
+            # Convert character positions to token positions
+            start_positions[i], end_positions[i] = self.char_to_token_span(
+                offsets, answer_start, answer_end
+            )
+        
+        sequences = {key: encoding[key] for key in SEQUENCE_KEYS if key in encoding}
+        if self.dynamic_padding:
+            lengths = [len(ids) for ids in sequences['input_ids']]
+            features = {key: np.concatenate(val).astype(np.int32) for key, val in sequences.items()}
+            features['sequence_offsets'] = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        else:
+            if self.tokenizer.padding_side == 'left':
+                # Labels were found on the unpadded sequences; position 0
+                # (the first token, for windows without the answer) moves too
+                shift = self.max_length - np.array([len(ids) for ids in sequences['input_ids']])
+                start_positions += shift
+                end_positions += shift
+            padded = self.tokenizer.pad(
+                sequences, padding='max_length', max_length=self.max_length, return_tensors='np'
+            )
+            features = {key: np.asarray(val, dtype=np.int32) for key, val in padded.items()}
+        features['start_positions'] = start_positions
+        features['end_positions'] = end_positions
+        features['example_ids'] = example_ids
+        
+        return features
+    
+    def char_to_token_span(self, offset_mapping, answer_start, answer_end):
+        """Map a character span to the first token ending it and the last token starting it"""
+        starts = offset_mapping[:, 0]
+        ends = offset_mapping[:, 1]
+        
+        end_hits = np.nonzero((starts <= answer_end) & (answer_end <= ends))[0]
+        end_token = int(end_hits[0]) if len(end_hits) else 0
+        
+        # The start token is only searched up to the token holding the end
+        limit = end_token + 1 if len(end_hits) else len(offset_mapping)
+        start_hits = np.nonzero((starts[:limit] <= answer_start) & (answer_start <= ends[:limit]))[0]
+        start_token = int(start_hits[-1]) if len(start_hits) else 0
+        
+        return start_token, end_token
+    
+    @property
+    def lengths(self):
+        """Unpadded token length of every feature"""
+        if 'sequence_offsets' in self.features:
+            return np.diff(self.features['sequence_offsets'])
+        return np.asarray(self.features['attention_mask']).sum(axis=1)
+    
+    def __len__(self):
+        return len(self.features['start_positions'])
+    
+    def __getitem__(self, idx):
+        item = {}
+        if 'sequence_offsets' in self.features:
+            start, end = self.features['sequence_offsets'][idx:idx + 2]
+        for key, val in self.features.items():
+            if key in ('example_ids', 'sequence_offsets'):
+                continue
+            if key in SEQUENCE_KEYS and 'sequence_offsets' in self.features:
+                val = val[start:end]
+            else:
+                val = val[idx]
+            item[key] = torch.tensor(np.asarray(val), dtype=torch.long)
+        return item
+
+class DynamicPaddingCollator:
+    """Pad each batch only to its own longest sequence
+    
+    Used with the unpadded features of QADataset(dynamic_padding=True).
+    Answer positions, including position 0 of windows without the answer,
+    are shifted along with the tokens for tokenizers that pad on the left.
+    """
+    
+    def __init__(self, tokenizer, pad_to_multiple_of=None):
+        self.tokenizer = tokenizer
+        self.pad_to_multiple_of = pad_to_multiple_of
+    
+    def __call__(self, features):
+        sequences = [
+            {key: feature[key].tolist() for key in SEQUENCE_KEYS if key in feature}
+            for feature in features
+        ]
+        batch = dict(self.tokenizer.pad(
+            sequences,
+            padding='longest',
+            pad_to_multiple_of=self.pad_to_multiple_of,
+            return_tensors='pt'
+        ))
         
-        # Convert character positions to token positions
-        offset_mapping = encoding.offset_mapping[0].numpy()
-        start_token = 0
-        end_token = 0
+        for key in ('start_positions', 'end_positions'):
+            if key not in features[0]:
+                continue
+            positions = torch.stack([feature[key] for feature in features])
+            if self.tokenizer.padding_side == 'left':
+                lengths = torch.tensor([len(feature['input_ids']) for feature in features])
+                shift = batch['input_ids'].shape[1] - lengths
+                positions = positions + shift
+            batch[key] = positions
         
-        for idx, (start, end) in enumerate(offset_mapping):
-            if start <= answer_start <= end:
-                start_token = idx
-            if start <= answer_end <= end:
-                end_token = idx
-                break
+        return batch
+
+def padding_stats(lengths, batch_size, max_length, group_size=None):
+    """Share of pad tokens in one epoch of length-grouped batches
+    
+    Lengths are grouped in groups of `group_size` (batch_size x gradient
+    accumulation steps for the Trainer's sampler, default batch_size) and
+    the order is cut into batches of batch_size. Returns (pad fraction with
+    dynamic padding, pad fraction when padding to max_length, share of batch
+    tokens saved by dynamic padding).
+    """
+    lengths = np.asarray(lengths)
+    if not len(lengths):
+        return 0.0, 0.0, 0.0
+    
+    # Same grouping as the Trainer's length-grouped sampler
+    order = np.asarray(get_length_grouped_indices(lengths.tolist(), group_size or batch_size))
+    batch_lengths = [lengths[order[i:i + batch_size]] for i in range(0, len(order), batch_size)]
+    
+    real_tokens = lengths.sum()
+    dynamic_tokens = sum(len(batch) * batch.max() for batch in batch_lengths)
+    static_tokens = len(lengths) * max_length
+    return (
+        1 - real_tokens / dynamic_tokens,
+        1 - real_tokens / static_tokens,
+        1 - dynamic_tokens / static_tokens
+    )
+
+class TelemetryCallback(TrainerCallback):
+    """Record every training epoch as a telemetry span"""
+    
+    def __init__(self, examples_per_epoch, tokens_per_epoch):
+        self.examples_per_epoch = examples_per_epoch
+        self.tokens_per_epoch = tokens_per_epoch
+    
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        telemetry.begin('epoch').count(examples=self.examples_per_epoch, tokens=self.tokens_per_epoch)
+    
+    def on_epoch_end(self, args, state, control, **kwargs):
+        telemetry.end('epoch')
+
+class TrainingBudgetCallback(TrainerCallback):
+    """Stop training once a wall-clock or FLOP budget is spent
+    
+    FLOPs are estimated like the Trainer does, 6 x parameters x tokens, from
+    the training tokens of one epoch. When the budget runs out the current
+    step is evaluated and checkpointed, so load_best_model_at_end still
+    restores the best checkpoint. After training, `report` says why training
+    stopped and estimates the time saved against the planned epochs. On a
+    resumed run the epochs, seconds and savings in the report all count this
+    session only; `start_epoch` is the epoch it resumed from.
+    """
+    
+    def __init__(self, max_seconds=None, max_flos=None, flos_per_epoch=0):
+        self.max_seconds = max_seconds
+        self.max_flos = max_flos
+        self.flos_per_epoch = flos_per_epoch
+        self.report = None
+    
+    def on_train_begin(self, args, state, control, **kwargs):
+        # A resumed run only counts the epochs of this session
+        self.start = time.perf_counter()
+        self.start_epoch = state.epoch or 0
+        self.stopped_by = None
+    
+    def on_step_end(self, args, state, control, **kwargs):
+        if self.max_seconds and time.perf_counter() - self.start >= self.max_seconds:
+            self.stopped_by = 'time budget'
+        elif self.max_flos and self.flos_per_epoch * (state.epoch or 0) >= self.max_flos:
+            self.stopped_by = 'flop budget'
+        if self.stopped_by:
+            control.should_training_stop = True
+            control.should_evaluate = True
+            control.should_save = True
+    
+    def on_train_end(self, args, state, control, **kwargs):
+        seconds = time.perf_counter() - self.start
+        epochs = (state.epoch or 0) - self.start_epoch
+        planned = args.num_train_epochs - self.start_epoch
+        stopped_by = self.stopped_by
+        if stopped_by is None:
+            stopped_by = 'early stopping' if state.global_step < state.max_steps else 'completed'
         
-        # Remove offset mapping
-        encoding.pop("offset_mapping")
+        self.report = {
+            'stopped_by': stopped_by,
+            'start_epoch': self.start_epoch,
+            'epochs': epochs,
+            'planned_epochs': planned,
+            'seconds': seconds,
+            'seconds_saved': seconds * (planned / epochs - 1) if 0 < epochs < planned else 0.0,
+            'best_eval_loss': state.best_metric,
+            'best_checkpoint': state.best_model_checkpoint
+        }
+
+class LengthGroupedTrainer(Trainer):
+    """Trainer whose length-grouped sampler reads QADataset.lengths
+    
+    Without lengths, the stock sampler calls dataset[i] on every feature to
+    measure it, building the tensors of the whole training set.
+    """
+    
+    def _get_train_sampler(self, *args, **kwargs):
+        dataset = (args[0] if args else kwargs.get('train_dataset')) or self.train_dataset
+        if not self.args.group_by_length or self.args.world_size > 1 or not hasattr(dataset, 'lengths'):
+            return super()._get_train_sampler(*args, **kwargs)
+        return LengthGroupedSampler(
+            self.args.train_batch_size * self.args.gradient_accumulation_steps,
+            lengths=dataset.lengths.tolist()
+        )
+
+class DistillationTrainer(LengthGroupedTrainer):
+    """Trainer whose loss mixes the hard span loss with a teacher's soft targets"""
+    
+    def __init__(self, *args, teacher=None, temperature=2.0, alpha=0.5, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.teacher = teacher.to(self.args.device).eval()
+        self.temperature = temperature
+        self.alpha = alpha
         
-        # Prepare final encoding
-        encoding = {key: val.squeeze(0) for key, val in encoding.items()}
-        encoding['start_positions'] = torch.tensor(start_token, dtype=torch.long)
-        encoding['end_positions'] = torch.tensor(end_token, dtype=torch.long)
+        # DistilBERT students take no token_type_ids, for example
+        self.student_inputs = set(inspect.signature(self.model.forward).parameters)
+        self.teacher_inputs = set(inspect.signature(self.teacher.forward).parameters) - {
+            'start_positions', 'end_positions'
+        }
+    
+    def soft_loss(self, student_logits, teacher_logits, attention_mask):
+        """Temperature-scaled KL divergence between span distributions, pads excluded"""
+        padding = attention_mask == 0
+        student_logits = student_logits.float().masked_fill(padding, -1e4) / self.temperature
+        teacher_logits = teacher_logits.float().masked_fill(padding, -1e4) / self.temperature
+        return F.kl_div(
+            F.log_softmax(student_logits, dim=-1),
+            F.softmax(teacher_logits, dim=-1),
+            reduction='batchmean'
+        ) * self.temperature ** 2
+    
+    def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
+        outputs = model(**{key: val for key, val in inputs.items() if key in self.student_inputs})
+        with torch.no_grad():
+            teacher_outputs = self.teacher(**{key: val for key, val in inputs.items() if key in self.teacher_inputs})
         
-        return encoding
+        soft_loss = (
+            self.soft_loss(outputs.start_logits, teacher_outputs.start_logits, inputs['attention_mask']) +
+            self.soft_loss(outputs.end_logits, teacher_outputs.end_logits, inputs['attention_mask'])
+        ) / 2
+        loss = self.alpha * outputs.loss + (1 - self.alpha) * soft_loss
+        return (loss, outputs) if return_outputs else loss
+
+class LazyModelRegistry(Mapping):
+    """Read-only dict view over the registered models or tokenizers
+    
+    Looking up a name loads that model and its tokenizer on first use;
+    iterating only yields names, so nothing is loaded until it is accessed.
+    """
+    
+    def __init__(self, manager, loaded):
+        self.manager = manager
+        self.loaded = loaded
+    
+    def __getitem__(self, name):
+        if name not in self.manager.model_configs:
+            raise KeyError(name)
+        if name not in self.loaded:
+            self.manager.load_model(name)
+        return self.loaded[name]
+    
+    def __contains__(self, name):
+        return name in self.manager.model_configs
+    
+    def __iter__(self):
+        return iter(self.manager.model_configs)
+    
+    def __len__(self):
+        return len(self.manager.model_configs)
 
 class ModelManager:
-    def __init__(self):
-        self.models = {}
-        self.tokenizers = {}
+    def __init__(self, feature_cache_dir='./feature_cache', tuning_cache='./batch_tuning.json'):
+        self.model_configs = {}
+        self._loaded_models = {}
+        self._loaded_tokenizers = {}
+        self.models = LazyModelRegistry(self, self._loaded_models)
+        self.tokenizers = LazyModelRegistry(self, self._loaded_tokenizers)
+        self.feature_store = FeatureStore(feature_cache_dir) if feature_cache_dir else None
+        self.batch_tuner = BatchTuner(tuning_cache)
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         print(f"Using device: {self.device}")
         
@@ -130,44 +496,71 @@ class ModelManager:
             torch.cuda.empty_cache()
             gc.collect()
     
-    def initialize_models(self):
-        """Initialize models with memory-efficient settings"""
-        model_configs = {
-            'BERT': 'bert-base-uncased',
-            'RoBERTa': 'roberta-base',
-            'DistilBERT': 'distilbert-base-uncased',
-            'ALBERT': 'albert-base-v2',
-            'DeBERTa': 'microsoft/deberta-base'
-        }
+    def initialize_models(self, names=None, checkpoints=None):
+        """Register models; weights are loaded lazily on first access
         
-        for name, path in model_configs.items():
-            try:
-                print(f"Loading model {name}...")
-                
-                # Load tokenizer
-                self.tokenizers[name] = AutoTokenizer.from_pretrained(path)
-                
-                # Load model in eval mode first
-                with torch.no_grad():
-                    model = AutoModelForQuestionAnswering.from_pretrained(
-                        path,
-                        low_cpu_mem_usage=True
-                    )
-                    model.eval()  # Set to eval mode initially
-                    
-                    # Move to GPU if available
-                    model = model.to(self.device)
-                    
-                    # Enable gradient checkpointing for memory efficiency
-                    model.gradient_checkpointing_enable()
-                    
-                self.models[name] = model
-                print(f"Successfully loaded model: {name}")
-                
-            except Exception as e:
-                print(f"Error loading model {name}: {str(e)}")
+        `names` selects a subset of MODEL_CHECKPOINTS (default: all of them)
+        and `checkpoints` ({name: path}) adds or replaces checkpoints.
+        """
+        available = {**MODEL_CHECKPOINTS, **(checkpoints or {})}
+        names = list(names) if names else list(available)
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            raise ValueError(f"Unknown models {', '.join(unknown)}; available: {', '.join(available)}")
+        self.model_configs.update({name: available[name] for name in names})
+    
+    def load_model(self, name):
+        """Load a registered model and its tokenizer with memory-efficient settings"""
+        if name in self._loaded_models:
+            return self._loaded_models[name], self._loaded_tokenizers[name]
+        
+        path = self.model_configs[name]
+        print(f"Loading model {name}...")
+        
+        # Load tokenizer
+        tokenizer = AutoTokenizer.from_pretrained(path)
+        
+        # Load model in eval mode first
+        with torch.no_grad():
+            model = AutoModelForQuestionAnswering.from_pretrained(
+                path,
+                low_cpu_mem_usage=True
+            )
+            model.eval()  # Set to eval mode initially
+            
+            # Move to GPU if available
+            model = model.to(self.device)
+            
+            # Enable gradient checkpointing for memory efficiency
+            model.gradient_checkpointing_enable()
+        
+        self._loaded_tokenizers[name] = tokenizer
+        self._loaded_models[name] = model
+        print(f"Successfully loaded model: {name}")
+        
+        return model, tokenizer
+    
+    def release_model(self, name):
+        """Drop a loaded model and its tokenizer and free their memory"""
+        model = self._loaded_models.pop(name, None)
+        self._loaded_tokenizers.pop(name, None)
+        if model is not None:
+            model.cpu()
+            del model
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        gc.collect()
     
-    def train_model(self, model_name, train_data, val_data, output_dir):
+    def train_model(self, model_name, train_data, val_data, output_dir, dynamic_padding=True, resume=False,
+                    settings=None):
+        """Fine-tune a registered model and save the best checkpoint
+        
+        With dynamic_padding (the default) sequences are stored unpadded,
+        batched by similar length and padded per batch only to their own
+        longest sequence. With resume, training continues from the latest
+        checkpoint-* in output_dir if there is one. `settings` overrides
+        the model's training_settings (epochs, batch_size, ...).
+        """
         if model_name not in self.models:
             print(f"Model {model_name} not found!")
             return None
@@ -176,84 +569,186 @@ class ModelManager:
             model = self.models[model_name]
             tokenizer = self.tokenizers[model_name]
             
-            # Set model to train mode
-            model.train()
+            return self._fit(model_name, model, tokenizer, train_data, val_data, output_dir,
+                             training_settings(model_name, settings), dynamic_padding, resume)
             
-            # Create datasets
-            train_dataset = QADataset(train_data, tokenizer)
-            val_dataset = QADataset(val_data, tokenizer)
+        except Exception as e:
+            print(f"Error during training model {model_name}: {str(e)}")
+            return None
+    
+    def distill_model(self, teacher_path, train_data, val_data, output_dir, student=None, student_layers=4,
+                      temperature=2.0, alpha=0.5, dynamic_padding=True, settings=None):
+        """Train a small student reader on the soft start/end logits of a trained teacher
+        
+        `teacher_path` is a best_<model> directory written by train_model.
+        The student is `student_layers` bottom layers of the teacher by
+        default, or `student`, a MODEL_CHECKPOINTS name or checkpoint path
+        whose tokenizer has the teacher's vocabulary, since both models read
+        the same tokenized features. The loss is alpha * the hard span loss
+        plus (1 - alpha) * the temperature-scaled KL divergence to the
+        teacher's distributions. Returns the trainer, the student is saved
+        to output_dir/best_student.
+        """
+        try:
+            teacher = AutoModelForQuestionAnswering.from_pretrained(teacher_path).to(self.device)
+            tokenizer = AutoTokenizer.from_pretrained(teacher_path)
             
-            # Model-specific batch sizes and settings
-            if model_name in ['DeBERTa', 'RoBERTa']:
-                batch_size = 8
-                grad_accum = 4
+            if student is None:
+                # Keeps the teacher's embeddings and its first student_layers layers
+                student_model = AutoModelForQuestionAnswering.from_pretrained(
+                    teacher_path, num_hidden_layers=student_layers
+                )
             else:
-                batch_size = 16
-                grad_accum = 2
-            
-            # Training arguments with better memory management
-            training_args = TrainingArguments(
-                output_dir=output_dir,
-                num_train_epochs=10,
-                per_device_train_batch_size=batch_size,
-                per_device_eval_batch_size=batch_size,
-                gradient_accumulation_steps=grad_accum,
-                learning_rate=2e-5,
-                warmup_ratio=0.1,
-                weight_decay=0.01,
-                logging_dir='./logs',
-                logging_steps=50,
-                eval_steps=100,
-                save_steps=100,
-                evaluation_strategy="steps",
-                save_strategy="steps",
-                load_best_model_at_end=True,
-                save_total_limit=2,
-                report_to="none",
-                remove_unused_columns=False,
-                fp16=True if torch.cuda.is_available() else False,
-                gradient_checkpointing=True,
-                dataloader_num_workers=4,
-                dataloader_pin_memory=True,
-                metric_for_best_model="eval_loss",
-                greater_is_better=False,
-                max_grad_norm=1.0,
-                optim="adamw_torch"
-            )
+                student_path = MODEL_CHECKPOINTS.get(student, student)
+                if AutoTokenizer.from_pretrained(student_path).get_vocab() != tokenizer.get_vocab():
+                    raise ValueError(f"Student {student} does not share the teacher's vocabulary")
+                student_model = AutoModelForQuestionAnswering.from_pretrained(student_path)
+            student_model.to(self.device)
             
-            # Clear cache before training
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-                gc.collect()
+            print(f"Distilling {teacher_path} ({teacher.num_parameters() / 1e6:.0f}M parameters) into a "
+                  f"{student_model.num_parameters() / 1e6:.0f}M parameter student...")
+            settings = training_settings('student', settings)
+            return self._fit('student', student_model, tokenizer, train_data, val_data, output_dir,
+                             settings, dynamic_padding, trainer_class=DistillationTrainer,
+                             teacher=teacher, temperature=temperature, alpha=alpha)
             
-            print(f"Starting training for model {model_name}...")
-            trainer = Trainer(
-                model=model,
-                args=training_args,
-                train_dataset=train_dataset,
-                eval_dataset=val_dataset,
-                tokenizer=tokenizer
+        except Exception as e:
+            print(f"Error during distillation of {teacher_path}: {str(e)}")
+            return None
+    
+    def _fit(self, model_name, model, tokenizer, train_data, val_data, output_dir, settings,
+             dynamic_padding=True, resume=False, trainer_class=LengthGroupedTrainer, **trainer_kwargs):
+        """Run the Trainer on a loaded model and save it to output_dir/best_<model_name>"""
+        # Set model to train mode
+        model.train()
+        
+        # Model-specific batch sizes and settings
+        batch_size = settings['batch_size']
+        grad_accum = settings['grad_accum']
+        precision = settings['precision']
+        if precision == 'auto':
+            precision = 'fp16' if torch.cuda.is_available() else 'fp32'
+        
+        # Evaluating a fixed sample keeps its features in the feature cache
+        if settings['val_sample'] and len(val_data) > settings['val_sample']:
+            val_data = val_data.sample(n=settings['val_sample'], random_state=42)
+        
+        # Create datasets
+        train_dataset = QADataset(train_data, tokenizer, max_length=settings['max_length'],
+                                  feature_store=self.feature_store, dynamic_padding=dynamic_padding)
+        val_dataset = QADataset(val_data, tokenizer, max_length=settings['max_length'],
+                                feature_store=self.feature_store, dynamic_padding=dynamic_padding)
+        
+        data_collator = None
+        if dynamic_padding:
+            # Multiples of 8 keep fp16 batches on tensor cores
+            data_collator = DynamicPaddingCollator(
+                tokenizer, pad_to_multiple_of=8 if precision != 'fp32' else None
             )
-            
-            trainer.train()
-            
-            print(f"Training completed. Saving model...")
+        
+        if settings['auto_batch']:
+            with telemetry.span('batch_tuning'):
+                batch_size, grad_accum = self.batch_tuner.tune(
+                    model_name, model, train_dataset, data_collator, precision, batch_size * grad_accum, self.device
+                )
+        
+        if dynamic_padding:
+            dynamic_pad, static_pad, saved = padding_stats(
+                train_dataset.lengths, batch_size, train_dataset.max_length, group_size=batch_size * grad_accum
+            )
+            print(f"Dynamic padding: {dynamic_pad:.1%} pad tokens per epoch instead of "
+                  f"{static_pad:.1%} with max_length padding, {saved:.1%} fewer tokens")
+            telemetry.count(pad_ratio_estimate=dynamic_pad, static_pad_ratio=static_pad)
+        
+        # Training arguments with better memory management
+        training_args = TrainingArguments(
+            output_dir=output_dir,
+            num_train_epochs=settings['epochs'],
+            per_device_train_batch_size=batch_size,
+            per_device_eval_batch_size=batch_size * 2,  # no activations are kept for backward
+            gradient_accumulation_steps=grad_accum,
+            learning_rate=settings['learning_rate'],
+            warmup_ratio=0.1,
+            weight_decay=0.01,
+            logging_dir='./logs',
+            logging_steps=50,
+            eval_steps=settings['eval_steps'],
+            save_steps=settings['eval_steps'],
+            evaluation_strategy="steps",
+            save_strategy="steps",
+            load_best_model_at_end=True,
+            save_total_limit=2,
+            report_to="none",
+            remove_unused_columns=False,
+            fp16=precision == 'fp16',
+            bf16=precision == 'bf16',
+            gradient_checkpointing=True,
+            dataloader_num_workers=settings['num_workers'],
+            dataloader_pin_memory=True,
+            metric_for_best_model="eval_loss",
+            greater_is_better=False,
+            max_grad_norm=1.0,
+            optim="adamw_torch",
+            group_by_length=dynamic_padding
+        )
+        
+        # Clear cache before training
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+            gc.collect()
+        
+        print(f"Starting training for model {model_name}...")
+        trainer = trainer_class(
+            model=model,
+            args=training_args,
+            train_dataset=train_dataset,
+            eval_dataset=val_dataset,
+            tokenizer=tokenizer,
+            data_collator=data_collator,
+            **trainer_kwargs
+        )
+        if telemetry.enabled:
+            trainer.add_callback(TelemetryCallback(len(train_dataset), int(train_dataset.lengths.sum())))
+        if settings['patience']:
+            trainer.add_callback(EarlyStoppingCallback(settings['patience'], settings['min_delta']))
+        budget = TrainingBudgetCallback(
+            max_seconds=settings['max_minutes'] * 60 if settings['max_minutes'] else None,
+            max_flos=settings['max_flos'],
+            flos_per_epoch=6 * model.num_parameters() * int(train_dataset.lengths.sum()) if settings['max_flos'] else 0
+        )
+        trainer.add_callback(budget)
+        
+        checkpoint = None
+        if resume and os.path.isdir(output_dir):
+            checkpoint = get_last_checkpoint(output_dir)
+            if checkpoint:
+                print(f"Resuming {model_name} from {checkpoint}")
+        
+        with telemetry.span('trainer.train'):
+            trainer.train(resume_from_checkpoint=checkpoint)
+        
+        trainer.budget_report = budget.report
+        if budget.report:
+            report = budget.report
+            print(f"{model_name} training stopped by {report['stopped_by']} after {report['epochs']:.2f} of "
+                  f"{report['planned_epochs']:.2f} epochs (resumed at epoch {report['start_epoch']:.2f}) "
+                  f"in {report['seconds']:.0f}s, "
+                  f"about {report['seconds_saved']:.0f}s saved; best eval_loss {report['best_eval_loss']}")
+            telemetry.count(seconds_saved=report['seconds_saved'])
+        
+        print(f"Training completed. Saving model...")
+        with telemetry.span('save'):
             model_save_path = os.path.join(output_dir, f"best_{model_name}")
             trainer.save_model(model_save_path)
             tokenizer.save_pretrained(model_save_path)
-            
-            return trainer
-            
-        except Exception as e:
-            print(f"Error during training model {model_name}: {str(e)}")
-            return None
+        
+        return trainer
 
     def cleanup(self):
         """Clean up GPU memory"""
-        for model in self.models.values():
-            model.cpu()
-        self.models.clear()
-        self.tokenizers.clear()
+        for name in list(self._loaded_models):
+            self.release_model(name)
+        self.model_configs.clear()
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
         gc.collect()
\ No newline at end of file
@@ -0,0 +1,397 @@
+import os
+import re
+import json
+import mmap
+import time
+import shutil
+import argparse
+from collections import Counter
+import numpy as np
+import pandas as pd
+from data_preparation import DataPreparator
+
+# Bump when the on-disk layout of a segment changes
+INDEX_FORMAT_VERSION = 1
+
+class IndexSegment:
+    """One immutable, memory-mapped slice of the inverted index
+    
+    Postings are stored in CSR form: the sorted `terms` array and `offsets`
+    locate the postings of term i at docs[offsets[i]:offsets[i + 1]] with
+    their term frequencies in tfs. Context texts are JSON lines in
+    docs.jsonl, addressed by the byte offsets in doc_offsets.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.terms = np.load(os.path.join(path, 'terms.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+        self.docs = np.load(os.path.join(path, 'docs.npy'), mmap_mode='r')
+        self.tfs = np.load(os.path.join(path, 'tfs.npy'), mmap_mode='r')
+        self.doc_lengths = np.load(os.path.join(path, 'doc_lengths.npy'), mmap_mode='r')
+        self.doc_offsets = np.load(os.path.join(path, 'doc_offsets.npy'), mmap_mode='r')
+        with open(os.path.join(path, 'docs.jsonl'), 'rb') as f:
+            self._texts = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    def __len__(self):
+        return len(self.doc_lengths)
+    
+    def postings(self, term):
+        """Return (docs, tfs) of a term, or None if it does not occur"""
+        i = int(np.searchsorted(self.terms, term))
+        if i == len(self.terms) or self.terms[i] != term:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.docs[start:end], self.tfs[start:end]
+    
+    def document(self, doc_id):
+        """Read one stored context by its segment-local id"""
+        start, end = self.doc_offsets[doc_id], self.doc_offsets[doc_id + 1]
+        return json.loads(self._texts[start:end])
+    
+    def close(self):
+        self._texts.close()
+    
+    @staticmethod
+    def write(path, documents, tokenize):
+        """Build a segment from [{'guide_id', 'context'}, ...] and write it to path"""
+        postings = {}
+        doc_lengths = np.zeros(len(documents), dtype=np.int32)
+        for doc_id, document in enumerate(documents):
+            counts = Counter(tokenize(document['context']))
+            doc_lengths[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+        
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+        docs = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.float32)
+        for i, term in enumerate(terms):
+            entries = np.array(postings[term])
+            docs[offsets[i]:offsets[i + 1]] = entries[:, 0]
+            tfs[offsets[i]:offsets[i + 1]] = entries[:, 1]
+        
+        os.makedirs(path, exist_ok=True)
+        doc_offsets = np.zeros(len(documents) + 1, dtype=np.int64)
+        with open(os.path.join(path, 'docs.jsonl'), 'wb') as f:
+            for doc_id, document in enumerate(documents):
+                line = (json.dumps(document, ensure_ascii=False) + '\n').encode('utf-8')
+                f.write(line)
+                doc_offsets[doc_id + 1] = doc_offsets[doc_id] + len(line)
+        
+        np.save(os.path.join(path, 'terms.npy'), np.array(terms, dtype=str))
+        np.save(os.path.join(path, 'offsets.npy'), offsets)
+        np.save(os.path.join(path, 'docs.npy'), docs)
+        np.save(os.path.join(path, 'tfs.npy'), tfs)
+        np.save(os.path.join(path, 'doc_lengths.npy'), doc_lengths)
+        np.save(os.path.join(path, 'doc_offsets.npy'), doc_offsets)
+
+class BM25Index:
+    """BM25 inverted index over the context windows of the guides
+    
+    Documents are the same 3-sentence windows DataPreparator builds for its
+    QA pairs, so a retrieved context looks exactly like the contexts the
+    reader was trained on. The index is a list of segments listed in
+    manifest.json; appending guides writes a new segment and never touches
+    the existing ones. Term statistics are combined across segments at
+    query time, so compact() merges small neighbouring segments to keep the
+    number of segments, and with it the per-query cost, bounded.
+    """
+    
+    def __init__(self, index_dir, k1=1.5, b=0.75):
+        self.index_dir = index_dir
+        self.k1 = k1
+        self.b = b
+        self.preparator = DataPreparator()
+        self.segments = []
+        self.manifest = {'version': INDEX_FORMAT_VERSION, 'segments': [], 'num_guides': 0}
+        
+        manifest_path = os.path.join(index_dir, 'manifest.json')
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') != INDEX_FORMAT_VERSION:
+                raise ValueError(f"Index {index_dir} has format version {manifest.get('version')}, "
+                                 f"expected {INDEX_FORMAT_VERSION} - rebuild it")
+            self.manifest = manifest
+            self.segments = [IndexSegment(os.path.join(index_dir, name)) for name in manifest['segments']]
+        
+        self._refresh_stats()
+    
+    def __len__(self):
+        return self.num_documents
+    
+    def _refresh_stats(self):
+        self.num_documents = sum(len(segment) for segment in self.segments)
+        total_length = sum(int(segment.doc_lengths.sum()) for segment in self.segments)
+        self.avg_doc_length = total_length / self.num_documents if self.num_documents else 0.0
+    
+    def tokenize(self, text):
+        """Lowercased word tokens without stopwords"""
+        return [word for word in re.findall(r'\w+', text.lower()) if word not in self.preparator.stopwords]
+    
+    def documents_for_guides(self, texts, first_guide_id=0):
+        """Context windows of guide texts, numbered by their row in the CSV"""
+        documents = []
+        for guide_id, text in enumerate(texts, start=first_guide_id):
+            if not isinstance(text, str) or not text.strip():
+                continue
+            sentences = self.preparator.custom_sentence_split(text)
+            # Windows of short guides repeat, keep each one once
+            for context in dict.fromkeys(self.preparator.context_windows(sentences)):
+                documents.append({'guide_id': guide_id, 'context': context})
+        return documents
+    
+    def add_guides(self, texts):
+        """Index guides appended after the ones already indexed as a new segment"""
+        first_guide_id = self.manifest['num_guides']
+        documents = self.documents_for_guides(texts, first_guide_id)
+        num_guides = first_guide_id + len(texts)
+        os.makedirs(self.index_dir, exist_ok=True)
+        if not documents:
+            self.manifest['num_guides'] = num_guides
+            self._write_manifest()
+            return 0
+        
+        name, path = self._write_segment(documents)
+        
+        # The manifest is written last, it is what makes the segment visible
+        self.manifest['segments'].append(name)
+        self.manifest['num_guides'] = num_guides
+        self._write_manifest()
+        
+        self.segments.append(IndexSegment(path))
+        self._refresh_stats()
+        return len(documents)
+    
+    def _write_segment(self, documents):
+        """Write documents as a new segment directory, return (name, path)"""
+        # Names are never reused, merged segments leave gaps in the numbering
+        number = self.manifest.get('next_segment', len(self.manifest['segments']))
+        self.manifest['next_segment'] = number + 1
+        name = f"segment-{number:05d}"
+        path = os.path.join(self.index_dir, name)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        IndexSegment.write(tmp_path, documents, self.tokenize)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+        return name, path
+    
+    def compact(self, max_segments=8):
+        """Merge neighbouring segments until at most max_segments are left
+        
+        The neighbouring pair with the fewest documents is merged first, so
+        large segments are rarely rewritten. Returns the number of merges.
+        """
+        merges = 0
+        while len(self.segments) > max(1, max_segments):
+            sizes = [len(a) + len(b) for a, b in zip(self.segments, self.segments[1:])]
+            i = int(np.argmin(sizes))
+            documents = [segment.document(doc_id) for segment in self.segments[i:i + 2]
+                         for doc_id in range(len(segment))]
+            name, path = self._write_segment(documents)
+            
+            # Swap the pair for the merged segment in the manifest first
+            old_segments = self.segments[i:i + 2]
+            old_names = self.manifest['segments'][i:i + 2]
+            self.manifest['segments'][i:i + 2] = [name]
+            self._write_manifest()
+            self.segments[i:i + 2] = [IndexSegment(path)]
+            for segment, old_name in zip(old_segments, old_names):
+                segment.close()
+                shutil.rmtree(os.path.join(self.index_dir, old_name))
+            merges += 1
+        return merges
+    
+    def update_from_csv(self, csv_path, chunksize=1000, segment_guides=10000, max_segments=8):
+        """Index the guides of csv_path that are not indexed yet
+        
+        Guides are identified by their row, so this expects new guides to be
+        appended to the end of the CSV. New guides are written in segments of
+        at least `segment_guides` guides (the last one may be smaller), then
+        the index is compacted to `max_segments`. Returns the number of new
+        contexts.
+        """
+        added = 0
+        row = 0
+        pending = []
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+            texts = chunk['text'].tolist()
+            skip = max(0, self.manifest['num_guides'] + len(pending) - row)
+            pending.extend(texts[skip:])
+            row += len(texts)
+            if len(pending) >= segment_guides:
+                added += self.add_guides(pending)
+                pending = []
+        if pending:
+            added += self.add_guides(pending)
+        
+        merges = self.compact(max_segments)
+        if merges:
+            print(f"Merged {merges} pairs of index segments, {len(self.segments)} segments left")
+        return added
+    
+    def _write_manifest(self):
+        manifest_path = os.path.join(self.index_dir, 'manifest.json')
+        tmp_path = f"{manifest_path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=4)
+        os.replace(tmp_path, manifest_path)
+    
+    def search(self, query, top_k=5):
+        """Return the top_k contexts for a query as [{'guide_id', 'context', 'score'}, ...]"""
+        terms = set(self.tokenize(query))
+        if not terms or not self.num_documents:
+            return []
+        
+        # Postings of every query term in every segment, for document frequencies
+        hits = {term: [segment.postings(term) for segment in self.segments] for term in terms}
+        
+        results = []
+        for seg_idx, segment in enumerate(self.segments):
+            scores = None
+            for term, term_postings in hits.items():
+                if term_postings[seg_idx] is None:
+                    continue
+                df = sum(len(p[0]) for p in term_postings if p is not None)
+                idf = np.log(1 + (self.num_documents - df + 0.5) / (df + 0.5))
+                
+                docs, tfs = term_postings[seg_idx]
+                norm = self.k1 * (1 - self.b + self.b * segment.doc_lengths[docs] / self.avg_doc_length)
+                if scores is None:
+                    scores = np.zeros(len(segment), dtype=np.float32)
+                # A document occurs once in the postings of a term
+                scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+            
+            if scores is None:
+                continue
+            candidates = np.flatnonzero(scores)
+            if len(candidates) > top_k:
+                candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+            results.extend((float(scores[doc_id]), seg_idx, int(doc_id)) for doc_id in candidates)
+        
+        results.sort(key=lambda hit: -hit[0])
+        return [
+            {**self.segments[seg_idx].document(doc_id), 'score': score}
+            for score, seg_idx, doc_id in results[:top_k]
+        ]
+    
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+class RetrievalReader:
+    """Answer questions without a context: retrieve top-k windows, then read them
+    
+    All retrieved contexts of all questions go through the reader in one
+    batch and the highest scoring span wins.
+    """
+    
+    def __init__(self, index, evaluator, backend, tokenizer, top_k=5, max_length=384):
+        self.index = index
+        self.evaluator = evaluator
+        self.backend = backend
+        self.tokenizer = tokenizer
+        self.top_k = top_k
+        self.max_length = max_length
+    
+    def answer_questions(self, questions, contexts=None):
+        """Answer questions, retrieving contexts for those whose context is None
+        
+        Returns one {'answer', 'score', 'context', 'guide_id'} per question.
+        """
+        contexts = contexts or [None] * len(questions)
+        candidates = []
+        for question, context in zip(questions, contexts):
+            if context is not None:
+                candidates.append([{'guide_id': None, 'context': context}])
+            else:
+                candidates.append(self.index.search(question, self.top_k))
+        
+        pair_questions = [q for q, hits in zip(questions, candidates) for _ in hits]
+        pair_contexts = [hit['context'] for hits in candidates for hit in hits]
+        answers, scores = [], []
+        if pair_questions:
+            answers, scores = self.evaluator.answer_questions(
+                self.backend, self.tokenizer, pair_questions, pair_contexts,
+                max_length=self.max_length, return_scores=True
+            )
+        
+        results = []
+        pair_idx = 0
+        for hits in candidates:
+            best = {'answer': '', 'score': float('-inf'), 'context': None, 'guide_id': None}
+            for hit in hits:
+                answer, score = answers[pair_idx], scores[pair_idx]
+                pair_idx += 1
+                if answer and score > best['score']:
+                    best = {'answer': answer, 'score': score, 'context': hit['context'], 'guide_id': hit['guide_id']}
+            results.append(best)
+        return results
+    
+    def answer(self, question):
+        return self.answer_questions([question])[0]
+
+def main():
+    parser = argparse.ArgumentParser(description="BM25 retrieval index over the tourism guides")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    build_parser = subparsers.add_parser('build', help="Build the index from scratch")
+    build_parser.add_argument('--csv', default='tourism_guides.csv')
+    build_parser.add_argument('--index', default='./retrieval_index')
+    
+    update_parser = subparsers.add_parser('update', help="Index guides appended to the CSV since the last update")
+    update_parser.add_argument('--csv', default='tourism_guides.csv')
+    update_parser.add_argument('--index', default='./retrieval_index')
+    update_parser.add_argument('--max-segments', type=int, default=8,
+                               help="Merge neighbouring segments down to this many after the update")
+    
+    query_parser = subparsers.add_parser('query', help="Retrieve contexts, optionally answering with a checkpoint")
+    query_parser.add_argument('question')
+    query_parser.add_argument('--index', default='./retrieval_index')
+    query_parser.add_argument('--top-k', type=int, default=5)
+    query_parser.add_argument('--checkpoint', default=None, help="best_<model> directory to read the contexts with")
+    
+    args = parser.parse_args()
+    
+    if args.command == 'build':
+        if os.path.exists(args.index):
+            shutil.rmtree(args.index)
+        start = time.perf_counter()
+        index = BM25Index(args.index)
+        added = index.update_from_csv(args.csv)
+        print(f"Indexed {added} contexts from {index.manifest['num_guides']} guides "
+              f"in {time.perf_counter() - start:.2f}s")
+    
+    elif args.command == 'update':
+        index = BM25Index(args.index)
+        added = index.update_from_csv(args.csv, max_segments=args.max_segments)
+        print(f"Added {added} contexts, {len(index)} contexts in {len(index.segments)} segments")
+    
+    else:
+        index = BM25Index(args.index)
+        start = time.perf_counter()
+        hits = index.search(args.question, args.top_k)
+        print(f"Retrieved {len(hits)} contexts in {(time.perf_counter() - start) * 1000:.2f}ms")
+        for hit in hits:
+            print(f"[{hit['score']:.2f}] guide {hit['guide_id']}: {hit['context']}")
+        
+        if args.checkpoint:
+            from transformers import AutoModelForQuestionAnswering, AutoTokenizer
+            from evaluation import Evaluator
+            from inference_backends import TorchBackend
+            
+            evaluator = Evaluator()
+            model = AutoModelForQuestionAnswering.from_pretrained(args.checkpoint).to(evaluator.device)
+            reader = RetrievalReader(
+                index, evaluator, TorchBackend(model, evaluator.device),
+                AutoTokenizer.from_pretrained(args.checkpoint), args.top_k
+            )
+            result = reader.answer(args.question)
+            print(f"\nAnswer: {result['answer']} (guide {result['guide_id']})")
+
+if __name__ == "__main__":
+    main()
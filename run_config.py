@@ -0,0 +1,103 @@
+import json
+import copy
+from models import training_settings
+
+DEFAULT_CONFIG = {
+    'csv_path': 'tourism_guides.csv',
+    'output_dir': './output',
+    'feature_cache_dir': './feature_cache',
+    'logit_cache_dir': './logit_cache',   # None recomputes the logits of every evaluation
+    'tuning_cache': './batch_tuning.json',  # batch sizes found by training 'auto_batch', None always probes
+    'test_size': 0.2,
+    'val_size': 0.1,
+    'sample': None,          # QA pairs kept across all splits, None keeps all
+    'models': None,          # model names to run, None runs all of them
+    'checkpoints': {},       # {model: checkpoint} added to or replacing the defaults
+    'training': {},          # training settings for every model
+    'model_training': {},    # {model: training settings} for single models
+    'distill': None,         # ModelManager.distill_model options to distill the best model, None skips it
+    'ensemble': None         # EnsembleEvaluator.compare options to compare ensembles of the trained models, None skips it
+}
+
+# Named starting points, applied before the config file and the command line
+PRESETS = {
+    'smoke': {
+        'models': ['DistilBERT'],
+        'sample': 200,
+        'training': {
+            'epochs': 1,
+            'batch_size': 8,
+            'grad_accum': 1,
+            'max_length': 128,
+            'num_workers': 0
+        }
+    }
+}
+
+# Settings that change the data or the trained models, and so the run manifest
+RESULT_KEYS = ('test_size', 'val_size', 'sample', 'checkpoints', 'training', 'model_training')
+
+def merge_config(config, overrides):
+    """Return config updated with overrides, merging nested dicts one level deep"""
+    merged = copy.deepcopy(config)
+    for key, value in overrides.items():
+        if key not in DEFAULT_CONFIG:
+            raise ValueError(f"Unknown config key {key!r}")
+        if value is None:
+            continue
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = {**merged[key], **{k: v for k, v in value.items() if v is not None}}
+        else:
+            merged[key] = value
+    return merged
+
+def load_config(path=None, preset=None, overrides=None):
+    """Build the run config: defaults, then preset, then JSON file, then overrides
+    
+    Training settings in `overrides` (the command line) win over the
+    per-model settings of the preset and the file as well.
+    """
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    if preset:
+        if preset not in PRESETS:
+            raise ValueError(f"Unknown preset {preset!r}; available: {', '.join(PRESETS)}")
+        config = merge_config(config, PRESETS[preset])
+    
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            config = merge_config(config, json.load(f))
+    
+    if overrides:
+        config = merge_config(config, overrides)
+        training = {key: value for key, value in overrides.get('training', {}).items() if value is not None}
+        config['model_training'] = {
+            name: {**settings, **training} for name, settings in config['model_training'].items()
+        }
+    
+    # Fail early on misspelled settings
+    for name in config['models'] or []:
+        model_settings(config, name)
+    return config
+
+def model_settings(config, model_name):
+    """Resolved training settings of one model under a run config"""
+    return training_settings(model_name, {
+        **config['training'],
+        **config['model_training'].get(model_name, {})
+    })
+
+def result_config(config):
+    """The part of the config that run manifests are keyed by"""
+    return {key: config[key] for key in RESULT_KEYS}
+
+def sample_splits(train_data, val_data, test_data, n_examples, seed=42):
+    """Keep about n_examples QA pairs, drawn from each split in proportion to its size"""
+    total = len(train_data) + len(val_data) + len(test_data)
+    if not n_examples or n_examples >= total:
+        return train_data, val_data, test_data
+    
+    sampled = []
+    for data in (train_data, val_data, test_data):
+        n = max(1, round(n_examples * len(data) / total))
+        sampled.append(data.sample(n=min(n, len(data)), random_state=seed))
+    return tuple(sampled)
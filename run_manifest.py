@@ -0,0 +1,126 @@
+import os
+import json
+import shutil
+import hashlib
+from datetime import datetime
+import pandas as pd
+
+# Bump when a change to the pipeline makes earlier runs unusable for resuming
+PIPELINE_VERSION = 1
+
+SPLITS = ('train', 'val', 'test')
+
+def file_hash(path, block_size=1 << 20):
+    """SHA-1 of a file's contents, read in blocks"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class RunManifest:
+    """Progress of one pipeline run, stored under <output_dir>/runs/<config hash>
+    
+    The config hash covers the guides CSV contents and everything else in
+    `config`, so a rerun with the same inputs finds the manifest of the
+    interrupted run while a changed config starts a fresh one. The manifest
+    records the cached QA splits and, per model, whether it finished and
+    where its results JSON is. It is rewritten atomically on every change.
+    """
+    
+    def __init__(self, output_dir, csv_path, config):
+        self.config = {
+            'pipeline_version': PIPELINE_VERSION,
+            'csv_sha1': file_hash(csv_path),
+            **config
+        }
+        self.config_hash = hashlib.sha1(
+            json.dumps(self.config, sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()[:16]
+        self.run_dir = os.path.join(output_dir, 'runs', self.config_hash)
+        self.path = os.path.join(self.run_dir, 'manifest.json')
+        self.splits_dir = os.path.join(self.run_dir, 'splits')
+        
+        self.state = {'config_hash': self.config_hash, 'config': self.config, 'splits': None, 'models': {}}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+    
+    def save(self):
+        os.makedirs(self.run_dir, exist_ok=True)
+        tmp_path = f"{self.path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=4, default=str)
+        os.replace(tmp_path, self.path)
+    
+    def invalidate(self, stages):
+        """Forget finished stages: 'data', 'models', 'all' or single model names
+        
+        Invalidating the data also invalidates every model trained on it.
+        """
+        stages = set(stages)
+        if stages & {'all', 'data'}:
+            self.state['splits'] = None
+            if os.path.exists(self.splits_dir):
+                shutil.rmtree(self.splits_dir)
+            stages.add('models')
+        
+        for name in list(self.state['models']):
+            if 'models' in stages or name in stages:
+                del self.state['models'][name]
+        self.save()
+    
+    @staticmethod
+    def is_forced(stages, model_name):
+        """Whether `stages` (as given to invalidate) covers a model"""
+        return bool(set(stages) & {'all', 'data', 'models', model_name})
+    
+    def load_splits(self):
+        """Cached (train, val, test) DataFrames, or None if not cached"""
+        if not self.state['splits']:
+            return None
+        
+        try:
+            return tuple(
+                pd.read_json(os.path.join(self.splits_dir, f"{split}.jsonl"), lines=True)
+                for split in SPLITS
+            )
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable cached splits in {self.splits_dir}: {str(e)}")
+            return None
+    
+    def save_splits(self, train_data, val_data, test_data):
+        """Cache the QA splits and record them as done"""
+        os.makedirs(self.splits_dir, exist_ok=True)
+        for split, data in zip(SPLITS, (train_data, val_data, test_data)):
+            data.to_json(os.path.join(self.splits_dir, f"{split}.jsonl"),
+                         orient='records', lines=True, force_ascii=False)
+        
+        self.state['splits'] = {split: len(data) for split, data in zip(SPLITS, (train_data, val_data, test_data))}
+        self.save()
+    
+    def finished_models(self):
+        """Names of the models whose results were saved"""
+        return [name for name, entry in self.state['models'].items() if entry.get('status') == 'done']
+    
+    def started_models(self):
+        """Names of the models that began training under this config but did not finish"""
+        return [name for name, entry in self.state['models'].items()
+                if entry.get('status') in ('running', 'failed')]
+    
+    def load_results(self, model_name):
+        """Saved results of a finished model, or None if they are gone"""
+        entry = self.state['models'].get(model_name, {})
+        path = entry.get('results_file')
+        if entry.get('status') != 'done' or not path or not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def mark_model(self, model_name, status, results_file=None):
+        """Record a model as 'running', 'done' or 'failed'"""
+        entry = {'status': status, 'updated': datetime.now().isoformat(timespec='seconds')}
+        if results_file:
+            entry['results_file'] = results_file
+        self.state['models'][model_name] = entry
+        self.save()
@@ -0,0 +1,344 @@
+import os
+import gc
+import sys
+import logging
+import traceback
+import multiprocessing as mp
+from multiprocessing.connection import wait
+import torch
+from telemetry import telemetry
+
+# Rough peak footprint of one train+evaluate pipeline on CPU in GB
+# (fp32 weights, gradients, AdamW state and activations at the default batch sizes)
+MODEL_MEMORY_GB = {
+    'BERT': 5.0,
+    'RoBERTa': 6.0,
+    'DistilBERT': 3.0,
+    'ALBERT': 3.0,
+    'DeBERTa': 7.0
+}
+DEFAULT_MODEL_MEMORY_GB = 6.0
+
+def available_memory_gb():
+    """Available system memory in GB, or None if it cannot be determined"""
+    try:
+        import psutil
+        return psutil.virtual_memory().available / 1024 ** 3
+    except ImportError:
+        pass
+    
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 1024 ** 3
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def max_concurrency_for_memory(model_names, memory_fraction=0.8):
+    """Number of pipelines that fit in the available memory at the same time"""
+    memory = available_memory_gb()
+    if memory is None or not model_names:
+        return 1
+    
+    per_model = max(MODEL_MEMORY_GB.get(name, DEFAULT_MODEL_MEMORY_GB) for name in model_names)
+    return max(1, min(len(model_names), int(memory * memory_fraction // per_model)))
+
+def cleanup_gpu():
+    """Clean up GPU memory"""
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+        gc.collect()
+
+def run_model_pipeline(model_manager, evaluator, model_name, train_data, val_data, test_data, output_dir,
+                       resume=False, settings=None):
+    """Train and evaluate one model
+    
+    Returns {'metrics': ..., 'detailed_results': ..., 'training': ...}, or
+    None if training failed; 'training' is the TrainingBudgetCallback report
+    of when and why training stopped. The model is released from the manager afterwards either way.
+    With resume, training continues from the model's latest checkpoint.
+    `settings` are passed on to train_model; evaluation uses their
+    max_length.
+    """
+    trainer = None
+    try:
+        logging.info(f"\nProcessing model: {model_name}")
+        logging.info("=" * 50)
+        model_output_dir = os.path.join(output_dir, model_name)
+        
+        # Training phase
+        logging.info(f"Training {model_name}...")
+        with telemetry.span('train'):
+            trainer = model_manager.train_model(
+                model_name,
+                train_data,
+                val_data,
+                model_output_dir,
+                resume=resume,
+                settings=settings
+            )
+        
+        if trainer is None:
+            logging.error(f"Training failed for {model_name} - skipping evaluation")
+            return None
+        
+        # Clean up GPU memory after training
+        cleanup_gpu()
+        
+        # Evaluation phase
+        logging.info(f"Evaluating {model_name}...")
+        with telemetry.span('evaluate'):
+            model_results, detailed_results = evaluator.evaluate_model(
+                model_manager.models[model_name],
+                model_manager.tokenizers[model_name],
+                test_data,
+                max_length=(settings or {}).get('max_length', 384)
+            )
+        
+        return {
+            'metrics': model_results,
+            'detailed_results': detailed_results,
+            'training': getattr(trainer, 'budget_report', None)
+        }
+    
+    finally:
+        # Release this model before the next one is loaded; the
+        # trainer holds references to it and its optimizer state
+        trainer = None
+        model_manager.release_model(model_name)
+        cleanup_gpu()
+
+def run_distillation_pipeline(model_manager, evaluator, teacher_name, teacher_results, train_data, val_data,
+                              test_data, output_dir, distill_config=None, settings=None):
+    """Distill a trained teacher into a student, then evaluate and time both
+    
+    `distill_config` holds the keyword arguments of
+    ModelManager.distill_model (student, student_layers, temperature,
+    alpha). Returns {'metrics', 'detailed_results', 'speed', 'teacher'} for
+    the student, where speed has the latency and throughput of the teacher
+    and the student, or None if distillation failed.
+    """
+    from transformers import AutoModelForQuestionAnswering, AutoTokenizer
+    from inference_backends import TorchBackend
+    
+    trainer = None
+    teacher = None
+    try:
+        logging.info(f"\nDistilling {teacher_name} into a student model")
+        logging.info("=" * 50)
+        teacher_path = os.path.join(output_dir, teacher_name, f"best_{teacher_name}")
+        student_output_dir = os.path.join(output_dir, f"{teacher_name}-student")
+        max_length = (settings or {}).get('max_length', 384)
+        
+        with telemetry.span('train'):
+            trainer = model_manager.distill_model(
+                teacher_path,
+                train_data,
+                val_data,
+                student_output_dir,
+                settings=settings,
+                **(distill_config or {})
+            )
+        
+        if trainer is None:
+            logging.error(f"Distillation of {teacher_name} failed")
+            return None
+        cleanup_gpu()
+        
+        student = trainer.model
+        tokenizer = trainer.tokenizer
+        with telemetry.span('evaluate'):
+            metrics, detailed_results = evaluator.evaluate_model(
+                student, tokenizer, test_data, max_length=max_length
+            )
+        
+        # Time both readers the same way on the test set
+        teacher = AutoModelForQuestionAnswering.from_pretrained(teacher_path).to(evaluator.device)
+        with telemetry.span('measure_speed'):
+            speed = {
+                'teacher': evaluator.measure_speed(
+                    TorchBackend(teacher, evaluator.device), AutoTokenizer.from_pretrained(teacher_path),
+                    test_data, max_length=max_length
+                ),
+                'student': evaluator.measure_speed(
+                    TorchBackend(student, evaluator.device), tokenizer, test_data, max_length=max_length
+                )
+            }
+        
+        return {
+            'metrics': metrics,
+            'detailed_results': detailed_results,
+            'teacher': teacher_name,
+            'teacher_metrics': teacher_results['metrics'],
+            'speed': speed,
+            'training': getattr(trainer, 'budget_report', None)
+        }
+    
+    finally:
+        trainer = None
+        teacher = None
+        cleanup_gpu()
+
+def _pipeline_worker(conn, model_name, model_path, manager_kwargs, train_data, val_data, test_data,
+                     output_dir, num_threads, log_file, telemetry_options, resume, settings,
+                     evaluator_kwargs):
+    """Entry point of a scheduler worker process
+    
+    Sends ('ok', results, timing report) or ('error', message) to the parent.
+    """
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f'%(asctime)s - %(levelname)s - [{model_name}] %(message)s',
+        handlers=handlers
+    )
+    
+    try:
+        torch.set_num_threads(num_threads)
+        if telemetry_options:
+            # Traces of each worker go to their own directory
+            telemetry.configure(**dict(
+                telemetry_options,
+                trace_dir=os.path.join(telemetry_options['trace_dir'], model_name)
+            ))
+        
+        # Imported here so the parent does not pay for it when unused
+        from models import ModelManager
+        from evaluation import Evaluator
+        
+        model_manager = ModelManager(**manager_kwargs)
+        model_manager.model_configs[model_name] = model_path
+        evaluator = Evaluator(**evaluator_kwargs)
+        
+        results = run_model_pipeline(
+            model_manager, evaluator, model_name, train_data, val_data, test_data, output_dir, resume, settings
+        )
+        conn.send(('ok', results, telemetry.report() if telemetry.enabled else None))
+    
+    except Exception as e:
+        logging.error(traceback.format_exc())
+        conn.send(('error', str(e)))
+    
+    finally:
+        conn.close()
+
+class ModelScheduler:
+    """Run per-model train -> evaluate pipelines in separate worker processes
+    
+    At most `max_concurrency` workers run at once, each limited to
+    `threads_per_worker` intra-op threads. By default the concurrency is
+    derived from the available memory and the cores are split evenly. A
+    worker that raises or dies only loses its own model's results.
+    """
+    
+    def __init__(self, max_concurrency=None, threads_per_worker=None, memory_fraction=0.8):
+        self.max_concurrency = max_concurrency
+        self.threads_per_worker = threads_per_worker
+        self.memory_fraction = memory_fraction
+    
+    def telemetry_options(self):
+        """Telemetry settings of the parent, for the workers to record the same way"""
+        if not telemetry.enabled:
+            return None
+        return {
+            'enabled': True,
+            'profile_stages': sorted(telemetry.profile_stages),
+            'profiler': telemetry.profiler,
+            'trace_dir': telemetry.trace_dir
+        }
+    
+    def run(self, model_configs, train_data, val_data, test_data, output_dir, manager_kwargs=None,
+            on_result=None, resume_models=(), model_settings=None, evaluator_kwargs=None):
+        """Run every model in model_configs ({name: checkpoint}) and return {name: results}
+        
+        `on_result(name, results)` is called in the parent as soon as a
+        model finishes, in completion order. Models in `resume_models`
+        continue training from their latest checkpoint; `model_settings`
+        ({name: settings}) are passed on to run_model_pipeline and
+        `evaluator_kwargs` to the Evaluator of every worker.
+        """
+        model_names = list(model_configs)
+        max_concurrency = self.max_concurrency or max_concurrency_for_memory(
+            model_names, self.memory_fraction
+        )
+        max_concurrency = max(1, min(max_concurrency, len(model_names)))
+        threads = self.threads_per_worker or max(1, (os.cpu_count() or 1) // max_concurrency)
+        logging.info(f"Scheduling {len(model_names)} models with {max_concurrency} concurrent "
+                     f"workers and {threads} threads per worker")
+        
+        # Workers append to the same log file as the parent
+        log_file = next((h.baseFilename for h in logging.getLogger().handlers
+                         if isinstance(h, logging.FileHandler)), None)
+        
+        ctx = mp.get_context('spawn')
+        pending = list(model_names)
+        running = {}
+        results = {}
+        
+        while pending or running:
+            # Fill the free worker slots
+            while pending and len(running) < max_concurrency:
+                model_name = pending.pop(0)
+                parent_conn, child_conn = ctx.Pipe(duplex=False)
+                process = ctx.Process(
+                    target=_pipeline_worker,
+                    args=(child_conn, model_name, model_configs[model_name], manager_kwargs or {},
+                          train_data, val_data, test_data, output_dir, threads, log_file,
+                          self.telemetry_options(), model_name in resume_models,
+                          (model_settings or {}).get(model_name), evaluator_kwargs or {}),
+                    name=f"pipeline-{model_name}"
+                )
+                
+                # OpenMP reads its thread count when the worker imports torch
+                previous = os.environ.get('OMP_NUM_THREADS')
+                os.environ['OMP_NUM_THREADS'] = str(threads)
+                try:
+                    process.start()
+                finally:
+                    if previous is None:
+                        os.environ.pop('OMP_NUM_THREADS', None)
+                    else:
+                        os.environ['OMP_NUM_THREADS'] = previous
+                child_conn.close()
+                
+                running[model_name] = (process, parent_conn)
+                logging.info(f"Started worker for {model_name} (pid {process.pid})")
+            
+            # Block until a worker reports or exits
+            wait([conn for _, conn in running.values()] +
+                 [process.sentinel for process, _ in running.values()])
+            
+            for model_name, (process, conn) in list(running.items()):
+                message = None
+                try:
+                    if conn.poll():
+                        message = conn.recv()
+                except EOFError:
+                    pass
+                
+                if message is None and process.is_alive():
+                    continue
+                
+                process.join()
+                conn.close()
+                del running[model_name]
+                
+                if message is None:
+                    logging.error(f"Error processing model {model_name}: worker exited "
+                                  f"with code {process.exitcode}")
+                elif message[0] == 'error':
+                    logging.error(f"Error processing model {model_name}: {message[1]}")
+                elif message[1] is not None:
+                    # The worker's spans go under this model in the parent's report
+                    telemetry.attach(model_name, message[2])
+                    results[model_name] = message[1]
+                    if on_result is not None:
+                        # A failing callback must not leave the other workers unjoined
+                        try:
+                            on_result(model_name, message[1])
+                        except Exception as e:
+                            logging.error(f"Error handling results of {model_name}: {str(e)}")
+                            logging.error(traceback.format_exc())
+        
+        # Keep the registration order for the comparative table
+        return {name: results[name] for name in model_names if name in results}
@@ -0,0 +1,279 @@
+import os
+import sys
+import json
+import time
+import cProfile
+from contextlib import contextmanager
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None if unknown"""
+    try:
+        import resource
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        pass
+    
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1024 ** 2
+    except (ImportError, AttributeError):
+        return None
+
+def current_rss_mb():
+    """Current resident set size of this process in MB, or None if unknown"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 ** 2
+    except ImportError:
+        pass
+    
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def peak_cuda_mb():
+    """Peak CUDA memory allocated by torch in MB, or None without CUDA"""
+    torch = sys.modules.get('torch')
+    if torch is None or not torch.cuda.is_available():
+        return None
+    return torch.cuda.max_memory_allocated() / 1024 ** 2
+
+class Span:
+    """Timing record of one named stage and its nested stages
+    
+    Entering a span with the same name under the same parent again adds to
+    the existing record, so per-batch spans aggregate into one entry with a
+    call count.
+    """
+    
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.counters = {}
+        self.children = {}
+        self.peak_rss_mb = None
+        self.rss_growth_mb = 0.0
+        self.peak_cuda_mb = None
+        self._started = None
+    
+    def child(self, name):
+        if name not in self.children:
+            self.children[name] = Span(name)
+        return self.children[name]
+    
+    def count(self, **counters):
+        """Add to the counters of this span"""
+        for name, value in counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+    
+    def to_dict(self):
+        report = {
+            'calls': self.calls,
+            'seconds': self.seconds,
+            'peak_rss_mb': self.peak_rss_mb,
+            'rss_growth_mb': self.rss_growth_mb,
+            'peak_cuda_mb': self.peak_cuda_mb,
+            'counters': dict(self.counters)
+        }
+        
+        # Derived rates
+        if self.seconds > 0:
+            for counter in ('examples', 'tokens'):
+                if counter in self.counters:
+                    report[f"{counter}_per_sec"] = self.counters[counter] / self.seconds
+        if self.counters.get('padded_tokens'):
+            report['pad_ratio'] = 1 - self.counters.get('tokens', 0) / self.counters['padded_tokens']
+        
+        if self.children:
+            report['children'] = {name: child.to_dict() for name, child in self.children.items()}
+        return report
+    
+    @classmethod
+    def from_dict(cls, name, report):
+        span = cls(name)
+        span.calls = report['calls']
+        span.seconds = report['seconds']
+        span.peak_rss_mb = report['peak_rss_mb']
+        span.rss_growth_mb = report['rss_growth_mb']
+        span.peak_cuda_mb = report['peak_cuda_mb']
+        span.counters = dict(report['counters'])
+        span.children = {
+            child_name: cls.from_dict(child_name, child)
+            for child_name, child in report.get('children', {}).items()
+        }
+        return span
+
+class _NullSpan:
+    """Stand-in yielded by disabled spans, counting is a no-op"""
+    
+    def count(self, **counters):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class Telemetry:
+    """Nested stage timers with counters, peak memory and optional profiling
+    
+    Disabled by default, in which case spans cost one attribute check. Use
+    the module-level `telemetry` instance and configure() it once at startup
+    so every module records into the same tree:
+        
+        with telemetry.span('evaluate') as span:
+            span.count(examples=len(batch))
+    
+    Spans named in `profile_stages` are also profiled with cProfile
+    (`<span path>.prof`) or torch.profiler (`<span path>-<call>.json` Chrome
+    traces) into trace_dir.
+    """
+    
+    def __init__(self):
+        self.configure()
+    
+    def configure(self, enabled=False, profile_stages=(), profiler='cprofile', trace_dir='./traces'):
+        if profiler not in ('cprofile', 'torch'):
+            raise ValueError(f"Unknown profiler {profiler!r}, expected 'cprofile' or 'torch'")
+        self.enabled = enabled
+        self.profile_stages = set(profile_stages)
+        self.profiler = profiler
+        self.trace_dir = trace_dir
+        self.root = Span('run')
+        self._stack = [self.root]
+        self._start = time.perf_counter()
+        self._profiling = False
+        self._profiles = {}
+    
+    @property
+    def current(self):
+        """The innermost open span"""
+        return self._stack[-1]
+    
+    def begin(self, name):
+        """Open a span, for stages that cannot use the span() context manager"""
+        span = self.current.child(name)
+        self._stack.append(span)
+        span.calls += 1
+        span._started = (time.perf_counter(), peak_rss_mb())
+        return span
+    
+    def end(self, name):
+        """Close the span `name`, and any spans left open inside it"""
+        if all(span.name != name for span in self._stack[1:]):
+            raise RuntimeError(f"Closing span {name!r} which is not open")
+        
+        while True:
+            span = self._stack.pop()
+            started, rss_before = span._started
+            span.seconds += time.perf_counter() - started
+            span.peak_rss_mb = peak_rss_mb()
+            if rss_before is not None and span.peak_rss_mb is not None:
+                span.rss_growth_mb += span.peak_rss_mb - rss_before
+            span.peak_cuda_mb = peak_cuda_mb()
+            if span.name == name:
+                return span
+    
+    @contextmanager
+    def span(self, name, **counters):
+        """Time a stage nested in the current one; yields the span for counting"""
+        if not self.enabled:
+            yield _NULL_SPAN
+            return
+        
+        span = self.begin(name)
+        span.count(**counters)
+        try:
+            if name in self.profile_stages and not self._profiling:
+                with self._profile(name):
+                    yield span
+            else:
+                yield span
+        finally:
+            self.end(name)
+    
+    def count(self, **counters):
+        """Add to the counters of the current span"""
+        if self.enabled:
+            self.current.count(**counters)
+    
+    @contextmanager
+    def _profile(self, name):
+        # Files are named by the span path, e.g. BERT.evaluate.forward
+        name = '.'.join(span.name for span in self._stack[1:])
+        os.makedirs(self.trace_dir, exist_ok=True)
+        self._profiling = True
+        try:
+            if self.profiler == 'torch':
+                import torch
+                
+                activities = [torch.profiler.ProfilerActivity.CPU]
+                if torch.cuda.is_available():
+                    activities.append(torch.profiler.ProfilerActivity.CUDA)
+                with torch.profiler.profile(activities=activities, record_shapes=True) as profile:
+                    yield
+                # One trace per call
+                path = os.path.join(self.trace_dir, f"{name}-{self.current.calls}.json")
+                profile.export_chrome_trace(path)
+            else:
+                # Calls of the same stage accumulate into one profile
+                first_call = name not in self._profiles
+                profile = self._profiles.setdefault(name, cProfile.Profile())
+                profile.enable()
+                try:
+                    yield
+                finally:
+                    profile.disable()
+                path = os.path.join(self.trace_dir, f"{name}.prof")
+                profile.dump_stats(path)
+                if not first_call:
+                    return
+            print(f"Profile of {name} saved to {path}")
+        finally:
+            self._profiling = False
+    
+    def attach(self, name, report):
+        """Add a report recorded in another process as a child of the current span"""
+        if self.enabled and report is not None:
+            self.current.children[name] = Span.from_dict(name, report)
+    
+    def report(self):
+        """The span tree as nested dicts, with the run's total wall time"""
+        self.root.seconds = time.perf_counter() - self._start
+        self.root.calls = 1
+        self.root.peak_rss_mb = peak_rss_mb()
+        self.root.peak_cuda_mb = peak_cuda_mb()
+        return self.root.to_dict()
+    
+    def save(self, path):
+        """Write the timing report as JSON"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=4)
+        return path
+    
+    def summary_lines(self):
+        """Indented one-line-per-span summary of the report"""
+        lines = []
+        
+        def visit(name, report, depth):
+            line = f"{'  ' * depth}{name}: {report['seconds']:.2f}s"
+            if report['calls'] > 1:
+                line += f" ({report['calls']} calls)"
+            for rate in ('examples_per_sec', 'tokens_per_sec'):
+                if rate in report:
+                    line += f", {report[rate]:.1f} {rate.replace('_per_sec', '')}/s"
+            if 'pad_ratio' in report:
+                line += f", pad {report['pad_ratio']:.1%}"
+            if report['peak_rss_mb'] is not None:
+                line += f", peak RSS {report['peak_rss_mb']:.0f} MB"
+            lines.append(line)
+            for child_name, child in report.get('children', {}).items():
+                visit(child_name, child, depth + 1)
+        
+        visit(self.root.name, self.report(), 0)
+        return lines
+
+# Shared instance every module records into
+telemetry = Telemetry()
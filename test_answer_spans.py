@@ -0,0 +1,105 @@
+"""Regression tests for the answer span locator of QADataset
+
+The reference functions below are the nested-loop implementations that
+QADataset.find_answer_span and the token mapping of QADataset.__getitem__
+used before they were rewritten.
+"""
+import pytest
+
+np = pytest.importorskip('numpy')
+torch = pytest.importorskip('torch')
+pytest.importorskip('transformers')
+
+from nltk.corpus import stopwords
+from models import QADataset
+
+def make_dataset():
+    dataset = QADataset.__new__(QADataset)
+    dataset.stopwords = set(stopwords.words('english'))
+    return dataset
+
+def reference_find_answer_span(dataset, context, answer):
+    context = dataset.clean_text(context.lower())
+    answer = dataset.clean_text(answer.lower())
+    
+    start = context.find(answer)
+    if start != -1:
+        return start, start + len(answer)
+    
+    key_words = {word for word in set(answer.split())
+                 if len(word) > 3 and word not in dataset.stopwords}
+    
+    best_start = -1
+    best_end = -1
+    best_score = 0
+    min_length = float('inf')
+    words = context.split()
+    for i in range(len(words)):
+        for j in range(i + 1, min(i + 15, len(words))):
+            span = ' '.join(words[i:j])
+            matches = len(key_words & set(span.split()))
+            span_length = j - i
+            score = matches / (span_length ** 0.5)
+            if (matches >= len(key_words) * 0.5 and
+                (score > best_score or (score == best_score and span_length < min_length))):
+                span_start = context.find(span)
+                if span_start != -1:
+                    best_score = score
+                    min_length = span_length
+                    best_start = span_start
+                    best_end = span_start + len(span)
+    
+    return (best_start, best_end) if best_start != -1 else (0, 1)
+
+def reference_char_to_token_span(offset_mapping, answer_start, answer_end):
+    start_token = 0
+    end_token = 0
+    for idx, (start, end) in enumerate(offset_mapping):
+        if start <= answer_start <= end:
+            start_token = idx
+        if start <= answer_end <= end:
+            end_token = idx
+            break
+    return start_token, end_token
+
+@pytest.mark.parametrize('context, answer, expected', [
+    # Exact match
+    ("The Old Town is home to the Cathedral of St. Mark.", "cathedral of St. Mark", (28, 49)),
+    # Shortest window holding most key words
+    ("Visitors love the medieval fortress above the harbour, and the fortress walls offer a scenic view.",
+     "The medieval fortress overlooks the harbour", (18, 35)),
+    # No key words, the first word
+    ("Open all year round.", "to the", (0, 4)),
+    ("", "museum tickets", (0, 1)),
+])
+def test_find_answer_span_matches_reference(context, answer, expected):
+    dataset = make_dataset()
+    assert dataset.find_answer_span(context, answer) == expected
+    assert reference_find_answer_span(dataset, context, answer) == expected
+
+def test_find_answer_span_includes_last_word():
+    # The reference never tried windows holding the last word of the context
+    dataset = make_dataset()
+    context, answer = "Boats leave from the harbour at dawn", "harbour dawn trips"
+    assert dataset.find_answer_span(context, answer) == (21, 36)
+    assert reference_find_answer_span(dataset, context, answer) == (0, 1)
+
+def test_find_answer_span_returns_word_offsets():
+    # The reference re-searched the span text and landed inside "museums"
+    dataset = make_dataset()
+    context, answer = "The museums list includes the museum shop shelves", "museum tickets"
+    assert dataset.find_answer_span(context, answer) == (30, 36)
+    assert reference_find_answer_span(dataset, context, answer) == (4, 10)
+
+def test_char_to_token_span_matches_reference():
+    dataset = make_dataset()
+    rng = np.random.RandomState(0)
+    for _ in range(200):
+        # Contiguous word tokens with single spaces, some special (0, 0) tokens first
+        lengths = rng.randint(1, 8, size=rng.randint(1, 30))
+        starts = np.concatenate([[0], np.cumsum(lengths + 1)[:-1]])
+        offsets = np.concatenate([np.zeros((2, 2), dtype=np.int64), np.stack([starts, starts + lengths], axis=1)])
+        answer_start = rng.randint(0, offsets[-1, 1] + 1)
+        answer_end = rng.randint(answer_start, offsets[-1, 1] + 2)
+        assert (dataset.char_to_token_span(offsets, answer_start, answer_end) ==
+                reference_char_to_token_span(offsets, answer_start, answer_end))
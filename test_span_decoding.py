@@ -0,0 +1,72 @@
+"""Regression tests for the batched span decoder of Evaluator
+
+reference_find_best_answer is the nested-loop Evaluator.find_best_answer
+that find_best_answers replaced.
+"""
+import pytest
+
+np = pytest.importorskip('numpy')
+torch = pytest.importorskip('torch')
+pytest.importorskip('transformers')
+
+from evaluation import Evaluator
+
+# Id 0 and 3 are special tokens, dropped when decoding
+WORDS = ['[CLS]', 'where', 'is', '[SEP]', 'the', 'old', 'harbour', 'boats', 'leave', 'at', 'dawn', 'what', '?']
+
+class WordTokenizer:
+    def decode(self, ids, skip_special_tokens=True):
+        return ' '.join(WORDS[i] for i in ids if not (skip_special_tokens and i in (0, 3)))
+
+def reference_find_best_answer(start_logits, end_logits, input_ids, tokenizer, max_answer_length=50):
+    start_idx = np.argsort(start_logits)[-20:][::-1]
+    end_idx = np.argsort(end_logits)[-20:][::-1]
+    
+    best_score = float('-inf')
+    best_answer = ""
+    for start in start_idx:
+        for end in end_idx:
+            if start > end or end - start + 1 > max_answer_length:
+                continue
+            if start == 0:
+                continue
+            score = start_logits[start] + end_logits[end]
+            if score > best_score:
+                answer = tokenizer.decode(input_ids[start:end + 1], skip_special_tokens=True).strip()
+                if (len(answer.split()) >= 2 and
+                    not answer.startswith('?') and
+                    not any(answer.lower().startswith(w) for w in ['what', 'where', 'when', 'who', 'how', 'why'])):
+                    best_score = score
+                    best_answer = answer
+    return best_answer.strip()
+
+def test_find_best_answers_fixed_logits():
+    evaluator = Evaluator.__new__(Evaluator)
+    input_ids = torch.tensor([[0, 1, 2, 3, 4, 5, 6, 3]])
+    # Best pair "harbour" has one word and [CLS] may not start, so "old harbour" wins
+    start_logits = torch.tensor([[9.0, 0.0, 0.0, 0.0, 1.0, 4.0, 5.0, 0.0]])
+    end_logits = torch.tensor([[9.0, 0.0, 0.0, 0.0, 0.0, 1.0, 6.0, 0.0]])
+    answers, scores = evaluator.find_best_answers(
+        start_logits, end_logits, input_ids, WordTokenizer(), return_scores=True
+    )
+    assert answers == ['old harbour']
+    assert scores == [10.0]
+    assert evaluator.find_best_answer(start_logits, end_logits, input_ids, WordTokenizer()) == 'old harbour'
+
+def test_find_best_answers_matches_reference():
+    evaluator = Evaluator.__new__(Evaluator)
+    rng = np.random.RandomState(0)
+    for max_answer_length in (3, 50):
+        input_ids = rng.randint(0, len(WORDS), size=(16, 40))
+        start_logits = rng.randn(16, 40).astype(np.float32)
+        end_logits = rng.randn(16, 40).astype(np.float32)
+        answers = evaluator.find_best_answers(
+            torch.from_numpy(start_logits), torch.from_numpy(end_logits), torch.from_numpy(input_ids),
+            WordTokenizer(), max_answer_length=max_answer_length
+        )
+        expected = [
+            reference_find_best_answer(start_logits[row], end_logits[row], input_ids[row], WordTokenizer(),
+                                       max_answer_length)
+            for row in range(len(input_ids))
+        ]
+        assert answers == expected